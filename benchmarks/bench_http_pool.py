@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+# bench_http_pool.py — زمن النداء الواحد: requests.get عارٍ مقابل جلسة main.HTTP المشتركة
+# يشغّل خادم HTTPS محلياً (شهادة self-signed عبر openssl) بدلاً من api.bitvavo.com
+#   python benchmarks/bench_http_pool.py [N]
+
+import os, sys, ssl, json, time, tempfile, threading, subprocess, statistics, warnings
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import requests
+os.environ.setdefault("SAQER_BOOT", "0")   # بلا watchdog/leases عند القياس
+import main
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    def do_GET(self):
+        body = json.dumps({"market": "BTC-EUR", "bids": [["1", "1"]], "asks": [["2", "1"]]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers(); self.wfile.write(body)
+    def log_message(self, *a): pass
+
+def _serve():
+    d = tempfile.mkdtemp()
+    crt, key = os.path.join(d, "c.pem"), os.path.join(d, "k.pem")
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+                    "-subj", "/CN=localhost", "-keyout", key, "-out", crt],
+                   check=True, capture_output=True)
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER); ctx.load_cert_chain(crt, key)
+    srv.socket = ctx.wrap_socket(srv.socket, server_side=True)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return f"https://127.0.0.1:{srv.server_address[1]}/v2/BTC-EUR/book?depth=1"
+
+def _run(label, call, n):
+    call()  # warm-up
+    ts = []
+    for _ in range(n):
+        t0 = time.perf_counter(); call(); ts.append((time.perf_counter() - t0) * 1000.0)
+    ts.sort()
+    print(f"{label:<14} n={n}  p50={statistics.median(ts):7.3f}ms  p95={ts[int(n*0.95)-1]:7.3f}ms  mean={statistics.fmean(ts):7.3f}ms")
+
+if __name__ == "__main__":
+    warnings.filterwarnings("ignore")
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    url = _serve()
+    _run("bare requests", lambda: requests.get(url, timeout=5, verify=False).json(), n)
+    _run("main.HTTP", lambda: main.http("GET", url, timeout=5, verify=False).json(), n)
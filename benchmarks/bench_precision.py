@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+# bench_precision.py — fmt_price / fmt_amount / round_amount_down: جدول _PREC مقابل المسار المرجعي Decimal
+# يملأ MARKET_META بأسواق وهمية (لا شبكة) ويتحقق من تطابق الناتج قبل القياس
+#   python benchmarks/bench_precision.py [N]
+
+import os, sys, time, random
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("SAQER_BOOT", "0")   # بلا watchdog/leases عند القياس
+import main
+
+_METAS = {
+    "DEC-EUR": {"priceDecimals": 2, "priceSigDigits": None, "amountDecimals": 4, "step": 0.0005},
+    "SIG-EUR": {"priceDecimals": None, "priceSigDigits": 5, "amountDecimals": 8, "step": 1e-8},
+    "LOT-EUR": {"priceDecimals": None, "priceSigDigits": 6, "amountDecimals": 6, "step": 0.25},
+}
+
+def _values(n):
+    rnd = random.Random(7)
+    return [rnd.random() * 10 ** rnd.randint(-9, 6) for _ in range(n)]
+
+def _run(label, fn, vals):
+    t0 = time.perf_counter()
+    for m in _METAS:
+        for v in vals: fn(m, v)
+    dt = time.perf_counter() - t0
+    print(f"{label:<34} {dt / (len(vals) * len(_METAS)) * 1e6:7.2f} µs/call")
+    return dt
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    main.MARKET_META.update(_METAS)
+    main._PREC.update({m: main._make_prec(v) for m, v in _METAS.items()})
+    vals = _values(n)
+    pairs = [("fmt_price", "_fmt_price_dec"), ("fmt_amount", "_fmt_amount_dec"),
+             ("round_amount_down", "_round_amount_down_dec")]
+    for fast, ref in pairs:
+        f, r = getattr(main, fast), main._timed(ref, getattr(main, ref))  # نفس غلاف القياس للطرفين
+        bad = sum(1 for m in _METAS for v in vals if f(m, v) != r(m, v))
+        print(f"{fast}: mismatches={bad}")
+        a = _run(f"{fast} (_PREC)", f, vals)
+        b = _run(f"{ref} (Decimal)", r, vals)
+        print(f"  speedup ×{b / a:.2f}")
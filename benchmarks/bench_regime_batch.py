@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+# bench_regime_batch.py — نظام السوق لـ 200 سوق × 240 شمعة: regime_batch (NumPy) مقابل حلقة market_regime_batch
+# بيانات random-walk (بلا شبكة)؛ يتحقق من تطابق المخرجات قبل القياس
+#   python benchmarks/bench_regime_batch.py [MARKETS] [CANDLES]
+
+import os, sys, time, random
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import strategy_base as sb
+
+def _walks(m, t):
+    rnd = random.Random(11); H, L, C = [], [], []
+    for _ in range(m):
+        c = rnd.uniform(0.01, 50000.0); h, l, cl = [], [], []
+        for _ in range(t):
+            c *= 1 + rnd.gauss(0, 0.003)
+            cl.append(c); h.append(c * (1 + abs(rnd.gauss(0, 0.002)))); l.append(c * (1 - abs(rnd.gauss(0, 0.002))))
+        H.append(h); L.append(l); C.append(cl)
+    return H, L, C
+
+def _best(fn, n):
+    ts = []
+    for _ in range(n):
+        t0 = time.perf_counter(); fn(); ts.append(time.perf_counter() - t0)
+    return min(ts) * 1000.0
+
+if __name__ == "__main__":
+    m = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    t = int(sys.argv[2]) if len(sys.argv) > 2 else 240
+    H, L, C = _walks(m, t)
+    ref = [sb._regime_from_lists(h, l, c) for h, l, c in zip(H, L, C)]
+    if sb.np is None:
+        print("numpy غير مثبت — regime_batch يعمل بالحلقة فقط"); sys.exit(0)
+    out = sb.regime_batch(H, L, C)
+    err = {k: max(abs(float(out[k][i]) - r[k]) / max(abs(r[k]), 1e-12) for i, r in enumerate(ref)) for k in ("rsi", "atr_pct", "adx")}
+    flips = sum(bool(out["trend_up"][i]) != r["trend_up"] for i, r in enumerate(ref))
+    print(f"{m}×{t}: max rel err {err} | trend flips={flips}")
+    A = (sb.np.asarray(H), sb.np.asarray(L), sb.np.asarray(C))
+    loop = _best(lambda: [sb._regime_from_lists(h, l, c) for h, l, c in zip(H, L, C)], 3)
+    vec = _best(lambda: sb.regime_batch(*A), 20)
+    vec_l = _best(lambda: sb.regime_batch(H, L, C), 20)
+    print(f"python loop       {loop:8.2f} ms")
+    print(f"numpy (arrays)    {vec:8.2f} ms   ×{loop / vec:.0f}")
+    print(f"numpy (من lists)  {vec_l:8.2f} ms   ×{loop / vec_l:.0f}")
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+# bench_ws_dispatch.py — إطارات/ثانية في Bitvavo.websocket.on_message: السلسلة القديمة مقابل جدول التوزيع (+orjson، +مجمّع خيوط)
+# يعيد تشغيل إطارات مسجّلة (ملف: إطار JSON خام في كل سطر) أو خليطاً مولّداً book/ticker/candle بلا شبكة
+#   python benchmarks/bench_ws_dispatch.py [FRAMES_FILE|N]
+
+import os, sys, json, time, random
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from python_bitvavo_api import bitvavo as bv
+
+MARKETS = [f"C{i}-EUR" for i in range(20)]
+
+def _frames(n):
+    rnd = random.Random(5); out = []
+    for i in range(n):
+        m = rnd.choice(MARKETS); r = rnd.random()
+        if r < 0.7:
+            out.append(json.dumps({"event": "book", "market": m, "nonce": i,
+                                   "bids": [[f"{rnd.uniform(90, 100):.2f}", f"{rnd.uniform(0, 5):.4f}"] for _ in range(3)],
+                                   "asks": [[f"{rnd.uniform(100, 110):.2f}", f"{rnd.uniform(0, 5):.4f}"] for _ in range(3)]}))
+        elif r < 0.9:
+            out.append(json.dumps({"event": "ticker", "market": m, "bestBid": "99.5", "bestBidSize": "1",
+                                   "bestAsk": "100.5", "bestAskSize": "2", "lastPrice": "100"}))
+        else:
+            out.append(json.dumps({"event": "candle", "market": m, "interval": "1m",
+                                   "candle": [[int(time.time()*1000), "100", "101", "99", "100.5", "12.3"]]}))
+    return out
+
+# نسخة مختصرة من on_message السابق: تنسيق debug دائماً + json.loads + مرور خطي على الفروع (25 action قبل الأحداث)
+_LEGACY_ACTIONS = list(bv._ACTION_CALLBACKS) + ["getBook"]
+_LEGACY_EVENTS = ["authenticate", "fill", "order", "ticker", "ticker24h", "candle", "book", "trade"]
+
+def _legacy(cbs, frame):
+    bv.debugToConsole("RECEIVED: " + frame)
+    msg = json.loads(frame)
+    if "error" in msg: return
+    if "action" in msg:
+        for a in _LEGACY_ACTIONS:
+            if msg["action"] == a: return
+    elif "event" in msg:
+        for e in _LEGACY_EVENTS:
+            if msg["event"] == e:
+                if e == "book": cbs["subscriptionBookUpdate"][msg["market"]](msg)
+                elif e == "ticker": cbs["subscriptionTicker"][msg["market"]](msg)
+                elif e == "candle": cbs["subscriptionCandles"][msg["market"]][msg["interval"]](msg)
+                return
+
+def _socket(decoder, workers, sink):
+    ws = bv.Bitvavo.websocket.__new__(bv.Bitvavo.websocket)
+    ws.keepBookCopy = False; ws.localBook = {}
+    ws.callbacks = {"subscriptionBookUpdate": {m: sink for m in MARKETS}, "subscriptionTicker": {m: sink for m in MARKETS},
+                    "subscriptionCandles": {m: {"1m": sink} for m in MARKETS}}
+    ws.initDispatch(decoder, workers, 1 << 20)
+    return ws
+
+def _run(label, frames, fn, drain=None):
+    t0 = time.perf_counter()
+    for f in frames: fn(f)
+    if drain: drain()
+    dt = time.perf_counter() - t0
+    print(f"{label:<28} {len(frames)/dt:>12,.0f} frames/s")
+
+if __name__ == "__main__":
+    arg = sys.argv[1] if len(sys.argv) > 1 else "200000"
+    if os.path.isfile(arg):
+        with open(arg, encoding="utf-8") as f: frames = [l.strip() for l in f if l.strip()]
+    else:
+        frames = _frames(int(arg))
+    seen = [0]
+    def sink(msg): seen[0] += 1
+
+    ws = _socket(json.loads, 0, sink)
+    _run("legacy if/elif + json", frames, lambda f: _legacy(ws.callbacks, f))
+    _run("table + json", frames, lambda f: ws.on_message(None, f))
+    if bv.orjson is not None:
+        ws = _socket(bv.orjson.loads, 0, sink)
+        _run("table + orjson", frames, lambda f: ws.on_message(None, f))
+    else:
+        print("table + orjson               (orjson غير مثبّت)")
+    ws = _socket(None, 4, sink)
+    def drain():
+        while ws.dispatchStats()["queued"]: time.sleep(0.001)
+    _run("table + default + pool(4)", frames, lambda f: ws.on_message(None, f), drain)
+    print("pool:", ws.dispatchStats())
+    ws.pool.close()
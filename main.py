@@ -5,10 +5,14 @@
 
 __SAQER_CORE_VERSION__ = "core-1.3-sigd+tick+resetfix+stoploss"
 
-import os, json, time, hmac, hashlib, threading, requests
+import os, json, time, hmac, hashlib, threading, queue, socket, atexit, zlib, fcntl, asyncio, weakref, tempfile, requests
+from collections import OrderedDict, namedtuple, deque
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from uuid import uuid4
 from decimal import Decimal, ROUND_DOWN, getcontext
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
+from bisect import bisect_left
 from dotenv import load_dotenv
 
 # ===== تحميل أسرار فقط من .env =====
@@ -25,14 +29,74 @@ PORT = int(os.getenv("PORT","8080"))
 BASE_URL = "https://api.bitvavo.com/v2"
 MAKER_FEE_RATE = float(os.getenv("MAKER_FEE_RATE","0.001"))
 
+# شموع في الذاكرة (REST مرة ثم WebSocket candles)
+CANDLE_KEEP     = int(os.getenv("CANDLE_KEEP","300"))        # حجم الحلقة لكل (سوق، فاصل)
+CANDLE_IDLE_SEC = float(os.getenv("CANDLE_IDLE_SEC","1800")) # حلقة لم تُقرأ منذ ذلك تُحذف ويُلغى اشتراكها
+
 # مصادر الأسعار
 PRICE_SOURCE     = os.getenv("PRICE_SOURCE","redis_http").lower()  # redis_only|http_only|redis_http
 BOOK_HASH_NS     = os.getenv("BOOK_HASH_NS","saqer:book")
+BOOK_FEED          = os.getenv("BOOK_FEED","1") == "1"            # WebSocket ticker → ذاكرة
+BOOK_WRITE_THROUGH = os.getenv("BOOK_WRITE_THROUGH","0") == "1"   # نسخ التحديثات إلى BOOK_HASH_NS
+BOOK_MAX_AGE_SEC   = float(os.getenv("BOOK_MAX_AGE_SEC","30"))    # سقف عمر القيمة حتى مع بث حيّ
+WS_WORKERS         = int(os.getenv("WS_WORKERS","0"))     # >0: callbacks البث على مجمّع خيوط (ترتيب لكل سوق)؛ 0 = على خيط الاستقبال
+WS_QUEUE           = int(os.getenv("WS_QUEUE","4096"))    # سعة طابور كل عامل؛ ما يفيض يُسقط ويُعدّ
+WS_SUB_BATCH_MS    = float(os.getenv("WS_SUB_BATCH_MS","50"))  # اشتراكات تصل خلال هذه النافذة تُرسل في إطار subscribe واحد
+WS_ORDERS          = os.getenv("WS_ORDERS","0") == "1"    # place/cancel/status عبر المقبس الموثّق (requestId) مع رجوع REST
+WS_ORDER_TIMEOUT_SEC = float(os.getenv("WS_ORDER_TIMEOUT_SEC","2.5"))
 SESSION_NS       = os.getenv("SESSION_NS","saqer:sessions")
 OPEN_NS          = os.getenv("OPEN_NS","saqer:open")
 
 # تردد فحص SL/TP
 SL_CHECK_SEC     = float(os.getenv("SL_CHECK_SEC","0.8"))
+WD_RECONCILE_SEC = float(os.getenv("WD_RECONCILE_SEC","20"))  # مطابقة REST احتياطية حين يكون بث الحساب حيّاً
+
+# Telegram outbox
+TG_QUEUE_MAX    = int(os.getenv("TG_QUEUE_MAX","500"))
+TG_MIN_INTERVAL = float(os.getenv("TG_MIN_INTERVAL","1.05"))  # حدّ Telegram ~1 رسالة/ث لكل محادثة
+TG_COALESCE_SEC = float(os.getenv("TG_COALESCE_SEC","0.4"))   # نافذة ضمّ الرسائل المتتابعة
+TG_ONCE_MAX     = int(os.getenv("TG_ONCE_MAX","2048"))        # مفاتيح tg_once المحفوظة (LRU)
+
+# Ready outbox (Redis list أو ملف append-only)
+READY_OUTBOX_KEY    = os.getenv("READY_OUTBOX_KEY","saqer:outbox:ready")
+READY_OUTBOX_DIR    = os.getenv("READY_OUTBOX_DIR","ready_outbox")   # ملف outbox لكل عملية (flock) عند غياب Redis
+READY_BATCH_MAX     = int(os.getenv("READY_BATCH_MAX","1"))     # >1: {"events":[...]} بطلب واحد (يتطلب دعم الطرف الآخر)
+READY_RETRY_MAX_SEC = float(os.getenv("READY_RETRY_MAX_SEC","60"))
+
+# لقطة بيانات الأسواق (Redis و/أو ملف) + تحديث خلفي
+MARKETS_SNAPSHOT_KEY  = os.getenv("MARKETS_SNAPSHOT_KEY","saqer:markets:snapshot")
+MARKETS_SNAPSHOT_FILE = os.getenv("MARKETS_SNAPSHOT_FILE","markets_snapshot.json")
+MARKETS_REFRESH_SEC   = float(os.getenv("MARKETS_REFRESH_SEC","3600"))   # 0 = بلا تحديث خلفي
+
+# كاش حالة محلي (write-behind) أمام Redis
+STATE_CACHE   = os.getenv("STATE_CACHE","1") == "1"
+STATE_CHANNEL = os.getenv("STATE_CHANNEL","saqer:state:inval")   # pub/sub لإبطال كاش العمّال الآخرين
+STATE_WAL_DIR = os.getenv("STATE_WAL_DIR","state_wal")           # ملف WAL لكل عملية (flock)
+STATE_WAL_FSYNC = os.getenv("STATE_WAL_FSYNC","1") == "1"         # 0: flush فقط — انهيار النظام (لا العملية) قد يفقد آخر الكتابات
+
+# ملكية المواقع بين عمّال gunicorn (Redis leases)
+LEASE_NS       = os.getenv("LEASE_NS","saqer:lease")
+LEASE_TTL_SEC  = float(os.getenv("LEASE_TTL_SEC","15"))   # عامل لم ينبض خلالها = ميت؛ مواقعه تُتبنّى
+LEASE_BEAT_SEC = float(os.getenv("LEASE_BEAT_SEC","4"))
+WORKER_ID      = f"{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:6]}"
+
+# تتبّع /hook → أول أمر
+TRACE_KEEP      = int(os.getenv("TRACE_KEEP","500"))   # عدد الصفقات المحفوظة في الذاكرة
+TRACE_MAX_SPANS = int(os.getenv("TRACE_MAX_SPANS","400"))
+
+# اتصالات HTTP (pool keep-alive)
+HTTP_POOL_SIZE       = int(os.getenv("HTTP_POOL_SIZE","16"))
+HTTP_RETRIES         = int(os.getenv("HTTP_RETRIES","2"))
+HTTP_BACKOFF         = float(os.getenv("HTTP_BACKOFF","0.15"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT","3"))
+HTTP_TIMEOUT         = float(os.getenv("HTTP_TIMEOUT","10"))
+
+# ميزانية rate-limit لدى Bitvavo (نقاط وزن/دقيقة)
+RL_LIMIT          = int(os.getenv("RL_LIMIT","1000"))
+RL_RESERVE_ORDERS = int(os.getenv("RL_RESERVE_ORDERS","150"))   # محجوزة لـ place/cancel/amend فقط
+RL_RESERVE_STATUS = int(os.getenv("RL_RESERVE_STATUS","100"))   # فوقها: status/book قبل candles/trades
+RL_SLOW_FRAC      = float(os.getenv("RL_SLOW_FRAC","0.5"))      # تحتها يبدأ إبطاء الأولويات المنخفضة
+RL_MAX_PACE_SEC   = float(os.getenv("RL_MAX_PACE_SEC","1.5"))
 
 getcontext().prec = 28
 app = Flask(__name__)
@@ -44,15 +108,239 @@ try:
 except Exception:
     R = None
 
-# ===== Telegram =====
+# ===== Bitvavo SDK (WebSocket) — اختياري =====
+try:
+    from python_bitvavo_api.bitvavo import Bitvavo
+except Exception:
+    Bitvavo = None
+
+# aiohttp — اختياري: مطلوب فقط لمسار AsyncCoreAPI الأصلي
+try:
+    import aiohttp
+except Exception:
+    aiohttp = None
+
+# ===== HTTP: جلسة مشتركة keep-alive لكل نداءات REST =====
+def _make_session() -> requests.Session:
+    # retries: أخطاء الاتصال دائماً (الطلب لم يُرسل)، وأخطاء القراءة/5xx فقط لـ GET/DELETE — لا تكرار لـ POST/PUT
+    retry = Retry(total=HTTP_RETRIES, connect=HTTP_RETRIES, read=HTTP_RETRIES, status=HTTP_RETRIES,
+                  backoff_factor=HTTP_BACKOFF, status_forcelist=(502, 503, 504),
+                  allowed_methods=frozenset({"GET", "DELETE"}), raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE, max_retries=retry)
+    s = requests.Session()
+    s.mount("https://", adapter); s.mount("http://", adapter)
+    return s
+
+HTTP = _make_session()
+
+def http(method: str, url: str, timeout: float | None = None, **kw) -> requests.Response:
+    return HTTP.request(method, url, timeout=(HTTP_CONNECT_TIMEOUT, timeout or HTTP_TIMEOUT), **kw)
+
+# ===== Metrics: latency histograms لكل عملية (و لكل سوق) =====
+_LAT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+_METRICS = {}   # (op, market) -> [counts[len+1], sum_sec, n, errors, inflight]
+_MET_LOCK = threading.Lock()
+
+def _metric(op: str, market: str) -> list:
+    m = _METRICS.get((op, market))
+    if m is None:
+        with _MET_LOCK:
+            m = _METRICS.setdefault((op, market), [[0] * (len(_LAT_BUCKETS) + 1), 0.0, 0, 0, 0])
+    return m
+
+def _observe(m: list, dt: float, err: bool):
+    with _MET_LOCK:
+        m[0][bisect_left(_LAT_BUCKETS, dt)] += 1
+        m[1] += dt; m[2] += 1; m[4] -= 1
+        if err: m[3] += 1
+
+def _metric_market(a: tuple, kw: dict) -> str:
+    """تسمية السوق محدودة بـ MARKET_META (أو market= صريح): نصوص tg_send/مفاتيح tg_once لا تصبح series."""
+    mk = kw.get("market")
+    if isinstance(mk, str): return mk
+    return a[0] if (a and isinstance(a[0], str) and a[0] in MARKET_META) else ""
+
+def _timed(op: str, fn):
+    """غلاف قياس خفيف (بضع µs): inflight + histogram + errors، لكل سوق معروف."""
+    def wrapper(*a, **kw):
+        m = _metric(op, _metric_market(a, kw))
+        with _MET_LOCK: m[4] += 1
+        t0 = time.perf_counter(); err = True
+        try:
+            out = fn(*a, **kw); err = False
+            return out
+        finally:
+            dt = time.perf_counter() - t0
+            _observe(m, dt, err)
+            tr = getattr(_TLS, "trace", None)
+            if tr is not None: _trace_span(tr, op, t0, dt)
+    wrapper.__name__ = getattr(fn, "__name__", op); wrapper.__doc__ = fn.__doc__; wrapper.__wrapped__ = fn
+    return wrapper
+
+# ===== Tracing: trace لكل /hook، spans تلقائية لكل عملية CoreAPI في نفس الخيط =====
+_TRACES = OrderedDict()    # trace_id -> {"id","coin","ts","t0","spans":[[name, start_ms, dur_ms]],"marks":{}}
+_TRACE_LOCK = threading.Lock()
+_TLS = threading.local()
+
+def trace_begin(**attrs) -> str:
+    tid = uuid4().hex[:16]
+    tr = {"id": tid, "ts": time.time(), "t0": time.perf_counter(), "spans": [], "marks": {}, **attrs}
+    with _TRACE_LOCK:
+        _TRACES[tid] = tr
+        while len(_TRACES) > TRACE_KEEP: _TRACES.popitem(last=False)
+    return tid
+
+def trace_attach(tid: str | None):
+    _TLS.trace = _TRACES.get(tid) if tid else None
+
+def _trace_span(tr: dict, name: str, t0: float, dt: float):
+    if len(tr["spans"]) < TRACE_MAX_SPANS:
+        tr["spans"].append([name, round((t0 - tr["t0"]) * 1000.0, 3), round(dt * 1000.0, 3)])
+
+def trace_mark(name: str, once: bool = True):
+    """حدث لحظي (ms منذ بداية الـ trace)، مثل first_ack."""
+    tr = getattr(_TLS, "trace", None)
+    if tr is None or (once and name in tr["marks"]): return
+    tr["marks"][name] = round((time.perf_counter() - tr["t0"]) * 1000.0, 3)
+
+class span:
+    """with core.span("read_hint"): ... — لا شيء إن لم يكن هناك trace في هذا الخيط."""
+    __slots__ = ("name", "t0")
+    def __init__(self, name: str): self.name = name
+    def __enter__(self): self.t0 = time.perf_counter(); return self
+    def __exit__(self, *exc):
+        tr = getattr(_TLS, "trace", None)
+        if tr is not None: _trace_span(tr, self.name, self.t0, time.perf_counter() - self.t0)
+        return False
+
+def _run_traced(tid: str, fn, *a):
+    trace_attach(tid); trace_mark("thread_start")
+    try:
+        return fn(*a)
+    finally:
+        trace_mark("end"); trace_attach(None)
+
+def _pct(vals: list, q: float) -> float:
+    if not vals: return 0.0
+    vals = sorted(vals); return vals[min(len(vals) - 1, int(q * len(vals)))]
+
+def trace_summary() -> dict:
+    """لكل مرحلة: مجموع زمنها داخل كل صفقة → p50/p90/p99 عبر الصفقات؛ وكذلك علامات مثل first_ack."""
+    with _TRACE_LOCK: trs = list(_TRACES.values())
+    stages, marks = {}, {}
+    for tr in trs:
+        per = {}
+        for name, _, dur in list(tr["spans"]): per[name] = per.get(name, 0.0) + dur
+        for k, v in per.items(): stages.setdefault(k, []).append(v)
+        for k, v in tr["marks"].items(): marks.setdefault(k, []).append(v)
+    fmt = lambda d: {k: {"n": len(v), "p50": _pct(v, .5), "p90": _pct(v, .9), "p99": _pct(v, .99), "max": max(v)}
+                     for k, v in sorted(d.items(), key=lambda kv: -_pct(kv[1], .5))}
+    return {"traces": len(trs), "stages_ms": fmt(stages), "marks_ms": fmt(marks)}
+
+def _prom_escape(v: str) -> str:
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def metrics_text(extra: dict | None = None) -> str:
+    """Prometheus text format (0.0.4). extra: {metric_name: number} كـ gauges إضافية."""
+    with _MET_LOCK:
+        snap = sorted((k, [list(v[0]), v[1], v[2], v[3], v[4]]) for k, v in _METRICS.items())
+    lbls = [f'op="{_prom_escape(op)}",market="{_prom_escape(market)}"' for (op, market), _ in snap]
+    out = ["# TYPE saqer_op_latency_seconds histogram"]
+    for lbl, (_, (counts, tot, n, _e, _i)) in zip(lbls, snap):
+        acc = 0
+        for le, c in zip(_LAT_BUCKETS, counts):
+            acc += c; out.append(f'saqer_op_latency_seconds_bucket{{{lbl},le="{le}"}} {acc}')
+        out.append(f'saqer_op_latency_seconds_bucket{{{lbl},le="+Inf"}} {n}')
+        out.append(f"saqer_op_latency_seconds_sum{{{lbl}}} {tot:.6f}")
+        out.append(f"saqer_op_latency_seconds_count{{{lbl}}} {n}")
+    out.append("# TYPE saqer_op_errors_total counter")
+    out += [f"saqer_op_errors_total{{{lbl}}} {v[3]}" for lbl, (_, v) in zip(lbls, snap)]
+    out.append("# TYPE saqer_op_inflight gauge")
+    out += [f"saqer_op_inflight{{{lbl}}} {v[4]}" for lbl, (_, v) in zip(lbls, snap)]
+    for k, v in sorted((extra or {}).items()):
+        out.append(f"# TYPE {k} gauge"); out.append(f"{k} {float(v):g}")
+    return "\n".join(out) + "\n"
+
+# ===== Telegram: outbox غير حاجب (ضمّ + rate limit + buffer محدود) =====
+_TG_Q = queue.Queue(maxsize=TG_QUEUE_MAX)
+_TG_ONCE = OrderedDict()
+_TG_LOCK = threading.Lock()
+_TG_THREAD = None
+TG_STATS = {"queued": 0, "sent": 0, "batches": 0, "dropped": 0, "deduped": 0, "errors": 0}
+_TG_MAX_LEN = 4000  # أقل من حد Telegram (4096)
+
 def tg_send(text: str):
+    """يضع الرسالة في الطابور ويعود فوراً؛ عند الامتلاء تُسقط وتُعدّ."""
     if not BOT_TOKEN:
         print("TG:", text); return
+    _tg_start()
     try:
-        requests.post(f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage",
-                      json={"chat_id": CHAT_ID or None, "text": text}, timeout=8)
-    except Exception as e:
-        print("tg_send err:", e)
+        _TG_Q.put_nowait(str(text)); TG_STATS["queued"] += 1
+    except queue.Full:
+        TG_STATS["dropped"] += 1
+
+def tg_once(key: str, text: str, window_sec: float = 20.0):
+    now = time.time()
+    with _TG_LOCK:
+        if now - _TG_ONCE.get(key, 0.0) < window_sec:
+            TG_STATS["deduped"] += 1; return
+        _TG_ONCE[key] = now; _TG_ONCE.move_to_end(key)
+        while len(_TG_ONCE) > TG_ONCE_MAX: _TG_ONCE.popitem(last=False)
+    tg_send(text)
+
+def _tg_start():
+    global _TG_THREAD
+    if _TG_THREAD is not None: return
+    with _TG_LOCK:
+        if _TG_THREAD is None:
+            _TG_THREAD = threading.Thread(target=_tg_worker, daemon=True, name="tg-outbox"); _TG_THREAD.start()
+
+def _tg_chunks(msgs: list) -> list:
+    # رسائل متطابقة متتالية → سطر واحد (×n)، ثم دمج حتى _TG_MAX_LEN
+    merged = []
+    for m in msgs:
+        if merged and merged[-1][0] == m: merged[-1][1] += 1
+        else: merged.append([m, 1])
+    out, cur = [], ""
+    for m, n in merged:
+        part = (m if n == 1 else f"{m} (×{n})")[:_TG_MAX_LEN]
+        if cur and len(cur) + 2 + len(part) > _TG_MAX_LEN: out.append(cur); cur = ""
+        cur = f"{cur}\n\n{part}" if cur else part
+    if cur: out.append(cur)
+    return out
+
+def _tg_post(text: str) -> bool:
+    for _ in range(3):
+        try:
+            r = http("POST", f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage",
+                     json={"chat_id": CHAT_ID or None, "text": text}, timeout=8)
+            if r.status_code == 429:
+                try: wait = float(r.json().get("parameters", {}).get("retry_after", 1))
+                except Exception: wait = 1.0
+                time.sleep(min(wait, 30.0)); continue
+            return r.status_code < 400
+        except Exception as e:
+            print("tg_send err:", e); return False
+    return False
+
+def _tg_drain(msgs: list, until: float):
+    while True:
+        rem = until - time.time()
+        try: msgs.append(_TG_Q.get(timeout=rem) if rem > 0 else _TG_Q.get_nowait())
+        except queue.Empty: return
+
+def _tg_worker():
+    last = 0.0
+    while True:
+        msgs = [_TG_Q.get()]
+        _tg_drain(msgs, time.time() + TG_COALESCE_SEC)
+        for chunk in _tg_chunks(msgs):
+            wait = TG_MIN_INTERVAL - (time.time() - last)
+            if wait > 0: time.sleep(wait)
+            if _tg_post(chunk): TG_STATS["sent"] += 1
+            else: TG_STATS["errors"] += 1
+            last = time.time()
+        TG_STATS["batches"] += 1
 
 def _auth_chat(chat_id: str) -> bool:
     return (not CHAT_ID) or (str(chat_id) == str(CHAT_ID))
@@ -62,25 +350,178 @@ def _sign(ts, method, path, body=""):
     msg = f"{ts}{method}{path}{body}"
     return hmac.new(API_SECRET.encode(), msg.encode(), hashlib.sha256).hexdigest()
 
-def bv_request(method: str, path: str, body=None, timeout=10):
-    url = f"{BASE_URL}{path}"
-    ts  = str(int(time.time() * 1000))
-    m = method.upper()
-    body_str = "" if m in ("GET","DELETE") else json.dumps(body or {}, separators=(',',':'))
-    payload  = None if m in ("GET","DELETE") else (body or {})
-    headers = {
+# ===== Rate-limit governor: token bucket مشترك لكل نداءات REST =====
+PRIO_ORDER, PRIO_STATUS, PRIO_LOW = 0, 1, 2
+_PRIO_NAMES = ("order", "status", "low")
+
+class _RateGovernor:
+    """
+    ميزانية مشتركة تتزامن مع رؤوس bitvavo-ratelimit-remaining/resetat.
+    الأوامر لا تنتظر إلا عند نفاد الميزانية؛ status يترك RL_RESERVE_ORDERS؛ low يترك الاحتياطين معاً،
+    ويُبطَّأ تدريجياً حين يقل المتبقي عن RL_SLOW_FRAC بتوزيع ما تبقى على زمن النافذة.
+    """
+    def __init__(self, limit: int):
+        self.cv = threading.Condition()
+        self.limit = limit; self.remaining = limit; self.reset_at = 0.0
+        self.floors = (0, RL_RESERVE_ORDERS, RL_RESERVE_ORDERS + RL_RESERVE_STATUS)
+        self.calls = [0, 0, 0]; self.throttled = [0, 0, 0]; self.slowed = [0, 0, 0]; self.wait_ms = [0.0, 0.0, 0.0]
+        self.bans = 0
+
+    def _take(self, prio: int, weight: int) -> tuple[float, float]:
+        """تحت القفل: (0، pace) إن حُجز الوزن، وإلا (مهلة الانتظار، 0)."""
+        now = time.time()
+        if now >= self.reset_at:  # نافذة جديدة (أو لا رؤوس بعد): نافذة محلية 60s
+            self.remaining = self.limit; self.reset_at = now + 60.0
+        if self.remaining - weight < self.floors[prio]:
+            return min(1.0, max(0.05, self.reset_at - now)), 0.0
+        self.remaining -= weight; self.calls[prio] += 1
+        if prio != PRIO_ORDER and self.remaining < self.limit * RL_SLOW_FRAC:
+            return 0.0, min(RL_MAX_PACE_SEC, (self.reset_at - now) / max(1, self.remaining - self.floors[prio]))
+        return 0.0, 0.0
+
+    def acquire(self, prio: int, weight: int = 1):
+        t0 = time.time(); waited = False
+        with self.cv:
+            while True:
+                wait, pace = self._take(prio, weight)
+                if not wait: break
+                if not waited: waited = True; self.throttled[prio] += 1
+                self.cv.wait(wait)
+        if pace > 0:
+            self.slowed[prio] += 1; time.sleep(pace)
+        self.wait_ms[prio] += (time.time() - t0) * 1000.0
+
+    async def aacquire(self, prio: int, weight: int = 1):
+        # notify_all لا يوقظ coroutines: نفس الميزانية بانتظار asyncio.sleep (≤1s) بدل cv.wait
+        t0 = time.time(); waited = False
+        while True:
+            with self.cv: wait, pace = self._take(prio, weight)
+            if not wait: break
+            if not waited: waited = True; self.throttled[prio] += 1
+            await asyncio.sleep(wait)
+        if pace > 0:
+            self.slowed[prio] += 1; await asyncio.sleep(pace)
+        self.wait_ms[prio] += (time.time() - t0) * 1000.0
+
+    @staticmethod
+    def _ban_until(j) -> float | None:
+        try:
+            if int(j.get("errorCode", 0)) == 105:
+                return int(j["error"].split(" at ")[1].split(".")[0]) / 1000.0
+        except Exception:
+            pass
+        return None
+
+    def update(self, r: requests.Response):
+        h = r.headers
+        rem, rst = h.get("bitvavo-ratelimit-remaining"), h.get("bitvavo-ratelimit-resetat")
+        ban_until = None
+        if r.status_code in (403, 429):
+            try: ban_until = self._ban_until(r.json())
+            except Exception: pass
+        with self.cv:
+            try:
+                if rem is not None: self.remaining = int(rem)
+                if rst is not None: self.reset_at = int(rst) / 1000.0
+            except Exception:
+                pass
+            if ban_until:
+                self.bans += 1; self.remaining = 0; self.reset_at = max(self.reset_at, ban_until)
+            self.cv.notify_all()
+
+    def note_error(self, j: dict):
+        """خطأ من المقبس (بلا رؤوس): 105 يوقف الميزانية حتى موعد رفع الحظر كما في REST."""
+        ban_until = self._ban_until(j)
+        if not ban_until: return
+        with self.cv:
+            self.bans += 1; self.remaining = 0; self.reset_at = max(self.reset_at, ban_until)
+            self.cv.notify_all()
+
+    def snapshot(self) -> dict:
+        return {"limit": self.limit, "remaining": self.remaining, "bans": self.bans,
+                "reset_in_ms": max(0, int((self.reset_at - time.time()) * 1000)),
+                **{k: dict(zip(_PRIO_NAMES, v)) for k, v in (("calls", self.calls), ("throttled", self.throttled),
+                                                            ("slowed", self.slowed), ("wait_ms", [round(x, 1) for x in self.wait_ms]))}}
+
+RL = _RateGovernor(RL_LIMIT)
+
+def _rl_class(method: str, path: str) -> tuple[int, int]:
+    """(أولوية، وزن) لكل endpoint — الأوزان حسب جدول Bitvavo."""
+    p, _, q = path.partition("?")
+    if p == "/order" and method != "GET": return PRIO_ORDER, 1
+    if p == "/ordersOpen": return PRIO_STATUS, (1 if "market=" in q else 25)
+    if p == "/balance": return PRIO_STATUS, 5
+    if p in ("/order",) or p.endswith("/book"): return PRIO_STATUS, 1
+    if p in ("/trades", "/orders"): return PRIO_LOW, 5
+    return PRIO_LOW, 1
+
+def _bv_headers(method: str, path: str, body_str: str = "") -> dict:
+    ts = str(int(time.time() * 1000))
+    return {
         "Bitvavo-Access-Key": API_KEY,
         "Bitvavo-Access-Timestamp": ts,
-        "Bitvavo-Access-Signature": _sign(ts, m, f"/v2{path}", body_str),
+        "Bitvavo-Access-Signature": _sign(ts, method, f"/v2{path}", body_str),
         "Bitvavo-Access-Window": "10000",
         "Content-Type":"application/json",
     }
-    r = requests.request(m, url, headers=headers, json=payload, timeout=timeout)
+
+# ---- منطق REST/المقبس/الأوامر يُكتب مرة واحدة كمولّد يطلب الإدخال/الإخراج خطوةً خطوة:
+#   ("rl", prio, weight) | ("http", method, url, headers, data, timeout) | ("wait", future, timeout) | ("sleep", sec)
+# _run_flow ينفّذها متزامناً و_arun_flow (AsyncCoreAPI) بـ await — نسخة واحدة لا تنحرف
+def _run_flow(gen):
+    res = exc = None
+    while True:
+        try: op = gen.send(res) if exc is None else gen.throw(exc)
+        except StopIteration as s: return s.value
+        res = exc = None
+        try:
+            k = op[0]
+            if k == "rl": RL.acquire(op[1], op[2])
+            elif k == "http": res = http(op[1], op[2], headers=op[3], data=op[4], timeout=op[5])
+            elif k == "wait": res = op[1].result(op[2])
+            else: time.sleep(op[1])
+        except Exception as e:
+            exc = e
+
+def _bv_send_flow(method: str, path: str, body: dict | None = None, timeout=10, signed: bool = True):
+    # الجسم يُرسل كما وُقّع بالضبط (compact JSON)
+    m = method.upper()
+    body_str = json.dumps(body, separators=(',',':')) if body is not None else ""
+    yield ("rl", *_rl_class(m, path))
+    met = _metric(f"rest:{m} {_metric_path(path)}", "")
+    with _MET_LOCK: met[4] += 1
+    t0 = time.perf_counter(); err = True
+    try:
+        r = yield ("http", m, f"{BASE_URL}{path}", (_bv_headers(m, path, body_str) if signed else None),
+                   (body_str or None), timeout)
+        err = r.status_code >= 400
+    finally:
+        _observe(met, time.perf_counter() - t0, err)
+    RL.update(r)
+    return r
+
+def _bv_send(method: str, path: str, body: dict | None = None, timeout=10, signed: bool = True) -> requests.Response:
+    return _run_flow(_bv_send_flow(method, path, body, timeout, signed))
+
+def _metric_path(path: str) -> str:
+    # /BTC-EUR/book?depth=1 → /{market}/book (تسميات محدودة العدد)
+    p = path.partition("?")[0]
+    parts = p.split("/")
+    if len(parts) > 2 and "-" in parts[1]: parts[1] = "{market}"
+    return "/".join(parts)
+
+def _bv_request_flow(method: str, path: str, body=None, timeout=10):
+    m = method.upper()
+    r = yield from _bv_send_flow(m, path, None if m in ("GET","DELETE") else (body or {}), timeout)
     try: return r.json()
     except: return {"error": r.text, "status_code": r.status_code}
 
+def bv_request(method: str, path: str, body=None, timeout=10):
+    return _run_flow(_bv_request_flow(method, path, body, timeout))
+
 # ===== Meta & Precision =====
 MARKET_MAP, MARKET_META = {}, {}
+_PREC = {}   # market -> _Prec (جدول دقة ثابت يُبنى مع load_markets_once)
 
 def _count_decimals_of_step(step: float) -> int:
     s = f"{step:.16f}".rstrip("0").rstrip(".")
@@ -96,11 +537,8 @@ def _parse_amount_precision(ap, min_base_hint: float|int=0) -> tuple[int,float]:
         step=float(v); return _count_decimals_of_step(step), step
     except: return 8, 1e-8
 
-def load_markets_once():
+def _parse_markets(rows: list) -> tuple[dict, dict]:
     """يدعم pricePrecision كـ step-decimals أو significant-digits (عدد خانات)."""
-    global MARKET_MAP, MARKET_META
-    if MARKET_MAP and MARKET_META: return
-    rows = requests.get(f"{BASE_URL}/markets", timeout=10).json()
     m, meta = {}, {}
     for r in rows:
         if r.get("quote")!="EUR": continue
@@ -139,13 +577,175 @@ def load_markets_once():
             "ap_raw": ap_raw,
         }
         m[base]=market
-    MARKET_MAP, MARKET_META=m, meta
+    return m, meta
+
+# ---- لقطة الأسواق: {"ver","ts","map","meta"}؛ ver يُرفع عند تغيير شكل meta أو منطق _parse_markets
+MARKETS_SNAPSHOT_VER = 1
+MARKETS_STATS = {"source": None, "ts": 0.0, "markets": 0, "refreshes": 0, "errors": 0,
+                 "added": 0, "removed": 0, "changed": 0, "last_ms": 0.0}
+_MARKETS_LOCK = threading.Lock()
+_MARKETS_THREAD = None
+
+def _markets_swap(m: dict, meta: dict, source: str, ts: float):
+    """تبديل ذري للجداول: كل جدول كائن جديد كامل؛ MARKET_MAP آخراً لأنه بوابة الأسواق الجديدة."""
+    global MARKET_MAP, MARKET_META, _PREC
+    prec = {mk: _make_prec(v) for mk, v in meta.items()}
+    _PREC = prec; MARKET_META = meta; MARKET_MAP = m
+    MARKETS_STATS.update(source=source, ts=ts, markets=len(meta))
+
+def _snapshot_save(m: dict, meta: dict, ts: float):
+    blob = json.dumps({"ver": MARKETS_SNAPSHOT_VER, "ts": ts, "map": m, "meta": meta}, separators=(',',':'))
+    if R:
+        try: R.set(MARKETS_SNAPSHOT_KEY, blob)
+        except Exception as e: print("markets snapshot redis err:", e)
+    if MARKETS_SNAPSHOT_FILE:
+        try:
+            # ملف مؤقت فريد لكل كتابة: العمّال يحفظون اللقطة نفسها في الوقت نفسه
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(MARKETS_SNAPSHOT_FILE)), suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f: f.write(blob)
+                os.replace(tmp, MARKETS_SNAPSHOT_FILE)
+            except BaseException:
+                try: os.unlink(tmp)
+                except OSError: pass
+                raise
+        except Exception as e: print("markets snapshot file err:", e)
+
+def _snapshot_load() -> tuple[dict, str] | None:
+    """أحدث لقطة صالحة (نسخة مطابقة) من Redis أو الملف."""
+    found = []
+    if R:
+        try:
+            raw = R.get(MARKETS_SNAPSHOT_KEY)
+            if raw: found.append((json.loads(raw), "redis"))
+        except Exception as e: print("markets snapshot redis err:", e)
+    if MARKETS_SNAPSHOT_FILE:
+        try:
+            with open(MARKETS_SNAPSHOT_FILE, encoding="utf-8") as f: found.append((json.load(f), "file"))
+        except FileNotFoundError: pass
+        except Exception as e: print("markets snapshot file err:", e)
+    ok = [(d, src) for d, src in found
+          if isinstance(d, dict) and d.get("ver") == MARKETS_SNAPSHOT_VER and d.get("map") and d.get("meta")]
+    return max(ok, key=lambda x: float(x[0].get("ts") or 0)) if ok else None
+
+def markets_refresh() -> bool:
+    """جلب /markets وتبديل الجداول وحفظ اللقطة. يُستدعى من الخيط الخلفي أو عند غياب أي لقطة."""
+    t0 = time.perf_counter()
+    try:
+        m, meta = _parse_markets(_bv_send("GET", "/markets", signed=False).json())
+    except Exception as e:
+        MARKETS_STATS["errors"] += 1; print("markets refresh err:", e); return False
+    if not meta:
+        MARKETS_STATS["errors"] += 1; return False
+    old = MARKET_META; ts = time.time()
+    _markets_swap(m, meta, "rest", ts)
+    if old:
+        added = meta.keys() - old.keys(); removed = old.keys() - meta.keys()
+        changed = [k for k in meta.keys() & old.keys() if meta[k] != old[k]]
+        MARKETS_STATS.update(added=len(added), removed=len(removed), changed=len(changed))
+        if added or removed or changed:
+            print(f"markets: +{sorted(added)} -{sorted(removed)} ~{sorted(changed)}")
+    MARKETS_STATS["refreshes"] += 1
+    MARKETS_STATS["last_ms"] = round((time.perf_counter() - t0) * 1000.0, 1)
+    _snapshot_save(m, meta, ts)
+    return True
+
+def _markets_refresher():
+    while True:
+        age = time.time() - float(MARKETS_STATS["ts"] or 0)
+        time.sleep(max(1.0, MARKETS_REFRESH_SEC - age))
+        if not markets_refresh(): time.sleep(min(60.0, MARKETS_REFRESH_SEC))
+
+def _markets_start():
+    global _MARKETS_THREAD
+    if _MARKETS_THREAD is not None or MARKETS_REFRESH_SEC <= 0: return
+    with _MARKETS_LOCK:
+        if _MARKETS_THREAD is None:
+            _MARKETS_THREAD = threading.Thread(target=_markets_refresher, daemon=True, name="markets-refresh")
+            _MARKETS_THREAD.start()
+
+def _markets_boot():
+    """من boot(): تحميل اللقطة (ms) بدل الشبكة؛ التحديث في الخلفية. الاستيراد وحده لا يلمس الشبكة."""
+    snap = None if MARKET_META else _snapshot_load()   # __main__ جلب REST قبلها: لا نستبدله بلقطة أقدم
+    if snap:
+        d, src = snap
+        try: _markets_swap(d["map"], d["meta"], src, float(d.get("ts") or 0))
+        except Exception as e: print("markets snapshot err:", e)
+    _markets_start()
+
+def load_markets_once():
+    if MARKET_MAP and MARKET_META: return
+    with _MARKETS_LOCK:   # طلبات /hook المتزامنة الأولى: جلب واحد فقط
+        if MARKET_MAP and MARKET_META: return
+        markets_refresh()
+
+def markets_list() -> list:
+    return sorted(MARKET_META)
 
 def coin_to_market(coin:str)->str|None:
     load_markets_once(); return MARKET_MAP.get((coin or "").upper())
 
+# ---- جدول الدقة: كل التنسيق/التقريب بحساب صحيح على أرقام repr(float) بدل Decimal
+# price_dec/price_sig: كما في MARKET_META؛ amt_dec: خانات الكمية؛ step_units: step × 10^amt_dec (int)؛
+# tick: لأسواق الخانات العشرية فقط (لأسواق sig يتبع السعر)
+_Prec = namedtuple("_Prec", "price_dec price_sig amt_dec step_units amt_scale tick")
+
+def _make_prec(meta: dict) -> _Prec | None:
+    try:
+        dec = meta.get("priceDecimals"); sig = meta.get("priceSigDigits")
+        amt_dec = int(meta.get("amountDecimals", 8))
+        step_units = 0
+        sp = _digits(float(meta.get("step", 1e-8) or 0))
+        if sp and sp[0] == "":
+            w, f = sp[1], sp[2].rstrip("0")
+            if len(f) > amt_dec: return None   # step أدق من الخانات: المسار المرجعي فقط
+            step_units = int(w + f.ljust(amt_dec, "0"))
+        tick = float(f"1e-{int(dec)}") if isinstance(dec, int) else 0.0
+        return _Prec(dec if isinstance(dec, int) else None, sig if isinstance(sig, int) and sig > 0 else None,
+                     amt_dec, step_units, 10 ** amt_dec, tick)
+    except Exception:
+        return None
+
+def _digits(x) -> tuple[str, str, str] | None:
+    """(sign, int_digits, frac_digits) لقيمة Decimal(str(x)) الدقيقة، بلا Decimal. None لغير float/int أو inf/nan."""
+    t = type(x)
+    if t is float: s = repr(x)
+    elif t is int: s = str(x)
+    else: return None
+    sign = ""
+    if s[0] == "-": sign = "-"; s = s[1:]
+    if "e" in s:
+        mant, _, e = s.partition("e")
+        w, _, f = mant.partition(".")
+        digits = w + f; point = len(w) + int(e)
+        if point <= 0: return sign, "0", "0" * (-point) + digits
+        if point >= len(digits): return sign, digits + "0" * (point - len(digits)), ""
+        return sign, digits[:point], digits[point:]
+    if s[0] in "in": return None   # inf / nan
+    w, _, f = s.partition(".")
+    return sign, w, f
+
+def _trim(sign: str, w: str, f: str) -> str:
+    f = f.rstrip("0")
+    return f"{sign}{w}.{f}" if f else f"{sign}{w}"
+
+def _tick_for_price(price: float, sig: int) -> float:
+    p = _digits(price)
+    if p is None: return 0.0
+    _, w, f = p
+    wl = w.lstrip("0")
+    if wl: adj = len(wl) - 1
+    else:
+        fl = f.lstrip("0")
+        if not fl: return 0.0
+        adj = -(len(f) - len(fl) + 1)
+    return float(f"1e{adj - (sig - 1)}")
+
 # ---- tick آمن
-def price_tick(market: str) -> float:
+def price_tick(market: str, price: float | None = None) -> float:
+    """price: سعر مرجعي لأسواق significant-digits (يتجنّب قراءة الدفتر)."""
+    pr = _PREC.get(market)
+    if pr is not None and pr.price_dec is not None: return pr.tick
     meta = MARKET_META.get(market, {}) or {}
     dec = meta.get("priceDecimals")
     sig = meta.get("priceSigDigits")
@@ -155,21 +755,20 @@ def price_tick(market: str) -> float:
         except Exception:
             return 0.0
     try:
-        bid, ask = get_best_bid_ask(market)
-        p = bid or ask or 1.0
-        d = Decimal(str(p))
-        if d.is_zero(): return 0.0
-        exp = d.adjusted()
-        q   = Decimal(1).scaleb(exp - (int(sig) - 1)) if sig else Decimal("0")
-        return float(q) if q > 0 else 0.0
+        if not price:
+            bid, ask = get_best_bid_ask(market)
+            price = bid or ask or 1.0
+        return _tick_for_price(float(price), int(sig)) if sig else 0.0
     except Exception:
         return 0.0
 
-def price_decimals(market:str) -> int:
+def price_decimals(market:str, price: float | None = None) -> int:
+    pr = _PREC.get(market)
+    if pr is not None and pr.price_dec is not None: return pr.price_dec
     meta = MARKET_META.get(market, {}) or {}
     dec = meta.get("priceDecimals")
     if isinstance(dec, int): return dec
-    t = price_tick(market)
+    t = price_tick(market, price)
     if t <= 0: return 6
     d = Decimal(str(t)).normalize()
     try:
@@ -191,6 +790,37 @@ def _round_to_sig_digits_down(value: float | Decimal, sig: int) -> Decimal:
     return (d // quant) * quant
 
 def fmt_price(market:str, price: float|Decimal)->str:
+    pr = _PREC.get(market)
+    p = _digits(price) if pr is not None else None
+    if p is None: return _fmt_price_dec(market, price)
+    sign, w, f = p
+    if pr.price_sig:
+        digits = w + f; point = len(w)
+        nz = len(digits) - len(digits.lstrip("0"))
+        if nz == len(digits): return "0"
+        keep = digits[:nz + pr.price_sig].ljust(len(digits), "0")
+        return _trim(sign, keep[:point], keep[point:])
+    return _trim(sign, w, f[:(pr.price_dec if pr.price_dec is not None else 6)])
+
+def round_amount_down(market:str, amount: float|Decimal)->float:
+    pr = _PREC.get(market)
+    p = _digits(amount) if pr is not None else None
+    if p is None: return _round_amount_down_dec(market, amount)
+    sign, w, f = p
+    units = int(w + f[:pr.amt_dec].ljust(pr.amt_dec, "0"))
+    if pr.step_units > 0: units -= units % pr.step_units
+    v = units / pr.amt_scale
+    return -v if sign else v
+
+def fmt_amount(market:str, amount: float|Decimal)->str:
+    pr = _PREC.get(market)
+    p = _digits(amount) if pr is not None else None
+    if p is None: return _fmt_amount_dec(market, amount)
+    sign, w, f = p
+    return _trim(sign, w, f[:pr.amt_dec])
+
+# ---- المسار المرجعي (Decimal): لأسواق بلا جدول دقة أو قيم Decimal
+def _fmt_price_dec(market:str, price: float|Decimal)->str:
     meta = MARKET_META.get(market, {}) or {}
     sig = meta.get("priceSigDigits")
     dec = meta.get("priceDecimals")
@@ -210,13 +840,13 @@ def fmt_price(market:str, price: float|Decimal)->str:
         return w if not f else f"{w}.{f}"
     return s
 
-def round_amount_down(market:str, amount: float|Decimal)->float:
+def _round_amount_down_dec(market:str, amount: float|Decimal)->float:
     decs=amount_decimals(market); st=Decimal(str(step(market) or 0))
     a = Decimal(str(amount)).quantize(Decimal(10)**-decs, rounding=ROUND_DOWN)
     if st>0: a=(a//st)*st
     return float(a)
 
-def fmt_amount(market:str, amount: float|Decimal)->str:
+def _fmt_amount_dec(market:str, amount: float|Decimal)->str:
     q = Decimal(10)**-amount_decimals(market)
     s = f"{(Decimal(str(amount))).quantize(q, rounding=ROUND_DOWN):f}"
     if "." in s:
@@ -224,8 +854,238 @@ def fmt_amount(market:str, amount: float|Decimal)->str:
         return w if not f else f"{w}.{f}"
     return s
 
-# ===== دفتر أوامر (Redis→HTTP) =====
+# ===== WebSocket Book Feeder: top-of-book في الذاكرة =====
+_WS = None
+_WS_LOCK = threading.Lock()
+_BOOK = {}          # market -> [bid, ask, ts_ms, connectCount]
+_BOOK_SUBS = set()
+_BOOK_WT_TS = {}    # market -> آخر write-through (ms)
+FEED_STATS = {"ticks": 0, "mem_hits": 0, "rest_fallbacks": 0}
+
+def _ws():
+    """WebSocket واحد للكور (lazy). None إن كان البث معطّلاً أو الـ SDK غير متاح."""
+    global _WS
+    if _WS is not None or not (BOOK_FEED and Bitvavo): return _WS
+    with _WS_LOCK:
+        if _WS is None:
+            try:
+                ws = Bitvavo({"APIKEY": API_KEY, "APISECRET": API_SECRET, "WSWORKERS": WS_WORKERS, "WSQUEUE": WS_QUEUE}).newWebsocket()
+                ws.setErrorCallback(lambda e: print("ws err:", e))
+                _WS = ws
+            except Exception as e:
+                print("ws init err:", e)
+    return _WS
+
+def ws_status() -> dict:
+    ws = _WS
+    if ws is None or not hasattr(ws, "dispatchStats"): return {}
+    out = ws.dispatchStats()
+    if hasattr(ws, "subscriptionStatus"): out.update({f"subs_{k}": v for k, v in ws.subscriptionStatus().items()})
+    if getattr(ws, "keepBookCopy", False): out.update({f"books_{k}": v for k, v in ws.bookStats().items()})
+    return {**out, "sub_batches": WS_SUB_STATS["batches"], "sub_items": WS_SUB_STATS["items"]}
+
+# ---- اشتراكات مجمّعة: book_watch/candles/acct_watch لا تحجب؛ خيط واحد يجمع ما يصل خلال WS_SUB_BATCH_MS
+# ويرسله عبر batchSubscriptions (إطار عام + إطار account) — مسح 200 سوق = إطار أو اثنان بدل 200
+_WS_SUB_Q = queue.Queue()
+_WS_SUB_LOCK = threading.Lock()
+_WS_SUB_THREAD = None
+WS_SUB_STATS = {"batches": 0, "items": 0}
+
+def _ws_subscribe(method: str, *args):
+    global _WS_SUB_THREAD
+    _WS_SUB_Q.put((method, args))
+    if _WS_SUB_THREAD is None:
+        with _WS_SUB_LOCK:
+            if _WS_SUB_THREAD is None:
+                _WS_SUB_THREAD = threading.Thread(target=_ws_sub_loop, daemon=True); _WS_SUB_THREAD.start()
+
+def _ws_sub_loop():
+    while True:
+        batch = [_WS_SUB_Q.get()]
+        time.sleep(WS_SUB_BATCH_MS / 1000.0)
+        while True:
+            try: batch.append(_WS_SUB_Q.get_nowait())
+            except queue.Empty: break
+        ws = _ws()
+        if ws is None: continue
+        try:
+            if hasattr(ws, "batchSubscriptions"):
+                with ws.batchSubscriptions():
+                    for method, args in batch: getattr(ws, method)(*args)
+            else:
+                for method, args in batch: getattr(ws, method)(*args)
+            WS_SUB_STATS["batches"] += 1; WS_SUB_STATS["items"] += len(batch)
+        except Exception as e:
+            print("ws subscribe err:", e)
+
+def _ws_up(ws) -> bool:
+    return bool(ws is not None and ws.open)
+
+def _on_ticker(msg: dict):
+    market = msg.get("market")
+    if not market: return
+    now_ms = int(time.time()*1000)
+    cur = _BOOK.get(market) or [0.0, 0.0, 0, -1]
+    try:
+        bid = float(msg["bestBid"]) if msg.get("bestBid") else cur[0]
+        ask = float(msg["bestAsk"]) if msg.get("bestAsk") else cur[1]
+    except Exception:
+        return
+    _BOOK[market] = [bid, ask, now_ms, _WS.connectCount if _WS else -1]
+    FEED_STATS["ticks"] += 1
+    if BOOK_WRITE_THROUGH and R and bid > 0 and ask > 0 and now_ms - _BOOK_WT_TS.get(market, 0) >= 250:
+        _BOOK_WT_TS[market] = now_ms
+        try: R.hset(f"{BOOK_HASH_NS}:{market}", mapping={"bid":str(bid),"ask":str(ask),"ts":str(now_ms)})
+        except Exception: pass
+
+def book_watch(market: str):
+    """اشتراك ticker عند الطلب (مرة لكل سوق). الإرسال مجمّعاً في خيط الاشتراكات لأن doSend ينتظر فتح المقبس."""
+    ws = _ws()
+    if ws is None or market in _BOOK_SUBS: return
+    _BOOK_SUBS.add(market)
+    _ws_subscribe("subscriptionTicker", market, _on_ticker)
+
+def _book_mem(market: str) -> tuple[float,float] | None:
+    ws = _WS
+    if not _ws_up(ws): return None
+    e = _BOOK.get(market)
+    if not e or e[0] <= 0 or e[1] <= 0: return None
+    # القيمة صالحة فقط إن جاءت من الاتصال الحالي (بعد reconnect تُعاد البذرة من REST)
+    if e[3] != ws.connectCount or (time.time()*1000 - e[2]) > BOOK_MAX_AGE_SEC*1000: return None
+    return e[0], e[1]
+
+def _book_seed(market: str, bid: float, ask: float, t_req_ms: int):
+    ws = _WS
+    if not _ws_up(ws) or market not in _BOOK_SUBS: return
+    cur = _BOOK.get(market)
+    if cur is None or cur[2] < t_req_ms or cur[3] != ws.connectCount:
+        _BOOK[market] = [bid, ask, int(time.time()*1000), ws.connectCount]
+
+def book_status() -> dict:
+    ws = _WS; now_ms = int(time.time()*1000)
+    return {"up": _ws_up(ws), "subs": len(_BOOK_SUBS), **FEED_STATS,
+            "age_ms": {m: now_ms - e[2] for m, e in list(_BOOK.items())}}
+
+# ===== Candle store: حلقة ثابتة لكل (سوق، فاصل) =====
+# بذرة REST واحدة ثم تحديثات subscriptionCandles؛ الصفوف (ts, o, h, l, c, v) من الأقدم إلى الأحدث
+_IV_MS = {"1m": 60_000, "5m": 300_000, "15m": 900_000, "30m": 1_800_000, "1h": 3_600_000, "2h": 7_200_000,
+          "4h": 14_400_000, "6h": 21_600_000, "8h": 28_800_000, "12h": 43_200_000, "1d": 86_400_000}
+_CANDLES = {}        # (market, interval) -> _CandleRing
+_CANDLE_LOCK = threading.Lock()
+_CANDLE_SWEEP = [0.0]
+CANDLE_STATS = {"hits": 0, "seeds": 0, "updates": 0, "gaps": 0, "evicted": 0}
+
+class _CandleRing:
+    __slots__ = ("rows", "conn", "used", "iv_ms", "lock", "seeding", "seeded", "short", "gap")
+    def __init__(self, iv_ms: int):
+        self.rows = deque(maxlen=CANDLE_KEEP); self.conn = -2; self.used = time.time()
+        self.iv_ms = iv_ms; self.lock = threading.Lock(); self.seeding = threading.Lock()
+        self.seeded = 0.0; self.short = False; self.gap = False
+
+    def live(self, limit: int) -> bool:
+        ws = _WS
+        if not (_ws_up(ws) and self.conn == ws.connectCount): return False
+        # فجوة: بذرة جديدة مرة في الفاصل على الأكثر (أسواق ضعيفة السيولة تفتقد شموعاً باستمرار)
+        if self.gap and time.time() - self.seeded >= self.iv_ms / 1000.0: return False
+        # REST أعاد أقل مما طُلب = تاريخ السوق كله (سوق حديث): الحلقة القصيرة كاملة
+        return self.short or len(self.rows) >= min(limit, CANDLE_KEEP)
+
+    def seed(self, data: list, conn: int, want: int):
+        rows = []
+        for r in data:
+            try: rows.append((int(r[0]), float(r[1]), float(r[2]), float(r[3]), float(r[4]), float(r[5])))
+            except Exception: continue
+        rows.sort(key=lambda x: x[0])   # REST يعيد الأحدث أولاً
+        with self.lock:
+            # ما وصل من البث أثناء الطلب أحدث من البذرة
+            live = [x for x in self.rows if rows and x[0] >= rows[-1][0]]
+            self.rows.clear(); self.rows.extend(x for x in rows if not live or x[0] < live[0][0]); self.rows.extend(live)
+            self.conn = conn; self.seeded = time.time(); self.short = len(rows) < want; self.gap = False
+
+    def push(self, row: tuple):
+        with self.lock:
+            last = self.rows[-1][0] if self.rows else None
+            if last is None or row[0] > last:
+                if last is not None and row[0] - last > self.iv_ms:
+                    self.gap = True; CANDLE_STATS["gaps"] += 1   # فجوة: أعد البذرة عند قراءة لاحقة (انظر live)
+                self.rows.append(row)
+            elif row[0] == last:
+                self.rows[-1] = row
+            else:
+                return
+        CANDLE_STATS["updates"] += 1
+
+def _on_candle(msg: dict):
+    ring = _CANDLES.get((msg.get("market"), msg.get("interval")))
+    if ring is None: return
+    for r in msg.get("candle") or []:
+        try: ring.push((int(r[0]), float(r[1]), float(r[2]), float(r[3]), float(r[4]), float(r[5])))
+        except Exception: continue
+
+def _candle_ring(market: str, interval: str) -> _CandleRing:
+    k = (market, interval)
+    ring = _CANDLES.get(k)
+    if ring is None:
+        with _CANDLE_LOCK:
+            ring = _CANDLES.get(k)
+            if ring is None:
+                ring = _CANDLES[k] = _CandleRing(_IV_MS.get(interval, 60_000))
+                if _ws() is not None:
+                    _ws_subscribe("subscriptionCandles", market, interval, _on_candle)
+    return ring
+
+def _candle_sweep():
+    now = time.time()
+    if now - _CANDLE_SWEEP[0] < 60: return
+    _CANDLE_SWEEP[0] = now
+    ws = _WS
+    for (market, interval), ring in list(_CANDLES.items()):
+        if now - ring.used < CANDLE_IDLE_SEC: continue
+        _CANDLES.pop((market, interval), None); CANDLE_STATS["evicted"] += 1
+        if ws is None: continue
+        try:
+            ws.unsubscribe("candles", market, interval)   # يحذف الـ callback أيضاً: لا إعادة اشتراك بعد reconnect
+        except Exception as e:
+            print("candle unsubscribe err:", e)
+
+def candles(market: str, interval: str = "1m", limit: int = 240) -> list:
+    """آخر limit شمعة (ts, o, h, l, c, v) من الأقدم للأحدث. REST فقط عند أول طلب أو بعد انقطاع، أو فجوة (مرة لكل فاصل)."""
+    _candle_sweep()
+    ring = _candle_ring(market, interval); ring.used = time.time()
+    if ring.live(limit):
+        CANDLE_STATS["hits"] += 1
+    else:
+        with ring.seeding:   # طلبات متزامنة (candle_watch + choose_tp): بذرة واحدة
+            if not ring.live(limit):
+                ws = _WS
+                conn = ws.connectCount if _ws_up(ws) else -2
+                want = max(limit, CANDLE_KEEP)
+                data = bv_request("GET", f"/{market}/candles?interval={interval}&limit={want}")
+                if not isinstance(data, list): return []
+                ring.seed(data, conn, want); CANDLE_STATS["seeds"] += 1
+    with ring.lock:
+        rows = list(ring.rows)
+    return rows[-limit:]
+
+def candles_peek(market: str, interval: str = "1m", limit: int = 240) -> list:
+    """مثل candles لكن من حلقة موجودة وحيّة فقط: بلا بذرة REST ولا اشتراك ولا تحديث used (للمسح الخلفي)."""
+    ring = _CANDLES.get((market, interval))
+    if ring is None or not ring.live(limit): return []
+    with ring.lock:
+        rows = list(ring.rows)
+    return rows[-limit:]
+
+def candle_watch(market: str, interval: str = "1m"):
+    """تسخين مبكر (مثلاً عند /hook): البذرة في خيط جانبي كي تكون جاهزة عند وضع TP."""
+    threading.Thread(target=candles, args=(market, interval, CANDLE_KEEP), daemon=True).start()
+
+# ===== دفتر أوامر (ذاكرة→Redis→HTTP) =====
 def get_best_bid_ask(market: str) -> tuple[float,float]:
+    book_watch(market)
+    mem = _book_mem(market)
+    if mem:
+        FEED_STATS["mem_hits"] += 1
+        return mem
     now_ms = int(time.time()*1000)
     if R and PRICE_SOURCE in ("redis_only","redis_http"):
         h = R.hgetall(f"{BOOK_HASH_NS}:{market}") or {}
@@ -235,8 +1095,10 @@ def get_best_bid_ask(market: str) -> tuple[float,float]:
                 return bid, ask
         except: pass
         if PRICE_SOURCE=="redis_only": return 0.0, 0.0
-    ob = requests.get(f"{BASE_URL}/{market}/book?depth=1", timeout=8).json()
+    FEED_STATS["rest_fallbacks"] += 1
+    ob = _bv_send("GET", f"/{market}/book?depth=1", timeout=8, signed=False).json()
     bid=float(ob["bids"][0][0]); ask=float(ob["asks"][0][0])
+    _book_seed(market, bid, ask, now_ms)
     if R:
         try: R.hset(f"{BOOK_HASH_NS}:{market}", mapping={"bid":str(bid),"ask":str(ask),"ts":str(now_ms)})
         except: pass
@@ -248,50 +1110,120 @@ def reset_state():
         tg_send("⚠️ لا يوجد Redis؛ لا شيء أمحوه.")
         return {"ok": True, "deleted": 0}
     deleted = 0
-    for ns in (SESSION_NS, OPEN_NS, BOOK_HASH_NS):
-        for key in R.scan_iter(match=f"{ns}:*"):
-            try:
-                deleted += R.delete(key) or 0
-            except Exception:
-                pass
+    with _SC_FLUSH_LOCK:   # لا كتابة write-behind بين الحذف وإسقاط المعلّق
+        _sc_reset((SESSION_NS, OPEN_NS))
+        for ns in (SESSION_NS, OPEN_NS, BOOK_HASH_NS):
+            for key in R.scan_iter(match=f"{ns}:*"):
+                try:
+                    deleted += R.delete(key) or 0
+                except Exception:
+                    pass
+    _sc_invalidate("*", None)
+    try: R.publish(STATE_CHANNEL, json.dumps({"ns": "*", "m": None, "w": WORKER_ID, "reset": [SESSION_NS, OPEN_NS]}))
+    except Exception: pass
     tg_send(f"🧹 Emergency reset — حُذف {deleted} مفتاحاً من Redis.")
     return {"ok": True, "deleted": deleted}
 
 # ===== أوامر (place / cancel / status / balance) =====
-def place_limit_postonly(market:str, side:str, price:float, amount:float):
+# ---- مسار المقبس: طلب موسوم بـ requestId → Future؛ None = لم يُرسَل أو انتهت المهلة بلا جواب → المستدعي يرجع إلى REST
+WS_ORDER_STATS = {"sent": 0, "ok": 0, "rejected": 0, "timeouts": 0, "recovered": 0, "skipped": 0}
+
+def _ws_orders():
+    ws = _ws() if WS_ORDERS else None
+    return ws if ws is not None and ws.open and ws.authenticated and hasattr(ws, "requestFuture") else None
+
+# طلبات المقبس تُحتسب من ميزانية المفتاح نفسها: نفس أولوية/وزن endpoint الـ REST المقابل
+_WS_RL_PATH = {"privateCreateOrder": ("POST", "/order"), "privateUpdateOrder": ("PUT", "/order"),
+               "privateCancelOrder": ("DELETE", "/order"), "privateGetOrder": ("GET", "/order"),
+               "privateGetOrdersOpen": ("GET", "/ordersOpen")}
+
+def _ws_rl_class(action: str, body: dict) -> tuple[int, int]:
+    method, path = _WS_RL_PATH.get(action, ("GET", ""))
+    return _rl_class(method, f"{path}?market={body['market']}" if body.get("market") else path)
+
+def _ws_order_done(fut, data=None, exc=None):
+    """نتيجة الـ Future: الجواب، أو شكل خطأ REST {"errorCode","error"} عند الرفض، أو None عند المهلة/الانقطاع."""
+    if exc is None:
+        WS_ORDER_STATS["ok"] += 1
+        return data if isinstance(data, dict) else {"response": data}
+    resp = getattr(exc, "response", None)
+    if isinstance(resp, dict):
+        WS_ORDER_STATS["rejected"] += 1; RL.note_error(resp)
+        return {"errorCode": resp.get("errorCode"), "error": resp.get("error")}
+    fut.cancel(); WS_ORDER_STATS["timeouts"] += 1
+    return None
+
+def _ws_order_flow(action: str, body: dict):
+    ws = _ws_orders()
+    if ws is None:
+        if WS_ORDERS: WS_ORDER_STATS["skipped"] += 1
+        return None
+    yield ("rl", *_ws_rl_class(action, body))
+    WS_ORDER_STATS["sent"] += 1
+    fut = ws.requestFuture({**body, "action": action}, True, WS_ORDER_TIMEOUT_SEC)
+    try: data = _ws_order_done(fut, (yield ("wait", fut, WS_ORDER_TIMEOUT_SEC)))
+    except Exception as e: data = _ws_order_done(fut, exc=e)
+    # مهلة: ربما وصل الأمر فعلاً — clientOrderId يحسم قبل إعادة الإرسال عبر REST
+    if data is None and action == "privateCreateOrder" and body.get("clientOrderId"):
+        data = yield from _order_by_client_id_flow(body["market"], body["clientOrderId"])
+        if data: WS_ORDER_STATS["recovered"] += 1
+    return data
+
+def _order_by_client_id_flow(market: str, cid: str):
+    st = yield from _bv_request_flow("GET", f"/order?market={market}&clientOrderId={cid}")
+    return st if isinstance(st, dict) and st.get("orderId") else None
+
+def _limit_body(market: str, side: str, p: float, a: float) -> dict:
+    return {
+        "market": market, "side": side, "orderType":"limit", "postOnly": True,
+        "clientOrderId": str(uuid4()),
+        "price": fmt_price(market, p),
+        "amount": fmt_amount(market, a),
+        "operatorId": ""
+    }
+
+def _limit_retry_price(market: str, side: str, price: float, err) -> float | None:
+    """سعر المحاولة الثانية بعد رفض postOnly (tick للخلف) أو دقة السعر (خانات دالّة)، وإلا None."""
+    if not isinstance(err, str): return None
+    e = err.lower()
+    if "postonly" in e or "taker" in e:
+        tick = price_tick(market, price)
+        return price - tick if side=="buy" else price + tick
+    if "price is too detailed" in e:
+        sig = MARKET_META.get(market, {}).get("priceSigDigits")
+        if isinstance(sig, int) and sig > 0:
+            return float(_round_to_sig_digits_down(price, sig))
+    return None
+
+def _client_id_dup(data) -> bool:
+    # نفس clientOrderId بعد مهلة المقبس: إن رُفض كمكرر فالأمر الأول هو القائم
+    return WS_ORDERS and isinstance(data, dict) and "clientorderid" in str(data.get("error","")).lower()
+
+def _place_limit_flow(market: str, side: str, price: float, amount: float):
     def _send(p: float, a: float):
-        body = {
-            "market": market, "side": side, "orderType":"limit", "postOnly": True,
-            "clientOrderId": str(uuid4()),
-            "price": fmt_price(market, p),
-            "amount": fmt_amount(market, a),
-            "operatorId": ""
-        }
-        ts=str(int(time.time()*1000))
-        sig=_sign(ts,"POST","/v2/order", json.dumps(body, separators=(',',':')))
-        headers={"Bitvavo-Access-Key":API_KEY,"Bitvavo-Access-Timestamp":ts,"Bitvavo-Access-Signature":sig,
-                 "Bitvavo-Access-Window":"10000","Content-Type":"application/json"}
-        r = requests.post(f"{BASE_URL}/order", headers=headers, json=body, timeout=10)
+        body = _limit_body(market, side, p, a)
+        data = yield from _ws_order_flow("privateCreateOrder", body)
+        if data is not None: return body, data
+        r = yield from _bv_send_flow("POST", "/order", body)
         try: data=r.json()
         except: data={"error": r.text}
+        if _client_id_dup(data):
+            data = (yield from _order_by_client_id_flow(market, body["clientOrderId"])) or data
         return body, data
 
-    body, resp = _send(price, amount)
+    body, resp = yield from _send(price, amount)
     err = (resp or {}).get("error", "")
+    if not err: trace_mark("first_ack")
 
-    if isinstance(err, str) and ("postonly" in err.lower() or "taker" in err.lower()):
-        tick = price_tick(market)
-        adj  = price - tick if side=="buy" else price + tick
-        return _send(adj, amount)
-
-    if isinstance(err, str) and "price is too detailed" in err.lower():
-        sig = MARKET_META.get(market, {}).get("priceSigDigits")
-        if isinstance(sig, int) and sig > 0:
-            p_adj = float(_round_to_sig_digits_down(price, sig))
-            return _send(p_adj, amount)
-
+    p_adj = _limit_retry_price(market, side, price, err)
+    if p_adj is not None:
+        body, resp = yield from _send(p_adj, amount)
+    if err and not (resp or {}).get("error"): trace_mark("first_ack")
     return body, resp
 
+def place_limit_postonly(market:str, side:str, price:float, amount:float):
+    return _run_flow(_place_limit_flow(market, side, price, amount))
+
 def place_stoploss_limit(market: str, amount: float, stop_price: float, limit_price: float):
     """
     يضع أمر StopLossLimit رسمي (سيل) — Bitvavo تتطلب operatorId.
@@ -307,70 +1239,112 @@ def place_stoploss_limit(market: str, amount: float, stop_price: float, limit_pr
         "timeInForce": "GTC",
         "operatorId": "saqer-sl"
     }
-    ts = str(int(time.time() * 1000))
-    sig = _sign(ts, "POST", "/v2/order", json.dumps(body, separators=(',',':')))
-    headers = {
-        "Bitvavo-Access-Key": API_KEY,
-        "Bitvavo-Access-Timestamp": ts,
-        "Bitvavo-Access-Signature": sig,
-        "Bitvavo-Access-Window": "10000",
-        "Content-Type": "application/json",
-    }
-    r = requests.post(f"{BASE_URL}/order", headers=headers, json=body, timeout=10)
+    r = _bv_send("POST", "/order", body)
     try:
         data = r.json()
     except:
         data = {"error": r.text}
     return body, data
 
-def cancel_order_blocking(market: str, orderId: str, wait_sec: float = 12.0):
+def _order_poll_flow(market: str, orderId: str):
+    st = yield from _ws_order_flow("privateGetOrder", {"market": market, "orderId": orderId})
+    if st is None: st = yield from _bv_request_flow("GET", f"/order?market={market}&orderId={orderId}")
+    s  = (st or {}).get("status","").lower() if isinstance(st, dict) else ""
+    return s, (st if isinstance(st, dict) else {})
+
+def _cancel_flow(market: str, orderId: str, wait_sec: float = 12.0):
     deadline = time.time() + max(wait_sec, 6.0)
-    def _poll():
-        st = bv_request("GET", f"/order?market={market}&orderId={orderId}")
-        s  = (st or {}).get("status","").lower() if isinstance(st, dict) else ""
-        return s, (st if isinstance(st, dict) else {})
     body = {"orderId": orderId, "market": market, "operatorId": ""}
-    ts   = str(int(time.time() * 1000))
-    body_str = json.dumps(body, separators=(',',':'))
-    headers = {
-        "Bitvavo-Access-Key": API_KEY,
-        "Bitvavo-Access-Timestamp": ts,
-        "Bitvavo-Access-Signature": _sign(ts, "DELETE", "/v2/order", body_str),
-        "Bitvavo-Access-Window": "10000",
-        "Content-Type": "application/json",
-    }
-    try:
-        r = requests.request("DELETE", f"{BASE_URL}/order", headers=headers, json=body, timeout=10)
-        try: _ = r.json()
-        except: pass
-    except Exception:
-        pass
-    last_s, last_st = "unknown", {}
+    if (yield from _ws_order_flow("privateCancelOrder", body)) is None:
+        try: yield from _bv_send_flow("DELETE", "/order", body)
+        except Exception:
+            pass
     while time.time() < deadline:
-        s, st = _poll()
-        last_s, last_st = s, st
+        s, st = yield from _order_poll_flow(market, orderId)
         if s in ("canceled","filled"):
             return True, s, st
-        time.sleep(0.4)
-    try: _ = bv_request("DELETE", f"/order?market={market}&orderId={orderId}")
+        yield ("sleep", 0.4)
+    try: yield from _bv_request_flow("DELETE", f"/order?market={market}&orderId={orderId}")
     except Exception:
         pass
-    s, st = _poll()
+    s, st = yield from _order_poll_flow(market, orderId)
     if s in ("canceled","filled"):
         return True, s, st
     return False, (s or "unknown"), (st or {})
 
-def order_status(market:str, orderId:str)->dict:
-    return bv_request("GET", f"/order?market={market}&orderId={orderId}") or {}
+def cancel_order_blocking(market: str, orderId: str, wait_sec: float = 12.0):
+    return _run_flow(_cancel_flow(market, orderId, wait_sec))
 
-def balance(symbol:str)->float:
-    bals=bv_request("GET","/balance")
+# ---- تعديل سعر أمر قائم (PUT /order) مع رجوع إلى cancel+place
+REPRICE_STATS = {"amend": {"n": 0, "ms": 0.0, "max_ms": 0.0},
+                 "fallback": {"n": 0, "ms": 0.0, "max_ms": 0.0}, "amend_rejected": 0}
+
+def _reprice_note(kind: str, t0: float):
+    st = REPRICE_STATS[kind]; ms = (time.perf_counter() - t0) * 1000.0
+    st["n"] += 1; st["ms"] += ms; st["max_ms"] = max(st["max_ms"], ms)
+
+def amend_order(market: str, orderId: str, side: str, price: float, amount: float, keep_amount: bool = False):
+    """
+    يعدّل أمر limit قائماً بطلب واحد (updateOrder). keep_amount=True: السعر فقط (الكمية المتبقية كما هي).
+    عند الرفض: cancel_order_blocking ثم place_limit_postonly بـ amount. يعيد (body, resp) مثل place_limit_postonly،
+    و resp["orderId"] قد يتغيّر في مسار الرجوع (وإن فشل الوضع: resp["prev_canceled"]=True). إن اكتمل الأمر قبل التعديل: {"error":"order_filled","filled":True,"order":st}.
+    """
+    t0 = time.perf_counter()
+    body = {"market": market, "orderId": orderId, "price": fmt_price(market, price), "operatorId": ""}
+    if not keep_amount: body["amount"] = fmt_amount(market, amount)
+    try:
+        r = _bv_send("PUT", "/order", body)
+        try: data = r.json()
+        except: data = {"error": r.text}
+    except Exception as e:
+        data = {"error": str(e)}
+    data = data if isinstance(data, dict) else {"error": data}
+    s = (data.get("status") or "").lower()
+    if not data.get("error") and s not in ("canceled", "rejected", "expired", "filled"):
+        _reprice_note("amend", t0)
+        return body, data
+
+    REPRICE_STATS["amend_rejected"] += 1
+    st = data
+    if s not in ("canceled", "rejected", "expired", "filled"):
+        _, s, st = cancel_order_blocking(market, orderId, wait_sec=2.5)
+    if s == "filled":
+        return None, {"error": "order_filled", "filled": True, "order": st}
+    if keep_amount:
+        try:
+            rem = float(st.get("amountRemaining") or 0)
+            if rem > 0: amount = min(amount, rem)
+        except Exception:
+            pass
+    body, resp = place_limit_postonly(market, side, price, round_amount_down(market, amount))
+    if isinstance(resp, dict) and resp.get("error"): resp["prev_canceled"] = True  # الأمر القديم لم يعد قائماً
+    _reprice_note("fallback", t0)
+    return body, resp
+
+def _order_status_flow(market: str, orderId: str):
+    return (yield from _bv_request_flow("GET", f"/order?market={market}&orderId={orderId}")) or {}
+
+def _orders_open_flow(market: str | None = None):
+    data = yield from _bv_request_flow("GET", "/ordersOpen" + (f"?market={market}" if market else ""))
+    return data if isinstance(data, list) else []
+
+def _balance_flow(symbol: str):
+    bals = yield from _bv_request_flow("GET","/balance")
     if isinstance(bals, list):
         for b in bals:
             if b.get("symbol")==symbol.upper():
                 return float(b.get("available",0) or 0.0)
     return 0.0
 
+def order_status(market:str, orderId:str)->dict:
+    return _run_flow(_order_status_flow(market, orderId))
+
+def orders_open(market: str | None = None) -> list:
+    return _run_flow(_orders_open_flow(market))
+
+def balance(symbol:str)->float:
+    return _run_flow(_balance_flow(symbol))
+
 def emergency_taker_sell(market:str, amount:float):
     bid,_=get_best_bid_ask(market)
     price=max(0.0, bid*(1-0.001))
@@ -380,11 +1354,7 @@ def emergency_taker_sell(market:str, amount:float):
         "amount": fmt_amount(market, round_amount_down(market, amount)),
         "operatorId":""
     }
-    ts=str(int(time.time()*1000))
-    sig=_sign(ts,"POST","/v2/order", json.dumps(body, separators=(',',':')))
-    headers={"Bitvavo-Access-Key":API_KEY,"Bitvavo-Access-Timestamp":ts,"Bitvavo-Access-Signature":sig,
-             "Bitvavo-Access-Window":"10000","Content-Type":"application/json"}
-    r=requests.post(f"{BASE_URL}/order", headers=headers, json=body, timeout=10)
+    r=_bv_send("POST", "/order", body)
     try: data=r.json()
     except: data={"error": r.text}
     return {"ok": not bool((data or {}).get("error")), "request": body, "response": data}
@@ -392,53 +1362,587 @@ def emergency_taker_sell(market:str, amount:float):
 # ===== State (Redis) =====
 def _key(ns, market): return f"{ns}:{market}"
 
+# ---- الحالة: كل موقع blob JSON واحد {"v": نسخة الترميز, "r": رقم المراجعة, "d": الحقول}
+# + فهرس set للأسواق النشطة ({ns}:_idx) بدل scan_iter؛ مفاتيح hash القديمة تُقرأ وتُحوَّل عند أول كتابة
+STATE_VER = 1
+STATE_CAS_RETRIES = 8
+
+def _idx(ns): return f"{ns}:_idx"
+
+def _state_decode(raw) -> tuple[dict, int]:
+    """(الحقول، المراجعة) من blob، أو من hash قديم (حقل → JSON) بمراجعة 0."""
+    if not raw: return {}, 0
+    if isinstance(raw, dict):
+        out = {}
+        for k, v in raw.items():
+            try: out[k] = json.loads(v)
+            except Exception: out[k] = v
+        return out, 0
+    try:
+        blob = json.loads(raw)
+        if isinstance(blob, dict) and blob.get("v") == STATE_VER: return dict(blob.get("d") or {}), int(blob.get("r") or 0)
+    except Exception:
+        pass
+    return {}, 0
+
+def _state_encode(d: dict, rev: int) -> str:
+    return json.dumps({"v": STATE_VER, "r": rev, "d": d}, separators=(',',':'))
+
+def _state_read(ns: str, market: str, pipe=None) -> tuple[dict, int]:
+    c = pipe if pipe is not None else R
+    key = _key(ns, market)
+    try:
+        return _state_decode(c.get(key))
+    except redis.ResponseError:   # WRONGTYPE: hash بصيغة ما قبل الـ blob
+        return _state_decode(c.hgetall(key))
+
+def _state_cas(ns: str, market: str, fn) -> dict | None:
+    """قراءة-تعديل-كتابة ذرية (WATCH/MULTI): fn(current) → dict جديد، أو None لعدم الكتابة."""
+    if not R: return None
+    key = _key(ns, market)
+    for _ in range(STATE_CAS_RETRIES):
+        with R.pipeline() as p:
+            try:
+                p.watch(key)
+                cur, rev = _state_read(ns, market, p)
+                new = fn(dict(cur))
+                if new is None: return None
+                p.multi()
+                p.set(key, _state_encode(new, rev + 1)); p.sadd(_idx(ns), market)
+                p.execute()
+                return new
+            except redis.WatchError:
+                continue
+    raise RuntimeError(f"state cas contention: {key}")
+
+def _state_clear(ns: str, market: str):
+    if not R: return
+    p = R.pipeline(); p.delete(_key(ns, market)); p.srem(_idx(ns), market); p.execute()
+
+_STATE_INDEXED = set()
+
+def _state_backfill(ns: str):
+    """مرة لكل عملية: فهرسة مفاتيح كُتبت قبل وجود الفهرس."""
+    if ns in _STATE_INDEXED: return
+    found = [k.split(":", 2)[-1] for k in R.scan_iter(match=f"{ns}:*", count=500) if k != _idx(ns)]
+    if found: R.sadd(_idx(ns), *found)
+    _STATE_INDEXED.add(ns)
+
+def _state_all(ns: str) -> dict:
+    """كل المواقع النشطة بجولتين: SMEMBERS ثم GET مجمّعة في pipeline."""
+    if not R: return {}
+    _state_backfill(ns)
+    markets = sorted(R.smembers(_idx(ns)) or ())
+    if not markets: return {}
+    p = R.pipeline(transaction=False)
+    for m in markets: p.get(_key(ns, m))
+    raws = p.execute(raise_on_error=False)
+    out, stale, legacy = {}, [], []
+    for m, raw in zip(markets, raws):
+        if isinstance(raw, redis.ResponseError): legacy.append(m)
+        elif raw is None: stale.append(m)
+        else:
+            d, _ = _state_decode(raw)
+            if d: out[m] = d
+    if legacy:
+        p = R.pipeline(transaction=False)
+        for m in legacy: p.hgetall(_key(ns, m))
+        for m, h in zip(legacy, p.execute()):
+            d, _ = _state_decode(h)
+            if d: out[m] = d
+            else: stale.append(m)
+    if stale: R.srem(_idx(ns), *stale)
+    return out
+
+# ---- كاش محلي مرجعي + كاتب واحد (write-behind):
+# القراءة من الذاكرة؛ الكتابة تُطبّق محلياً فوراً وتُسجّل في WAL ثم يكتبها خيط واحد إلى Redis بالترتيب (FIFO)
+# مع إعادة المحاولة عند انقطاعه؛ بعد كل كتابة يُنشر {ns,m,w} على STATE_CHANNEL فتُبطل العمليات الأخرى نسختها.
+STATE_STATS = {"hits": 0, "misses": 0, "read_errors": 0, "writes": 0, "write_retries": 0,
+               "invalidations": 0, "wal_replayed": 0, "reset_dropped": 0}
+_SC = {}              # (ns, market) -> dict ({} = معروف أنه فارغ)
+_SC_GEN = {}          # (ns, market) -> عدّاد إبطال (يمنع قراءة قديمة من الكتابة فوق إبطال أحدث)
+_SC_PENDING = {}      # (ns, market) -> كتابات لم تصل Redis بعد
+_SC_LOCK = threading.Lock()
+_SC_Q = queue.Queue()
+_SC_SEQ = iter(range(1, 1 << 62))
+_SC_THREADS = {}
+_SC_WAL = None
+_SC_FLUSH_LOCK = threading.Lock()   # كتابة Redis الجارية من الكاتب؛ reset ينتظرها كي لا تُعيد ما حذفه
+_SC_RESET = {}        # ns -> أول seq بعد آخر reset؛ ما قبله في الطابور يُسقط بدل أن يُكتب
+
+class _StateWAL:
+    """سجل append-only لكتابات لم تصل Redis: {"op":"add","s","ns","m","k","d"} / {"op":"ack","s"}.
+    الملف مقفل (flock) طوال حياة العملية؛ ملف غير مقفل عند الإقلاع = عملية ماتت ← يُعاد تشغيله.
+    add يضيف إلى ذاكرة فقط (تحت _SC_LOCK فيبقى ترتيب الملف = ترتيب seq)؛ sync خارج القفل يكتب ويعمل fsync
+    لكل ما تجمّع دفعةً واحدة (group commit): من وجد سجله مكتوباً بـ fsync غيره يعود فوراً."""
+    def __init__(self, path: str | None):
+        self.path = path; self.lock = threading.Lock(); self.open_n = 0; self.f = None
+        self.io = threading.Lock()   # الكتابة/fsync؛ self.lock للذاكرة فقط فلا ينتظر add أي fsync
+        self.buf = []; self.last = 0; self.synced = 0
+        if path:
+            self.f = open(path, "a", encoding="utf-8")
+            fcntl.flock(self.f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    def add(self, seq: int, ns: str, m: str, kind: str, d: dict | None):
+        if self.f is None: return
+        rec = json.dumps({"op": "add", "s": seq, "ns": ns, "m": m, "k": kind, "d": d}, separators=(',',':')) + "\n"
+        with self.lock:
+            self.buf.append(rec); self.open_n += 1; self.last = seq
+    def sync(self, seq: int):
+        """يعود حين يصير add رقم seq على القرص."""
+        if self.f is None: return
+        with self.io:
+            if self.synced >= seq: return
+            with self.lock:
+                recs, self.buf, last = self.buf, [], self.last
+            if recs: self.f.write("".join(recs))
+            self.f.flush()
+            if STATE_WAL_FSYNC: os.fsync(self.f.fileno())
+            self.synced = last
+    def ack(self, seq: int):
+        if self.f is None: return
+        with self.io, self.lock:
+            self.open_n -= 1
+            if self.open_n <= 0:
+                self.buf.clear(); self.f.truncate(0); self.open_n = 0   # لا معلّق: ابدأ من جديد
+                self.synced = self.last
+            else:   # يُكتب مع fsync التالي: ack ضائع يعيد تشغيل كتابة أقدم قبل الأحدث منها (نفس النتيجة)
+                self.buf.append(json.dumps({"op": "ack", "s": seq}) + "\n")
+
+    @staticmethod
+    def orphans(dirpath: str, own: str) -> list:
+        """(path, f, [add records]) لملفات WAL تركتها عمليات ميتة؛ سجلات add/ack مفتاحها "s"."""
+        out = []
+        for name in sorted(os.listdir(dirpath)):
+            path = os.path.join(dirpath, name)
+            if path == own or not name.endswith(".jsonl"): continue
+            try:
+                f = open(path, "r+", encoding="utf-8"); fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except (BlockingIOError, OSError):
+                continue   # عملية حيّة
+            pending = OrderedDict()
+            for line in f:
+                try: rec = json.loads(line)
+                except Exception: continue
+                if rec.get("op") == "add": pending[rec["s"]] = rec
+                elif rec.get("op") == "ack": pending.pop(rec.get("s"), None)
+            out.append((path, f, list(pending.values())))
+        return out
+
+def _sc_on() -> bool: return STATE_CACHE and R is not None
+
+def _sc_read(ns: str, market: str) -> dict:
+    if not R: return {}
+    if not STATE_CACHE: return _state_read(ns, market)[0]
+    k = (ns, market)
+    d = _SC.get(k)
+    if d is not None:
+        STATE_STATS["hits"] += 1; return dict(d)
+    STATE_STATS["misses"] += 1
+    gen = _SC_GEN.get(k, 0)
+    try:
+        d = _state_read(ns, market)[0]
+    except Exception as e:
+        STATE_STATS["read_errors"] += 1; print("state read err:", e); return {}
+    with _SC_LOCK:
+        if _SC_GEN.get(k, 0) == gen and k not in _SC: _SC[k] = d
+    return dict(d)
+
+def _sc_write(ns: str, market: str, fn=None, clear: bool = False):
+    """fn(current) → dict جديد أو None؛ clear=True للحذف. يعيد القيمة المحلية الجديدة (أو None)."""
+    if not R: return None
+    if not STATE_CACHE:
+        if clear: _state_clear(ns, market); return None
+        return _state_cas(ns, market, fn)
+    k = (ns, market)
+    if not clear and k not in _SC: _sc_read(ns, market)   # fn يحتاج القيمة الحالية
+    with _SC_LOCK:
+        if clear: new = {}
+        else:
+            new = fn(dict(_SC.get(k) or {}))
+            if new is None: return None
+        _SC[k] = new; _SC_PENDING[k] = _SC_PENDING.get(k, 0) + 1
+        seq = next(_SC_SEQ)
+        _sc_wal().add(seq, ns, market, "clear" if clear else "put", None if clear else new)
+        _SC_Q.put((seq, ns, market, None if clear else fn))
+    _sc_wal().sync(seq)   # fsync خارج _SC_LOCK (مجمّع مع الكتّاب المتزامنين)
+    _sc_start()
+    return dict(new)
+
+def _sc_wal() -> _StateWAL:
+    global _SC_WAL
+    if _SC_WAL is None:
+        try:
+            os.makedirs(STATE_WAL_DIR, exist_ok=True)
+            _SC_WAL = _StateWAL(os.path.join(STATE_WAL_DIR, f"{WORKER_ID.replace(':','_')}.jsonl"))
+        except Exception as e:
+            print("state wal disabled:", e); _SC_WAL = _StateWAL(None)   # ذاكرة فقط
+    return _SC_WAL
+
+def _sc_writer():
+    while True:
+        seq, ns, market, fn = _SC_Q.get()
+        k = (ns, market); fails = 0; res = None; dropped = False
+        while True:
+            with _SC_FLUSH_LOCK:
+                if seq < _SC_RESET.get(ns, 0):
+                    dropped = True; break   # كُتبت قبل reset: لا تُعيد الحالة الممحوة
+                try:
+                    res = _state_clear(ns, market) if fn is None else _state_cas(ns, market, fn)
+                    try: R.publish(STATE_CHANNEL, json.dumps({"ns": ns, "m": market, "w": WORKER_ID}))
+                    except Exception: pass
+                    break
+                except Exception as e:
+                    fails += 1; STATE_STATS["write_retries"] += 1
+                    if fails == 1: print("state write err (retrying):", e)
+            time.sleep(min(5.0, 0.2 * (2 ** min(fails, 5))))
+        STATE_STATS["reset_dropped" if dropped else "writes"] += 1
+        with _SC_LOCK:
+            _SC_PENDING[k] -= 1
+            if _SC_PENDING[k] <= 0:
+                _SC_PENDING.pop(k, None)
+                if dropped: _SC.pop(k, None)
+                elif fn is not None and res is None: _SC.pop(k, None)   # fn رفض قيمة Redis: أعد القراءة لاحقاً
+                elif fn is not None: _SC[k] = res
+        _sc_wal().ack(seq)
+
+def _sc_invalidate(ns: str, market: str | None):
+    with _SC_LOCK:
+        keys = [k for k in _SC if ns == "*" or (k[0] == ns and (market is None or k[1] == market))]
+        for k in keys:
+            if k in _SC_PENDING: continue   # تعديلنا المحلي أحدث؛ الكاتب سيضع نتيجة Redis
+            _SC.pop(k, None); _SC_GEN[k] = _SC_GEN.get(k, 0) + 1
+    STATE_STATS["invalidations"] += 1
+
+def _sc_reset(namespaces):
+    """إسقاط الكتابات المعلّقة لهذه الـ namespaces ونسخها المحلية. يُستدعى تحت _SC_FLUSH_LOCK في عملية الـ reset؛
+    العمّال الآخرون يطبّقونه عند رسالة reset (كتابة في طريقها إلى Redis لديهم لحظتها قد تسبق الرسالة)."""
+    with _SC_LOCK:
+        cut = next(_SC_SEQ)
+        for ns in namespaces: _SC_RESET[ns] = cut
+        for k in [k for k in _SC if k[0] in namespaces]:
+            _SC.pop(k, None); _SC_GEN[k] = _SC_GEN.get(k, 0) + 1
+
+def _sc_listener():
+    while True:
+        try:
+            ps = R.pubsub(ignore_subscribe_messages=True); ps.subscribe(STATE_CHANNEL)
+            _sc_invalidate("*", None)   # ربما فاتتنا رسائل أثناء الانقطاع
+            while True:
+                msg = ps.get_message(timeout=1.0)
+                if not msg: continue
+                try: d = json.loads(msg["data"])
+                except Exception: continue
+                if d.get("w") == WORKER_ID: continue
+                if d.get("reset"): _sc_reset(d["reset"])
+                _sc_invalidate(d.get("ns") or "*", d.get("m"))
+        except Exception as e:
+            print("state listener err:", e); time.sleep(1.0)
+
+def _sc_start():
+    if "writer" in _SC_THREADS: return
+    with _SC_LOCK:
+        if "writer" not in _SC_THREADS:
+            _SC_THREADS["writer"] = threading.Thread(target=_sc_writer, daemon=True, name="state-writer")
+            _SC_THREADS["writer"].start()
+
+def state_start():
+    """عند الإقلاع: مستمع الإبطال + إعادة تشغيل WAL عمليات ماتت (عبر كاتب هذه العملية كي يبقى الترتيب)."""
+    if not _sc_on() or "listener" in _SC_THREADS: return
+    _SC_THREADS["listener"] = threading.Thread(target=_sc_listener, daemon=True, name="state-inval")
+    _SC_THREADS["listener"].start()
+    try:
+        own = _sc_wal().path
+        if not own: return
+        for path, f, recs in _StateWAL.orphans(STATE_WAL_DIR, own):
+            for rec in recs:
+                d = rec.get("d") or {}
+                _sc_write(rec["ns"], rec["m"], clear=True) if rec.get("k") == "clear" else \
+                    _sc_write(rec["ns"], rec["m"], lambda cur, d=d: {**cur, **d})
+                STATE_STATS["wal_replayed"] += 1
+            os.remove(path); f.close()
+    except Exception as e:
+        print("state wal replay err:", e)
+
+def state_status() -> dict:
+    return {**STATE_STATS, "cached": len(_SC), "pending": _SC_Q.qsize(), "enabled": _sc_on()}
+
 def pos_get(market:str)->dict:
+    return _sc_read(SESSION_NS, market)
+
+def pos_all() -> dict:
+    """من Redis (كل العمليات) مع تراكب الكتابات المحلية التي لم تصل بعد؛ من الكاش إن تعذّر Redis."""
     if not R: return {}
-    d=R.hgetall(_key(SESSION_NS, market)) or {}
-    out={}
-    for k,v in d.items():
-        try: out[k]=json.loads(v)
-        except: out[k]=v
+    try:
+        out = _state_all(SESSION_NS)
+    except Exception:
+        if not _sc_on(): raise
+        return {m: dict(d) for (ns, m), d in list(_SC.items()) if ns == SESSION_NS and d}
+    if _sc_on():
+        with _SC_LOCK:
+            for (ns, m) in list(_SC_PENDING):
+                if ns != SESSION_NS: continue
+                d = _SC.get((ns, m))
+                if d: out[m] = dict(d)
+                else: out.pop(m, None)
     return out
 
 def pos_set(market:str, pos:dict):
-    if not R: return
-    R.hset(_key(SESSION_NS, market), mapping={k: json.dumps(v) for k,v in pos.items()})
+    """دمج الحقول (نفس دلالة hset السابقة)."""
+    _sc_write(SESSION_NS, market, lambda cur: {**cur, **pos})
+
+def pos_cas(market:str, fn):
+    """fn(pos الحالي) → pos جديد كامل أو None. يعيد الجديد أو None (يُعاد تطبيق fn على قيمة Redis عند الكتابة)."""
+    return _sc_write(SESSION_NS, market, fn)
 
 def pos_clear(market:str):
-    if R: R.delete(_key(SESSION_NS, market))
+    _sc_write(SESSION_NS, market, clear=True)
 
 def open_set(market:str, info:dict):
-    if R: R.hset(_key(OPEN_NS, market), mapping={k: json.dumps(v) for k,v in info.items()})
+    _sc_write(OPEN_NS, market, lambda cur: {**cur, **info})
 
 def open_get(market:str)->dict:
-    if not R: return {}
-    d=R.hgetall(_key(OPEN_NS, market)) or {}
-    out={}
-    for k,v in d.items():
-        try: out[k]=json.loads(v)
-        except: out=k and v
-    return out if isinstance(out, dict) else {}
+    return _sc_read(OPEN_NS, market)
 
 def open_clear(market:str):
-    if R: R.delete(_key(OPEN_NS, market))
+    _sc_write(OPEN_NS, market, clear=True)
+
+# ===== Ownership: عمّال متعددون عبر Redis leases =====
+# {LEASE_NS}:workers  zset  worker -> آخر نبضة
+# {LEASE_NS}:leader   str   worker (TTL) — القائد يشغّل watchdog ويستهلك outbox الـ Redis
+# {LEASE_NS}:pos:<m>  str   worker (TTL) — من يدير خروج الموقع؛ المواقع اليتيمة تُوزّع بـ crc32(market) على الأحياء
+LEASE_STATS = {"leader": False, "workers": 1, "owned": 0, "adopted": 0, "lost": 0, "beats": 0, "errors": 0}
+_LEASE_OWNED = set()
+_LEASE_LIVE = [WORKER_ID]
+_LEASE_LEADER_UNTIL = 0.0
+_LEASE_THREAD = None
+_LEASE_LOCK = threading.Lock()
+_LUA_RENEW = "if redis.call('get',KEYS[1])==ARGV[1] then return redis.call('pexpire',KEYS[1],ARGV[2]) else return 0 end"
+_LUA_FREE  = "if redis.call('get',KEYS[1])==ARGV[1] then return redis.call('del',KEYS[1]) else return 0 end"
+
+def _lease_key(market: str) -> str: return f"{LEASE_NS}:pos:{market}"
+
+def is_leader() -> bool:
+    return (not R) or time.time() < _LEASE_LEADER_UNTIL
+
+def shard_owner(market: str) -> str:
+    live = _LEASE_LIVE or [WORKER_ID]
+    return live[zlib.crc32(market.encode()) % len(live)]
+
+def lease_acquire(market: str) -> bool:
+    """True إن صار (أو كان) هذا العامل مالك الموقع."""
+    if not R: return True
+    key = _lease_key(market)
+    if R.set(key, WORKER_ID, nx=True, px=int(LEASE_TTL_SEC * 1000)) or R.get(key) == WORKER_ID:
+        _LEASE_OWNED.add(market); LEASE_STATS["owned"] = len(_LEASE_OWNED)
+        return True
+    return False
+
+def lease_release(market: str):
+    _LEASE_OWNED.discard(market); LEASE_STATS["owned"] = len(_LEASE_OWNED)
+    if R:
+        try: R.eval(_LUA_FREE, 1, _lease_key(market), WORKER_ID)
+        except Exception as e: print("lease release err:", e)
+
+def _lease_beat():
+    global _LEASE_LIVE, _LEASE_LEADER_UNTIL
+    now = time.time(); ttl_ms = int(LEASE_TTL_SEC * 1000); wk = f"{LEASE_NS}:workers"
+    p = R.pipeline()
+    p.zadd(wk, {WORKER_ID: now}); p.zremrangebyscore(wk, "-inf", now - LEASE_TTL_SEC); p.zrange(wk, 0, -1)
+    live = p.execute()[2]
+    _LEASE_LIVE = sorted(live) or [WORKER_ID]; LEASE_STATS["workers"] = len(_LEASE_LIVE)
+
+    lk = f"{LEASE_NS}:leader"
+    was = is_leader()
+    if R.eval(_LUA_RENEW, 1, lk, WORKER_ID, ttl_ms) or R.set(lk, WORKER_ID, nx=True, px=ttl_ms):
+        _LEASE_LEADER_UNTIL = now + LEASE_TTL_SEC * 0.8
+    LEASE_STATS["leader"] = is_leader()
+    if LEASE_STATS["leader"] and not was:
+        print("lease: leader", WORKER_ID); _ready_start(); _READY_WAKE.set()
+
+    import strategy
+    for market in list(_LEASE_OWNED):
+        if not R.eval(_LUA_RENEW, 1, _lease_key(market), WORKER_ID, ttl_ms):
+            _LEASE_OWNED.discard(market); LEASE_STATS["lost"] += 1
+            print("lease lost:", market); strategy.on_lease_lost(CORE, market)
+    LEASE_STATS["owned"] = len(_LEASE_OWNED)
+
+    # تبنّي المواقع اليتيمة (مالكها مات) التي يقع شاردها على هذا العامل
+    for market, pos in pos_all().items():
+        if market in _LEASE_OWNED or shard_owner(market) != WORKER_ID: continue
+        if not pos.get("ts_open") or pos.get("tp_done"): continue   # لم يكن له خروج مُدار، أو انتهى
+        if R.exists(_lease_key(market)): continue
+        if lease_acquire(market):
+            LEASE_STATS["adopted"] += 1
+            tg_send(f"♻️ تبنّي موقع — {market} (من عامل متوقف)")
+            strategy.adopt_position(CORE, market, pos)
+
+def _lease_loop():
+    while True:
+        try:
+            _lease_beat(); LEASE_STATS["beats"] += 1
+        except Exception as e:
+            LEASE_STATS["errors"] += 1; print("lease err:", e)
+        time.sleep(LEASE_BEAT_SEC)
+
+def _lease_exit():
+    if not R: return
+    try:
+        for market in list(_LEASE_OWNED): lease_release(market)
+        R.eval(_LUA_FREE, 1, f"{LEASE_NS}:leader", WORKER_ID)
+        R.zrem(f"{LEASE_NS}:workers", WORKER_ID)
+    except Exception:
+        pass
+
+def lease_start():
+    global _LEASE_THREAD
+    if not R or _LEASE_THREAD is not None: return
+    with _LEASE_LOCK:
+        if _LEASE_THREAD is None:
+            _LEASE_THREAD = threading.Thread(target=_lease_loop, daemon=True, name="lease"); _LEASE_THREAD.start()
+            atexit.register(_lease_exit)
+
+def lease_status() -> dict:
+    return {**LEASE_STATS, "worker": WORKER_ID, "live": list(_LEASE_LIVE), "markets": sorted(_LEASE_OWNED)}
+
+# ===== Ready Notify: outbox دائم غير حاجب =====
+class _RedisOutbox:
+    def __init__(self, key: str): self.key = key
+    def push(self, ev: dict): R.rpush(self.key, json.dumps(ev, separators=(',',':')))
+    def peek(self, n: int) -> list:
+        out = []
+        for raw in R.lrange(self.key, 0, n - 1) or []:
+            try: out.append(json.loads(raw))
+            except Exception: out.append({"id": None, "bad": raw})
+        return out
+    def ack(self, evs: list): R.ltrim(self.key, len(evs), -1)  # مستهلك واحد: العناصر المُرسلة في رأس القائمة
+    def size(self) -> int: return int(R.llen(self.key) or 0)
+
+class _FileOutbox:
+    """سجل append-only لكل عملية: {"op":"add","s":id,"ev":...} / {"op":"ack","s":id}؛ يُفرّغ حين لا يبقى معلّق.
+    كـ _StateWAL: الملف مقفل (flock) طوال حياة العملية، وملفات العمليات الميتة تُنقل إليه عند الإقلاع."""
+    def __init__(self, dirpath: str):
+        self.lock = threading.Lock(); self.pending = OrderedDict()
+        os.makedirs(dirpath, exist_ok=True)
+        self.path = os.path.join(dirpath, f"{WORKER_ID.replace(':','_')}.jsonl")
+        self.f = open(self.path, "a", encoding="utf-8")
+        fcntl.flock(self.f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        for path, f, recs in _StateWAL.orphans(dirpath, self.path):
+            evs = [r["ev"] for r in recs if isinstance(r.get("ev"), dict)]
+            if evs:
+                self._append([{"op": "add", "s": e["id"], "ev": e} for e in evs])
+                for e in evs: self.pending[e["id"]] = e
+            os.remove(path); f.close()
+    def _append(self, recs: list):
+        for r in recs: self.f.write(json.dumps(r, separators=(',',':')) + "\n")
+        self.f.flush(); os.fsync(self.f.fileno())
+    def push(self, ev: dict):
+        with self.lock: self._append([{"op": "add", "s": ev["id"], "ev": ev}]); self.pending[ev["id"]] = ev
+    def peek(self, n: int) -> list:
+        with self.lock: return list(self.pending.values())[:n]
+    def ack(self, evs: list):
+        with self.lock:
+            for ev in evs: self.pending.pop(ev.get("id"), None)
+            if self.pending: self._append([{"op": "ack", "s": ev.get("id")} for ev in evs])
+            else: self.f.truncate(0); self.f.flush(); os.fsync(self.f.fileno())
+    def size(self) -> int: return len(self.pending)
+
+READY_STATS = {"queued": 0, "delivered": 0, "batches": 0, "retries": 0, "dropped": 0, "lag_ms_last": 0.0, "lag_ms_max": 0.0}
+_READY_WAKE = threading.Event()
+_READY_FILE = None
+_READY_THREAD = None
+_READY_LOCK = threading.Lock()
+
+def _ready_stores() -> list:
+    global _READY_FILE
+    if _READY_FILE is None:
+        with _READY_LOCK:   # مقبض واحد للملف: قفل _FileOutbox هو ما يسلسل الكتابات
+            if _READY_FILE is None: _READY_FILE = _FileOutbox(READY_OUTBOX_DIR)
+    return [_READY_FILE] + ([_RedisOutbox(READY_OUTBOX_KEY)] if R else [])
+
+def _ready_start():
+    global _READY_THREAD
+    if _READY_THREAD is not None: return
+    with _READY_LOCK:
+        if _READY_THREAD is None:
+            _READY_THREAD = threading.Thread(target=_ready_worker, daemon=True, name="ready-outbox"); _READY_THREAD.start()
 
-# ===== Ready Notify =====
 def notify_ready(market:str, reason:str, pnl_eur=None):
+    """يُسجّل حدث ready في الـ outbox (Redis، أو الملف عند غيابه/تعطّله) ويعود فوراً."""
     if not ABUSIYAH_READY_URL:
         tg_send(f"ready — {market} ({reason})"); return
     if not ABUSIYAH_READY_URL.rstrip("/").endswith("/ready"):
-        tg_send(f"⚠️ ABUSIYAH_READY_URL لا ينتهي بـ /ready: {ABUSIYAH_READY_URL}")
+        tg_once("ready_url", f"⚠️ ABUSIYAH_READY_URL لا ينتهي بـ /ready: {ABUSIYAH_READY_URL}", 600)
+    ev = {"id": uuid4().hex, "coin": market.split("-")[0], "reason": reason, "pnl_eur": pnl_eur, "ts": time.time()}
+    stores = _ready_stores()
+    try:
+        stores[-1].push(ev)
+    except Exception as e:
+        print("ready outbox redis err:", e); stores[0].push(ev)
+    READY_STATS["queued"] += 1
+    _ready_start(); _READY_WAKE.set()
+
+def _ready_post(evs: list) -> int:
+    """0 = تم، 1 = إعادة لاحقاً، 2 = رفض نهائي (4xx)."""
     headers={"Content-Type":"application/json"}
     if LINK_SECRET: headers["X-Link-Secret"]=LINK_SECRET
-    coin=market.split("-")[0]
+    payload = ({"events": [{k: e.get(k) for k in ("coin","reason","pnl_eur")} for e in evs]} if len(evs) > 1
+               else {k: evs[0].get(k) for k in ("coin","reason","pnl_eur")})
+    try:
+        r = http("POST", ABUSIYAH_READY_URL, json=payload, headers=headers, timeout=6)
+    except Exception as e:
+        print("ready post err:", e); return 1
+    if 200 <= r.status_code < 300: return 0
+    if 400 <= r.status_code < 500 and r.status_code not in (408, 429):
+        tg_send(f"⚠️ ready فشل — HTTP {r.status_code} | {r.text[:160]}"); return 2
+    return 1
+
+def _ready_worker():
+    fails = 0
+    while True:
+        _READY_WAKE.clear(); sent = False
+        for store in _ready_stores():
+            if isinstance(store, _RedisOutbox) and not is_leader(): continue   # مستهلك واحد (ltrim)
+            try:
+                evs = store.peek(max(1, READY_BATCH_MAX))
+            except Exception as e:
+                print("ready outbox err:", e); continue
+            if not evs: continue
+            good = [e for e in evs if e.get("id")]
+            if not good:
+                store.ack(evs); READY_STATS["dropped"] += len(evs); sent = True; continue
+            res = _ready_post(good)
+            if res == 1:
+                fails += 1; READY_STATS["retries"] += 1
+                break
+            store.ack(evs); fails = 0; sent = True
+            if res == 2:
+                READY_STATS["dropped"] += len(good); continue
+            now = time.time(); READY_STATS["delivered"] += len(good); READY_STATS["batches"] += 1
+            lag_m = _metric("ready_delivery_lag", "")
+            for e in good:
+                lag = max(0.0, now - float(e.get("ts") or now))
+                with _MET_LOCK: lag_m[4] += 1
+                _observe(lag_m, lag, False)
+                READY_STATS["lag_ms_last"] = round(lag * 1000.0, 1)
+                READY_STATS["lag_ms_max"] = max(READY_STATS["lag_ms_max"], READY_STATS["lag_ms_last"])
+        if sent: continue
+        if fails: time.sleep(min(READY_RETRY_MAX_SEC, 0.5 * (2 ** min(fails, 8))))
+        else: _READY_WAKE.wait(5.0)
+
+def ready_boot():
+    """عند الإقلاع: يأخذ outbox العمليات الميتة (إن وُجد) ويبدأ تسليمه دون انتظار حدث جديد."""
     try:
-        r = requests.post(ABUSIYAH_READY_URL, json={"coin":coin,"reason":reason,"pnl_eur":pnl_eur},
-                          headers=headers, timeout=6)
-        if not (200 <= r.status_code < 300):
-            tg_send(f"⚠️ ready فشل — HTTP {r.status_code} | {r.text[:160]}")
+        if any(store.size() for store in _ready_stores()): _ready_start(); _READY_WAKE.set()
     except Exception as e:
-        tg_send(f"⚠️ فشل نداء ready: {e}")
+        print("ready outbox boot err:", e)
+
+def ready_pending() -> int:
+    n = 0
+    for store in _ready_stores():
+        try: n += store.size()
+        except Exception: pass
+    return n
+
 # ===== Helpers: average sell & PnL =====
 def _avg_from_order_fills(order_obj: dict) -> tuple[float, float]:
     try:
@@ -501,20 +2005,28 @@ def _send_sale_notifications(market: str, avg_in: float, sold_base: float, sell_
 class CoreAPI:
     # اتصالات/أدوات
     tg_send = staticmethod(tg_send)
+    tg_once = staticmethod(tg_once)
     notify_ready = staticmethod(notify_ready)
     bv_request = staticmethod(bv_request)
+    ratelimit = staticmethod(RL.snapshot)
+    span = span; trace_mark = staticmethod(trace_mark)
 
     # سوق/أوامر
     get_best_bid_ask = staticmethod(get_best_bid_ask)
+    book_watch = staticmethod(book_watch)
+    candles = staticmethod(candles); candle_watch = staticmethod(candle_watch); candles_peek = staticmethod(candles_peek)
     place_limit_postonly = staticmethod(place_limit_postonly)
     place_stoploss_limit = staticmethod(place_stoploss_limit)  # NEW
     cancel_order_blocking = staticmethod(cancel_order_blocking)
+    amend_order = staticmethod(amend_order)
     order_status = staticmethod(order_status)
+    orders_open = staticmethod(orders_open)
     emergency_taker_sell = staticmethod(emergency_taker_sell)
     balance = staticmethod(balance)
 
     # Meta/Precision
     coin_to_market = staticmethod(coin_to_market)
+    markets = staticmethod(markets_list)
     min_base = staticmethod(min_base)
     fmt_price = staticmethod(fmt_price)
     fmt_amount = staticmethod(fmt_amount)
@@ -524,60 +2036,260 @@ class CoreAPI:
 
     # State
     pos_get = staticmethod(pos_get); pos_set = staticmethod(pos_set); pos_clear = staticmethod(pos_clear)
+    pos_all = staticmethod(pos_all); pos_cas = staticmethod(pos_cas)
     open_get= staticmethod(open_get); open_set= staticmethod(open_set); open_clear= staticmethod(open_clear)
     reset_state = staticmethod(reset_state)
+    lease_acquire = staticmethod(lease_acquire); lease_release = staticmethod(lease_release)
 
     # ثوابت
     fee_rate = MAKER_FEE_RATE
 
+# كل staticmethod في CoreAPI يمرّ عبر _timed (latency/errors/inflight لكل عملية وسوق)؛
+# والدالة العامة بنفس الاسم تُستبدل أيضاً كي تُقاس النداءات الداخلية (watchdog، الإشعارات...)
+for _name, _attr in list(vars(CoreAPI).items()):
+    if isinstance(_attr, staticmethod):
+        _fn = _attr.__func__; _w = _timed(_name, _fn)
+        setattr(CoreAPI, _name, staticmethod(_w))
+        if globals().get(_name) is _fn: globals()[_name] = _w
+
 CORE = CoreAPI()
 
+# ===== AsyncCoreAPI: نفس أسماء CoreAPI كـ coroutines — await ACORE.place_limit_postonly(...) =====
+# REST والأوامر أصلية على aiohttp (جلسة مجمّعة لكل event loop، نفس RL والتوقيع والمقاييس ومسار المقبس)؛
+# ما لا شبكة فيه يُنفّذ داخل الـ loop مباشرة، والباقي (Redis، Telegram...) عبر asyncio.to_thread. CoreAPI المتزامن كما هو.
+_AHTTP = weakref.WeakKeyDictionary()   # loop -> aiohttp.ClientSession
+
+def _ahttp():
+    loop = asyncio.get_running_loop()
+    s = _AHTTP.get(loop)
+    if s is None or s.closed:
+        if aiohttp is None: raise RuntimeError("AsyncCoreAPI يتطلب aiohttp")
+        s = _AHTTP[loop] = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=HTTP_POOL_SIZE, keepalive_timeout=30))
+    return s
+
+async def ahttp_close():
+    s = _AHTTP.pop(asyncio.get_running_loop(), None)
+    if s is not None and not s.closed: await s.close()
+
+class _AResp:
+    """ما يقرؤه RL.update والمستدعون من requests.Response."""
+    __slots__ = ("status_code", "headers", "text")
+    def __init__(self, status_code: int, headers, text: str):
+        self.status_code = status_code; self.headers = headers; self.text = text
+    def json(self): return json.loads(self.text)
+
+async def _ahttp_send(m: str, url: str, headers, data, timeout) -> _AResp:
+    to = aiohttp.ClientTimeout(total=None, sock_connect=HTTP_CONNECT_TIMEOUT, sock_read=timeout or HTTP_TIMEOUT)
+    tries = HTTP_RETRIES + 1 if m in ("GET", "DELETE") else 1   # كـ Retry في http(): لا تكرار لـ POST/PUT
+    for i in range(tries):
+        try:
+            async with _ahttp().request(m, url, headers=headers, data=data, timeout=to) as r:
+                return _AResp(r.status, r.headers.copy(), await r.text())
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+            if i + 1 >= tries: raise
+            await asyncio.sleep(HTTP_BACKOFF * (2 ** i))
+
+async def _arun_flow(gen):
+    """_run_flow بـ await: نفس المولّدات (_bv_send_flow، _cancel_flow...)."""
+    res = exc = None
+    while True:
+        try: op = gen.send(res) if exc is None else gen.throw(exc)
+        except StopIteration as s: return s.value
+        res = exc = None
+        try:
+            k = op[0]
+            if k == "rl": await RL.aacquire(op[1], op[2])
+            elif k == "http": res = await _ahttp_send(*op[1:])
+            elif k == "wait": res = await asyncio.wait_for(asyncio.wrap_future(op[1]), op[2])
+            else: await asyncio.sleep(op[1])
+        except Exception as e:
+            exc = e
+
+def _aflow(flow, name: str):
+    async def wrapper(*a, **kw): return await _arun_flow(flow(*a, **kw))
+    wrapper.__name__ = name; wrapper.__wrapped__ = flow
+    return wrapper
+
+async def aget_best_bid_ask(market: str) -> tuple[float,float]:
+    # البث الحي هو المسار الساخن؛ الاشتراك الأول ورجوع Redis/REST يبقيان في المسار المتزامن عبر خيط
+    if market not in _BOOK_SUBS: await asyncio.to_thread(book_watch, market)
+    mem = _book_mem(market)
+    if mem:
+        FEED_STATS["mem_hits"] += 1
+        return mem
+    return await asyncio.to_thread(get_best_bid_ask, market)
+
+def _atimed(op: str, fn):
+    """_timed للـ coroutines (بلا spans: التتبّع مرتبط بالخيط)."""
+    async def wrapper(*a, **kw):
+        m = _metric(op, _metric_market(a, kw))
+        with _MET_LOCK: m[4] += 1
+        t0 = time.perf_counter(); err = True
+        try:
+            out = await fn(*a, **kw); err = False
+            return out
+        finally:
+            _observe(m, time.perf_counter() - t0, err)
+    wrapper.__name__ = getattr(fn, "__name__", op); wrapper.__doc__ = fn.__doc__; wrapper.__wrapped__ = fn
+    return wrapper
+
+def _ainline(fn):
+    async def wrapper(*a, **kw): return fn(*a, **kw)
+    wrapper.__name__ = fn.__name__; wrapper.__wrapped__ = fn
+    return wrapper
+
+def _athread(fn):
+    async def wrapper(*a, **kw): return await asyncio.to_thread(fn, *a, **kw)
+    wrapper.__name__ = fn.__name__; wrapper.__wrapped__ = fn
+    return wrapper
+
+_ASYNC_NATIVE = {"bv_request": _aflow(_bv_request_flow, "bv_request"),
+                 "place_limit_postonly": _aflow(_place_limit_flow, "place_limit_postonly"),
+                 "cancel_order_blocking": _aflow(_cancel_flow, "cancel_order_blocking"),
+                 "order_status": _aflow(_order_status_flow, "order_status"),
+                 "orders_open": _aflow(_orders_open_flow, "orders_open"),
+                 "balance": _aflow(_balance_flow, "balance"), "get_best_bid_ask": aget_best_bid_ask}
+# حساب/ذاكرة فقط، بلا أي مسار قد يحجب (REST، بناء المقبس، Redis، خيوط): تُنفّذ داخل الـ loop.
+# price_tick/price_decimals (أسواق significant-digits تقرأ الدفتر)، coin_to_market (load_markets_once)
+# وbook_watch/candle_watch (_ws() قد يبني المقبس) ليست هنا: تمرّ عبر to_thread
+_ASYNC_INLINE = {"fmt_price", "fmt_amount", "round_amount_down", "markets", "min_base", "ratelimit",
+                 "trace_mark", "candles_peek"}
+
+class AsyncCoreAPI:
+    fee_rate = MAKER_FEE_RATE
+    close = staticmethod(ahttp_close)
+
+for _name, _attr in list(vars(CoreAPI).items()):
+    if not isinstance(_attr, staticmethod): continue
+    _fn = _attr.__func__
+    if _name in _ASYNC_NATIVE: _w = _atimed(_name, _ASYNC_NATIVE[_name])
+    elif _name in _ASYNC_INLINE: _w = _ainline(_fn)
+    else: _w = _athread(_fn)
+    setattr(AsyncCoreAPI, _name, staticmethod(_w))
+
+ACORE = AsyncCoreAPI()
+CoreAPI.aio = ACORE   # strategy: core.aio.place_limit_postonly(...) من event loop واحد
+
+# ===== Account stream: أحداث order/fill من subscriptionAccount =====
+_ACCT_SUBS = set()
+_FILLS = {}                 # orderId -> {"b": base, "q": quote, "ids": set(fillId), "ts": sec}
+_WD_EVENTS = queue.Queue()  # (market, orderId, order_event) — أوامر اكتملت
+WD_STATS = {"fills": 0, "order_events": 0, "resolved_stream": 0, "resolved_poll": 0, "reconciles": 0, "deferred": 0}
+
+def _acct_up() -> bool:
+    ws = _WS
+    return _ws_up(ws) and bool(ws.authenticated)
+
+def _on_account(msg: dict):
+    oid = msg.get("orderId"); ev = msg.get("event")
+    if not oid: return
+    if ev == "fill":
+        f = _FILLS.setdefault(oid, {"b": 0.0, "q": 0.0, "ids": set(), "ts": 0.0})
+        fid = msg.get("fillId")
+        if fid in f["ids"]: return
+        try:
+            a = float(msg.get("amount", 0) or 0); p = float(msg.get("price", 0) or 0)
+        except Exception:
+            return
+        f["ids"].add(fid); f["b"] += a; f["q"] += a * p; f["ts"] = time.time()
+        WD_STATS["fills"] += 1
+    elif ev == "order":
+        WD_STATS["order_events"] += 1
+        if (msg.get("status") or "").lower() == "filled":
+            _WD_EVENTS.put((msg.get("market"), oid, msg))
+
+def acct_watch(market: str):
+    if not API_KEY: return
+    ws = _ws()
+    if ws is None or market in _ACCT_SUBS: return
+    _ACCT_SUBS.add(market)
+    _ws_subscribe("subscriptionAccount", market, _on_account)
+
+def _fills_avg(orderId: str) -> tuple[float, float]:
+    f = _FILLS.get(orderId)
+    if f and f["b"] > 0 and f["q"] > 0:
+        return f["q"] / f["b"], f["b"]
+    return 0.0, 0.0
+
+def _exit_live(market: str) -> bool:
+    """خروج TP مُدار لهذا السوق: EXITS محلياً، أو lease في أي عامل (المالك يشغّل المهمة أو يطارد الشراء)."""
+    import strategy
+    if strategy.EXITS.has(market): return True
+    if not R: return False
+    try: return bool(R.exists(_lease_key(market)))
+    except Exception: return False
+
+def _wd_resolve_filled(market: str, orderId: str, st: dict) -> bool:
+    """أمر TP/SL اكتمل: احسب متوسط البيع (fills ← order ← trades) وأبلغ ثم امسح الجلسة.
+    ملء TP لموقع له خروج حيّ تحسمه مهمة EXITS نفسها (مرة واحدة)؛ الـ watchdog للمواقع بلا مالك."""
+    if R and not is_leader(): return False   # القائد وحده يبلّغ ويمسح (مرة واحدة)
+    pos = pos_get(market)
+    if not pos: return False
+    if orderId and orderId == pos.get("tp_oid"):
+        if _exit_live(market):
+            WD_STATS["deferred"] += 1; return False
+        reason = "tp_filled"
+    elif orderId and orderId == pos.get("sl_oid"): reason = "sl_filled"
+    else: return False
+    sell_avg, sold_b = _fills_avg(orderId)
+    if sell_avg <= 0 or sold_b <= 0:
+        sell_avg, sold_b = _avg_from_order_fills(st or {})
+    if sell_avg <= 0 or sold_b <= 0:
+        sell_avg, sold_b = _recent_sell_avg(market, lookback_sec=60)
+    base = float(pos.get("base") or 0); avg = float(pos.get("avg") or 0)
+    _send_sale_notifications(market, avg, (sold_b or base), (sell_avg or 0.0), reason=reason)
+    pos_clear(market); _FILLS.pop(orderId, None)
+    return True
+
 # ===== Watchdog: يرصد TP/SL ويحسب PnL ويبلّغ =====
 def start_watchdog():
     from strategy import maybe_move_sl  # موجود لأغراض التوافق
     def loop():
+        last_rec = 0.0
         while True:
             try:
-                if not R:
-                    time.sleep(1.0); continue
-                for key in R.scan_iter(match=f"{SESSION_NS}:*"):
-                    market = key.split(":", 2)[-1]
-                    pos = pos_get(market)
-                    if not pos: continue
+                if R and not is_leader():   # watchdog واحد عبر كل العمّال؛ أحداث غير القائد تُسقط (بثّ القائد ومطابقته تحسمها)
+                    while not _WD_EVENTS.empty(): _WD_EVENTS.get_nowait()
+                    time.sleep(LEASE_BEAT_SEC); continue
+                # 1) أحداث البث: حلّ فوري لأوامر TP/SL المكتملة حتى موعد الدورة، ثم المطابقة في موعدها
+                due = time.time() + max(0.4, SL_CHECK_SEC)
+                while True:
+                    try: market, oid, st = _WD_EVENTS.get(timeout=max(0.0, due - time.time()))
+                    except queue.Empty: break
+                    if _wd_resolve_filled(market, oid, st): WD_STATS["resolved_stream"] += 1
+                if not R: continue
+
+                # 2) مطابقة REST: كل WD_RECONCILE_SEC إن كان البث حيّاً، وإلا كل دورة (السلوك القديم)
+                now = time.time()
+                reconcile = (not _acct_up()) or (now - last_rec >= WD_RECONCILE_SEC)
+                if reconcile:
+                    last_rec = now; WD_STATS["reconciles"] += 1
+                    for oid in [k for k, f in list(_FILLS.items()) if now - f["ts"] > 3600]:
+                        _FILLS.pop(oid, None)
+
+                for market, pos in pos_all().items():
+                    acct_watch(market)
 
                     base=float(pos.get("base") or 0)
                     avg=float(pos.get("avg") or 0)
-                    tp_oid=pos.get("tp_oid")
-                    sl_oid=pos.get("sl_oid")
                     slp=float(pos.get("sl_price") or 0)
 
-                    # 1) TP filled؟
-                    if tp_oid:
-                        st = order_status(market, tp_oid)
-                        if (st or {}).get("status","").lower() == "filled":
-                            sell_avg, sold_b = _avg_from_order_fills(st)
-                            if sell_avg <= 0 or sold_b <= 0:
-                                sell_avg, sold_b = _recent_sell_avg(market, lookback_sec=60)
-                            _send_sale_notifications(market, avg, (sold_b or base), (sell_avg or 0.0), reason="tp_filled")
-                            pos_clear(market); continue
-
-                    # 2) SL الرسمي filled؟
-                    if sl_oid:
-                        st = order_status(market, sl_oid)
-                        if (st or {}).get("status","").lower() == "filled":
-                            sell_avg, sold_b = _avg_from_order_fills(st)
-                            if sell_avg <= 0 or sold_b <= 0:
-                                sell_avg, sold_b = _recent_sell_avg(market, lookback_sec=60)
-                            _send_sale_notifications(market, avg, (sold_b or base), (sell_avg or 0.0), reason="sl_filled")
-                            pos_clear(market); continue
+                    if reconcile:
+                        resolved = False
+                        for oid in (pos.get("tp_oid"), pos.get("sl_oid")):
+                            if not oid: continue
+                            st = order_status(market, oid)
+                            if (st or {}).get("status","").lower() == "filled":
+                                resolved = _wd_resolve_filled(market, oid, st)
+                                if resolved: WD_STATS["resolved_poll"] += 1
+                                break
+                        if resolved: continue
 
                     # 3) (اختياري) قفل ربح — لن يغيّر SL الثابت عندك، لكنه آمن
                     bid,_ = get_best_bid_ask(market)
                     new_sl = maybe_move_sl(CORE, market, avg, base, bid, slp)
                     if new_sl and new_sl>0 and (slp<=0 or new_sl>slp):
-                        pos["sl_price"]=new_sl; pos_set(market, pos); tg_send(f"🔒 قفل ربح — SL={new_sl:.8f} ({market})")
-
-                time.sleep(max(0.4, SL_CHECK_SEC))
+                        pos_set(market, {"sl_price": new_sl}); tg_send(f"🔒 قفل ربح — SL={new_sl:.8f} ({market})")
             except Exception as e:
                 print("watchdog err:", e); time.sleep(1.0)
     threading.Thread(target=loop, daemon=True).start()
@@ -634,8 +2346,9 @@ def abusiyah_hook():
         coin  =(data.get("coin") or "").upper().strip()
         if action!="buy" or not COIN_RE.match(coin):
             return jsonify(ok=False, err="invalid_payload"), 400
-        threading.Thread(target=lambda: on_hook_buy(CORE, coin), daemon=True).start()
-        return jsonify(ok=True, msg="buy started"), 202
+        tid = trace_begin(coin=coin)
+        threading.Thread(target=_run_traced, args=(tid, on_hook_buy, CORE, coin), daemon=True).start()
+        return jsonify(ok=True, msg="buy started", trace_id=tid), 202
     except Exception as e:
         tg_send(f"🐞 hook error: {type(e).__name__}: {e}")
         return jsonify(ok=False, err=str(e)), 500
@@ -643,6 +2356,57 @@ def abusiyah_hook():
 @app.route("/", methods=["GET"])
 def home(): return f"Saqer — {__SAQER_CORE_VERSION__} ✅", 200
 
+@app.route("/metrics", methods=["GET"])
+def http_metrics():
+    rl = RL.snapshot()
+    extra = {"saqer_ratelimit_remaining": rl["remaining"], "saqer_ratelimit_reset_in_ms": rl["reset_in_ms"],
+             "saqer_ratelimit_bans": rl["bans"], "saqer_book_feed_up": int(book_status()["up"]),
+             "saqer_book_subscriptions": len(_BOOK_SUBS)}
+    for p in _PRIO_NAMES:
+        extra[f"saqer_ratelimit_throttled_{p}"] = rl["throttled"][p]
+        extra[f"saqer_ratelimit_slowed_{p}"] = rl["slowed"][p]
+    extra.update({f"saqer_book_{k}": v for k, v in FEED_STATS.items()})
+    extra.update({f"saqer_watchdog_{k}": v for k, v in WD_STATS.items()})
+    extra.update({f"saqer_tg_{k}": v for k, v in TG_STATS.items()}); extra["saqer_tg_pending"] = _TG_Q.qsize()
+    extra.update({f"saqer_ready_{k}": v for k, v in READY_STATS.items()}); extra["saqer_ready_pending"] = ready_pending()
+    extra.update({f"saqer_lease_{k}": int(v) for k, v in LEASE_STATS.items()})
+    extra.update({f"saqer_state_{k}": int(v) for k, v in state_status().items()})
+    extra.update({f"saqer_candles_{k}": v for k, v in CANDLE_STATS.items()}); extra["saqer_candles_rings"] = len(_CANDLES)
+    extra.update({f"saqer_ws_{k}": v for k, v in ws_status().items()})
+    extra.update({f"saqer_ws_orders_{k}": v for k, v in WS_ORDER_STATS.items()})
+    for k, v in REPRICE_STATS.items():
+        if isinstance(v, dict):
+            extra[f"saqer_reprice_{k}_count"] = v["n"]; extra[f"saqer_reprice_{k}_ms_sum"] = v["ms"]
+        else:
+            extra[f"saqer_reprice_{k}"] = v
+    return Response(metrics_text(extra), mimetype="text/plain; version=0.0.4")
+
+@app.route("/traces", methods=["GET"])
+def http_traces():
+    n = max(1, min(int(request.args.get("n", 20) or 20), TRACE_KEEP))
+    with _TRACE_LOCK: trs = list(_TRACES.values())[-n:]
+    rows = [{"id": t["id"], "coin": t.get("coin"), "ts": t["ts"], "spans": len(t["spans"]), **t["marks"]} for t in reversed(trs)]
+    return jsonify(ok=True, traces=rows), 200
+
+@app.route("/traces/summary", methods=["GET"])
+def http_traces_summary():
+    return jsonify(ok=True, **trace_summary()), 200
+
+@app.route("/traces/<tid>", methods=["GET"])
+def http_trace(tid):
+    tr = _TRACES.get(tid)
+    if not tr: return jsonify(ok=False, err="not_found"), 404
+    return jsonify(ok=True, **{k: v for k, v in tr.items() if k != "t0"}), 200
+
+@app.route("/stats", methods=["GET"])
+def http_stats():
+    rp = {k: ({**v, "avg_ms": round(v["ms"]/v["n"], 2) if v["n"] else None} if isinstance(v, dict) else v)
+          for k, v in REPRICE_STATS.items()}
+    return jsonify(ok=True, reprice=rp, book=book_status(), watchdog=WD_STATS, ratelimit=RL.snapshot(),
+                   telegram={**TG_STATS, "pending": _TG_Q.qsize()}, ready={**READY_STATS, "pending": ready_pending()},
+                   markets=MARKETS_STATS, lease=lease_status(), state=state_status(),
+                   candles={**CANDLE_STATS, "rings": len(_CANDLES)}, ws={**ws_status(), "orders": WS_ORDER_STATS}), 200
+
 # ===== فحص واجهة strategy =====
 def _check_strategy_interface():
     import strategy
@@ -651,8 +2415,27 @@ def _check_strategy_interface():
     if missing:
         raise RuntimeError(f"strategy.py missing: {missing}")
 
-if __name__ == "__main__":
-    load_markets_once()
+# ===== إقلاع: مرة لكل عملية — python main.py أو gunicorn main:app (SAQER_BOOT=0 لتعطيله عند الاستيراد)
+_BOOTED = False
+
+def boot():
+    global _BOOTED
+    if _BOOTED: return
+    _BOOTED = True
+    _markets_boot()
     _check_strategy_interface()
+    import strategy
+    if hasattr(strategy, "on_boot"): strategy.on_boot(CORE)
+    if not R and int(os.getenv("WEB_CONCURRENCY", "1") or 1) > 1:
+        print("⚠️ WEB_CONCURRENCY>1 بلا REDIS_URL: كل عامل قائد ومالك لكل سوق — شغّل عاملاً واحداً")
+    state_start()
+    lease_start()
+    ready_boot()
     start_watchdog()
-    app.run(host="0.0.0.0", port=PORT)
\ No newline at end of file
+
+if __name__ == "__main__":
+    load_markets_once()
+    boot()
+    app.run(host="0.0.0.0", port=PORT)
+elif os.getenv("SAQER_BOOT","1") == "1":
+    boot()
\ No newline at end of file
@@ -0,0 +1,331 @@
+import asyncio
+import inspect
+import json
+import time
+try:
+  import aiohttp
+except ImportError:
+  aiohttp = None
+try:
+  import websockets
+except ImportError:
+  websockets = None
+
+from python_bitvavo_api import bitvavo as _sync
+from python_bitvavo_api.bitvavo import Bitvavo, createSignature, debugToConsole, errorToConsole, requestError
+
+# asyncio client: every REST endpoint method of Bitvavo (time, book, placeOrder, ...) is inherited unchanged;
+# only publicRequest/privateRequest are replaced, so each of them returns an awaitable here.
+# Needs aiohttp (REST) and websockets (newWebsocket); both are optional for the sync client.
+class AsyncBitvavo(Bitvavo):
+  def __init__(self, options = {}):
+    if aiohttp is None:
+      raise ImportError('AsyncBitvavo needs aiohttp')
+    Bitvavo.__init__(self, options)
+    self.poolSize = 64
+    for key in options:
+      if key.lower() == "poolsize":
+        self.poolSize = int(options[key])
+    self.session = None
+
+  # one pooled keep-alive session, created lazily inside the running loop
+  def getSession(self):
+    if self.session is None or self.session.closed:
+      self.session = aiohttp.ClientSession(connector = aiohttp.TCPConnector(limit = self.poolSize),
+                                           timeout = aiohttp.ClientTimeout(total = self.timeout))
+    return self.session
+
+  async def close(self):
+    if self.session is not None and not self.session.closed:
+      await self.session.close()
+
+  async def __aenter__(self):
+    return self
+
+  async def __aexit__(self, *args):
+    await self.close()
+
+  async def publicRequest(self, url):
+    debugToConsole("REQUEST: " + url)
+    async with self.getSession().get(url, headers = self.publicHeaders(url)) as r:
+      data = await r.json(content_type = None)
+      self.trackRateLimit(data, r.headers)
+    return data
+
+  async def privateRequest(self, endpoint, postfix, body = None, method = 'GET'):
+    url = self.base + endpoint + postfix
+    headers = self.privateHeaders(endpoint, postfix, body, method)
+    debugToConsole("REQUEST: " + url)
+    async with self.getSession().request(method, url, headers = headers, json = body) as r:
+      data = await r.json(content_type = None)
+      self.trackRateLimit(data, r.headers)
+    return data
+
+  def newWebsocket(self):
+    return asyncWebsocket(self)
+
+# event -> callbacks key; ticker24h and candle are routed separately
+_EVENT_CALLBACKS = {
+  'fill': 'subscriptionAccount',
+  'order': 'subscriptionAccount',
+  'ticker': 'subscriptionTicker',
+  'book': 'subscriptionBookUpdate',
+  'trade': 'subscriptionTrades',
+}
+
+# channel name -> callbacks key, used to rebuild subscriptions after a reconnect
+_CHANNELS = {
+  'ticker': 'subscriptionTicker',
+  'ticker24h': 'subscriptionTicker24h',
+  'account': 'subscriptionAccount',
+  'book': 'subscriptionBookUpdate',
+  'trades': 'subscriptionTrades',
+}
+
+# asyncio WebSocket manager: one reader task, reconnect with backoff, resubscribe, and
+# requestId-correlated requests that are awaited directly. Callbacks may be plain functions or coroutines.
+class asyncWebsocket:
+  def __init__(self, bitvavo):
+    if websockets is None:
+      raise ImportError('asyncWebsocket needs websockets')
+    self.bitvavo = bitvavo
+    self.APIKEY = bitvavo.APIKEY
+    self.APISECRET = bitvavo.APISECRET
+    self.ACCESSWINDOW = bitvavo.ACCESSWINDOW
+    self.wsUrl = bitvavo.wsUrl
+    self.decoder = bitvavo.decoder or _sync._loads
+    self.callbacks = {}
+    self.keepAlive = True
+    self.reconnectTimer = 0.1
+    self.connectCount = 0
+    self.requestTimeout = 30
+    self.requestSeq = 0
+    self.pending = {}
+    self.ws = None
+    self.task = None
+    self.opened = None
+    self.authenticated = None
+
+  @property
+  def open(self):
+    return self.opened is not None and self.opened.is_set()
+
+  async def connect(self):
+    if self.task is None:
+      self.opened = asyncio.Event()
+      self.authenticated = asyncio.Event()
+      self.task = asyncio.get_running_loop().create_task(self.run())
+    await self.opened.wait()
+    return self
+
+  async def closeSocket(self):
+    self.keepAlive = False
+    if self.ws is not None:
+      await self.ws.close()
+    if self.task is not None:
+      self.task.cancel()
+      try:
+        await self.task
+      except (asyncio.CancelledError, Exception):
+        pass
+    self.failPending(ConnectionError('websocket closed'))
+
+  async def __aenter__(self):
+    return await self.connect()
+
+  async def __aexit__(self, *args):
+    await self.closeSocket()
+
+  async def run(self):
+    while self.keepAlive:
+      try:
+        async with websockets.connect(self.wsUrl, max_size = None) as ws:
+          self.ws = ws
+          self.connectCount += 1
+          self.reconnectTimer = 0.1
+          await self.onOpen()
+          async for frame in ws:
+            self.onMessage(frame)
+      except asyncio.CancelledError:
+        raise
+      except Exception as e:
+        self.onError(e)
+      self.ws = None
+      self.opened.clear()
+      self.authenticated.clear()
+      self.failPending(ConnectionError('websocket closed'))
+      if not self.keepAlive:
+        return
+      debugToConsole('reconnecting in ' + str(self.reconnectTimer))
+      await asyncio.sleep(self.reconnectTimer)
+      self.reconnectTimer = min(self.reconnectTimer * 2, 10)
+
+  async def onOpen(self):
+    if self.APIKEY != '':
+      now = int(time.time() * 1000)
+      await self.ws.send(json.dumps({ 'window': str(self.ACCESSWINDOW), 'action': 'authenticate', 'key': self.APIKEY,
+                                      'signature': createSignature(now, 'GET', '/websocket', {}, self.APISECRET), 'timestamp': now }))
+    for frame in self.subscriptionFrames():
+      await self.ws.send(json.dumps(frame))
+    self.opened.set()
+
+  def subscriptionFrames(self):
+    channels = []
+    for name, key in _CHANNELS.items():
+      markets = list(self.callbacks.get(key, {}))
+      if markets:
+        channels.append({ 'name': name, 'markets': markets })
+    candles = self.callbacks.get('subscriptionCandles', {})
+    for interval in sorted(set(i for m in candles for i in candles[m])):
+      channels.append({ 'name': 'candles', 'interval': [interval], 'markets': [m for m in candles if interval in candles[m]] })
+    public = [c for c in channels if c['name'] != 'account']
+    private = [c for c in channels if c['name'] == 'account']
+    frames = [{ 'action': 'subscribe', 'channels': public }] if public else []
+    if private and self.APIKEY != '':
+      frames.append({ 'action': 'subscribe', 'channels': private })
+    return frames
+
+  def onMessage(self, frame):
+    if _sync.debugging:
+      debugToConsole('RECEIVED: ' + (frame if isinstance(frame, str) else frame.decode()))
+    msg = self.decoder(frame)
+    if 'requestId' in msg:
+      self.resolveRequest(msg)
+      if msg.get('errorCode') == 105:
+        self.bitvavo.updateRateLimit(msg)
+      return
+    if 'error' in msg:
+      if msg.get('errorCode') == 105:
+        self.bitvavo.updateRateLimit(msg)
+      self.onError(msg)
+      return
+    event = msg.get('event')
+    if event is None:
+      return
+    if event == 'authenticate':
+      self.authenticated.set()
+      debugToConsole('Authenticated Websocket.')
+    elif event == 'ticker24h':
+      for entry in msg['data']:
+        self.call(self.callbacks.get('subscriptionTicker24h', {}).get(entry['market']), entry)
+    elif event == 'candle':
+      self.call(self.callbacks.get('subscriptionCandles', {}).get(msg['market'], {}).get(msg['interval']), msg)
+    elif event in _EVENT_CALLBACKS:
+      self.call(self.callbacks.get(_EVENT_CALLBACKS[event], {}).get(msg.get('market')), msg)
+
+  def call(self, callback, msg):
+    if callback is None:
+      return
+    try:
+      result = callback(msg)
+      if inspect.isawaitable(result):
+        asyncio.ensure_future(result)
+    except Exception as e:
+      self.onError(e)
+
+  def onError(self, error):
+    if 'error' in self.callbacks:
+      self.call(self.callbacks['error'], error)
+    else:
+      errorToConsole(error if isinstance(error, str) else repr(error))
+
+  def setErrorCallback(self, callback):
+    self.callbacks['error'] = callback
+
+  # ---- requests: await request(body) -> response; requestError / asyncio.TimeoutError / ConnectionError
+  async def request(self, body, private = False, timeout = None):
+    if private and self.APIKEY == '':
+      raise requestError({'errorCode': 0, 'error': 'You did not set the API key, but requested a private function.'})
+    timeout = self.requestTimeout if timeout is None else timeout
+    await self.connect()
+    if private:
+      await asyncio.wait_for(self.authenticated.wait(), timeout)
+    self.requestSeq += 1
+    requestId = self.requestSeq
+    future = asyncio.get_running_loop().create_future()
+    self.pending[requestId] = future
+    body['requestId'] = requestId
+    try:
+      await self.ws.send(json.dumps(body))
+      return await asyncio.wait_for(future, timeout)
+    finally:
+      self.pending.pop(requestId, None)
+
+  def resolveRequest(self, msg):
+    future = self.pending.pop(msg.get('requestId'), None)
+    if future is None or future.done():
+      return
+    if 'error' in msg:
+      future.set_exception(requestError(msg))
+    else:
+      future.set_result(msg.get('response'))
+
+  def failPending(self, error):
+    pending, self.pending = self.pending, {}
+    for future in pending.values():
+      if not future.done():
+        future.set_exception(error)
+
+  async def time(self, timeout = None):
+    return await self.request({ 'action': 'getTime' }, False, timeout)
+
+  async def book(self, market, options = None, timeout = None):
+    body = dict(options or {}, action = 'getBook', market = market)
+    return await self.request(body, False, timeout)
+
+  async def tickerBook(self, options = None, timeout = None):
+    return await self.request(dict(options or {}, action = 'getTickerBook'), False, timeout)
+
+  async def placeOrder(self, market, side, orderType, body, timeout = None):
+    body = dict(body, market = market, side = side, orderType = orderType, action = 'privateCreateOrder')
+    return await self.request(body, True, timeout)
+
+  async def getOrder(self, market, orderId, timeout = None):
+    return await self.request({ 'action': 'privateGetOrder', 'market': market, 'orderId': orderId }, True, timeout)
+
+  async def updateOrder(self, market, orderId, body, timeout = None):
+    body = dict(body, market = market, orderId = orderId, action = 'privateUpdateOrder')
+    return await self.request(body, True, timeout)
+
+  async def cancelOrder(self, market, orderId, operatorId = None, timeout = None):
+    body = { 'action': 'privateCancelOrder', 'market': market, 'orderId': orderId }
+    if operatorId is not None:
+      body['operatorId'] = operatorId
+    return await self.request(body, True, timeout)
+
+  async def ordersOpen(self, options = None, timeout = None):
+    return await self.request(dict(options or {}, action = 'privateGetOrdersOpen'), True, timeout)
+
+  async def balance(self, options = None, timeout = None):
+    return await self.request(dict(options or {}, action = 'privateGetBalance'), True, timeout)
+
+  # ---- subscriptions: stored like the sync client and replayed on every reconnect
+  async def subscribe(self, channel):
+    if self.ws is not None and self.open:
+      await self.ws.send(json.dumps({ 'action': 'subscribe', 'channels': [channel] }))
+
+  async def subscriptionTicker(self, market, callback):
+    self.callbacks.setdefault('subscriptionTicker', {})[market] = callback
+    await self.subscribe({ 'name': 'ticker', 'markets': [market] })
+
+  async def subscriptionTicker24h(self, market, callback):
+    self.callbacks.setdefault('subscriptionTicker24h', {})[market] = callback
+    await self.subscribe({ 'name': 'ticker24h', 'markets': [market] })
+
+  async def subscriptionAccount(self, market, callback):
+    self.callbacks.setdefault('subscriptionAccount', {})[market] = callback
+    if self.open and self.APIKEY != '':
+      await asyncio.wait_for(self.authenticated.wait(), self.requestTimeout)
+      await self.subscribe({ 'name': 'account', 'markets': [market] })
+
+  async def subscriptionCandles(self, market, interval, callback):
+    self.callbacks.setdefault('subscriptionCandles', {}).setdefault(market, {})[interval] = callback
+    await self.subscribe({ 'name': 'candles', 'interval': [interval], 'markets': [market] })
+
+  async def subscriptionTrades(self, market, callback):
+    self.callbacks.setdefault('subscriptionTrades', {})[market] = callback
+    await self.subscribe({ 'name': 'trades', 'markets': [market] })
+
+  async def subscriptionBookUpdate(self, market, callback):
+    self.callbacks.setdefault('subscriptionBookUpdate', {})[market] = callback
+    await self.subscribe({ 'name': 'book', 'markets': [market] })
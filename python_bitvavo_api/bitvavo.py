@@ -6,6 +6,17 @@ import json
 import websocket
 import threading
 import datetime
+import bisect
+import queue
+import concurrent.futures
+import contextlib
+import collections
+try:
+  import orjson
+  _loads = orjson.loads
+except ImportError:
+  orjson = None
+  _loads = json.loads
 
 debugging = False
 
@@ -49,7 +60,29 @@ def bidsCompare(a, b):
     return True
   return False
 
+def _bookKey(price, compareFunc):
+  # bids are keyed on the negated price so both sides stay ascending for bisect
+  return -float(price) if compareFunc is bidsCompare else float(price)
+
 def sortAndInsert(book, update, compareFunc):
+  if compareFunc is not bidsCompare and compareFunc is not asksCompare:
+    return _sortAndInsertScan(book, update, compareFunc)
+  keys = [_bookKey(row[0], compareFunc) for row in book]
+  for updateEntry in update:
+    key = _bookKey(updateEntry[0], compareFunc)
+    j = bisect.bisect_left(keys, key)
+    if j < len(keys) and keys[j] == key:
+      if float(updateEntry[1]) > 0.0:
+        book[j] = updateEntry
+      else:
+        del keys[j]
+        del book[j]
+    elif float(updateEntry[1]) > 0.0:
+      keys.insert(j, key)
+      book.insert(j, updateEntry)
+  return book
+
+def _sortAndInsertScan(book, update, compareFunc):
   for updateEntry in update:
     entrySet = False
     for j in range(len(book)):
@@ -71,26 +104,293 @@ def sortAndInsert(book, update, compareFunc):
       book.append(updateEntry)
   return book
 
+class _BookSide:
+  # sorted numeric keys plus the [price, size] rows in the same order; rows are what callbacks see.
+  # A side always keeps every level; a depth cap only limits what callbacks see, since the levels
+  # below the cap are needed once the ones above them are removed.
+  __slots__ = ('keys', 'rows', 'sign')
+
+  def __init__(self, sign):
+    self.keys = []
+    self.rows = []
+    self.sign = sign
+
+  def load(self, rows):
+    rows = [[r[0], r[1]] for r in rows if float(r[1]) > 0.0]
+    rows.sort(key = lambda r: self.sign * float(r[0]))
+    self.rows[:] = rows
+    self.keys[:] = [self.sign * float(r[0]) for r in rows]
+
+  # With depth, the changes describe the top `depth` levels: updates inside them, levels that moved
+  # into them (as their current row) and levels that left them (with size '0').
+  def apply(self, update, depth):
+    keys, rows, changed = self.keys, self.rows, []
+    if depth is not None:
+      before = dict(zip(keys[:depth], rows[:depth]))
+      last = {}
+    for entry in update:
+      key = self.sign * float(entry[0])
+      live = float(entry[1]) > 0.0
+      j = bisect.bisect_left(keys, key)
+      if j < len(keys) and keys[j] == key:
+        if live:
+          rows[j] = [entry[0], entry[1]]
+        else:
+          del keys[j]
+          del rows[j]
+      elif live:
+        keys.insert(j, key)
+        rows.insert(j, [entry[0], entry[1]])
+      else:
+        continue
+      if depth is None:
+        changed.append([entry[0], entry[1]])
+      else:
+        last[key] = entry
+    if depth is None:
+      return changed
+    after = set(keys[:depth])
+    for key, entry in last.items():
+      if key in after:
+        changed.append([entry[0], entry[1]])
+      elif key in before:
+        changed.append([entry[0], '0'])
+    for j in range(min(depth, len(keys))):
+      if keys[j] not in before and keys[j] not in last:
+        changed.append(list(rows[j]))
+    for key, row in before.items():
+      if key not in after and key not in last:
+        changed.append([row[0], '0'])
+    return changed
+
+# events held per book while its snapshot is in flight; overflow drops the oldest, which the replay then sees as a gap
+_BOOK_BUFFER_MAX = 10000
+
+class LocalBook(dict):
+  # still a dict with the old bids/asks/nonce/market keys so existing callbacks keep working
+  def __init__(self, market, depth = None, changesOnly = False):
+    dict.__init__(self)
+    self._bids = _BookSide(-1.0)
+    self._asks = _BookSide(1.0)
+    self.depth = depth
+    self.changesOnly = changesOnly
+    self.buffer = collections.deque(maxlen = _BOOK_BUFFER_MAX)
+    self.syncStarted = time.time()
+    self.stats = {'snapshots': 0, 'resyncs': 0, 'replayed': 0, 'stale': 0, 'staleSnapshots': 0, 'overflow': 0, 'lastMs': 0.0, 'maxMs': 0.0, 'totalMs': 0.0}
+    self['market'] = market
+    self['bids'] = self._bids.rows
+    self['asks'] = self._asks.rows
+    self['nonce'] = None
+
+  def load(self, response):
+    self._bids.load(response.get('bids', []))
+    self._asks.load(response.get('asks', []))
+    self['nonce'] = response['nonce']
+
+  def apply(self, message):
+    changes = {'market': self['market'], 'nonce': message['nonce'], 'snapshot': False}
+    changes['bids'] = self._bids.apply(message.get('bids', []), self.depth)
+    changes['asks'] = self._asks.apply(message.get('asks', []), self.depth)
+    self['nonce'] = message['nonce']
+    return changes
+
+  def snapshotChanges(self):
+    return {'market': self['market'], 'nonce': self['nonce'], 'bids': self._bids.rows[:self.depth], 'asks': self._asks.rows[:self.depth], 'snapshot': True}
+
+  # until the next snapshot arrives the rows are stale and incremental events are buffered, not applied
+  def invalidate(self):
+    if self['nonce'] is not None:
+      self.syncStarted = time.time()
+    self['nonce'] = None
+    self.buffer.clear()
+
+  def hold(self, message):
+    if len(self.buffer) == self.buffer.maxlen:
+      self.stats['overflow'] += 1
+    self.buffer.append(message)
+
+  # Applies the snapshot, then replays the buffered events newer than it. Returns False when the
+  # buffer does not continue the snapshot (lost events); the book then stays invalid and needs a new snapshot.
+  # Returns None when the book is valid and already at or past the snapshot's nonce: the snapshot is ignored.
+  def sync(self, response):
+    if self['nonce'] is not None and response['nonce'] <= self['nonce']:
+      self.stats['staleSnapshots'] += 1
+      return None
+    self.load(response)
+    for message in self.buffer:
+      if message['nonce'] <= self['nonce']:
+        self.stats['stale'] += 1
+        continue
+      if message['nonce'] != self['nonce'] + 1:
+        self['nonce'] = None
+        self.buffer.clear()
+        return False
+      self.apply(message)
+      self.stats['replayed'] += 1
+    self.buffer.clear()
+    ms = (time.time() - self.syncStarted) * 1000.0
+    self.stats['snapshots'] += 1
+    self.stats['lastMs'] = ms
+    self.stats['totalMs'] += ms
+    self.stats['maxMs'] = max(self.stats['maxMs'], ms)
+    return True
+
+  def bestBid(self):
+    rows = self._bids.rows
+    return rows[0] if rows else None
+
+  def bestAsk(self):
+    rows = self._asks.rows
+    return rows[0] if rows else None
+
+  # n = None: every level up to the depth cap
+  def top(self, n = 1):
+    if self.depth is not None:
+      n = self.depth if n is None else min(n, self.depth)
+    return {'bids': self._bids.rows[:n], 'asks': self._asks.rows[:n], 'nonce': self['nonce'], 'market': self['market']}
+
+# Resync protocol: while a book has no snapshot its events are buffered; the getBook answer is applied and
+# the buffered events with a newer nonce are replayed on top, so nothing between snapshot and stream is lost.
 def processLocalBook(ws, message):
   if('action' in message):
     if(message['action'] == 'getBook'):
       market = message['response']['market']
-      ws.localBook[market]['bids'] = message['response']['bids']
-      ws.localBook[market]['asks'] = message['response']['asks']
-      ws.localBook[market]['nonce'] = message['response']['nonce']
-      ws.localBook[market]['market'] = market
+      book = ws.localBook[market]
+      synced = book.sync(message['response'])
+      if(synced is None):
+        return
+      if(not synced):
+        ws.resnapshotBooks([market])
+        return
+      changes = book.snapshotChanges()
   elif('event' in message):
     if(message['event'] == 'book'):
       market = message['market']
+      book = ws.localBook[market]
+      if(book['nonce'] is None):
+        book.hold(message)
+        return
 
-      if(message['nonce'] != ws.localBook[market]['nonce'] + 1):
-        ws.makeLocalBook(market, ws.callbacks['localBookUser'][market])
+      if(message['nonce'] != book['nonce'] + 1):
+        if(message['nonce'] <= book['nonce']):
+          return
+        book.stats['resyncs'] += 1
+        ws.resnapshotBooks([market])
+        book.hold(message)
+        return
+      changes = book.apply(message)
+      if(book.changesOnly and not changes['bids'] and not changes['asks']):
         return
-      ws.localBook[market]['bids'] = sortAndInsert(ws.localBook[market]['bids'], message['bids'], bidsCompare)
-      ws.localBook[market]['asks'] = sortAndInsert(ws.localBook[market]['asks'], message['asks'], asksCompare)
-      ws.localBook[market]['nonce'] = message['nonce']
 
-  ws.callbacks['subscriptionBookUser'][market](ws.localBook[market])
+  if(book.changesOnly):
+    ws.deliver(market, ws.callbacks['subscriptionBookUser'][market], changes)
+  elif(ws.pool is None and book.depth is None):
+    ws.deliver(market, ws.callbacks['subscriptionBookUser'][market], book)
+  else:
+    # capped view; a worker must not see the live rows while the receive thread mutates them
+    ws.deliver(market, ws.callbacks['subscriptionBookUser'][market], book.top(None))
+
+# action -> callbacks key; getBook is handled separately because it also feeds the local book
+_ACTION_CALLBACKS = {
+  'getTime': 'time',
+  'getMarkets': 'markets',
+  'getAssets': 'assets',
+  'getTrades': 'publicTrades',
+  'getCandles': 'candles',
+  'getTicker24h': 'ticker24h',
+  'getTickerPrice': 'tickerPrice',
+  'getTickerBook': 'tickerBook',
+  'privateCreateOrder': 'placeOrder',
+  'privateUpdateOrder': 'updateOrder',
+  'privateGetOrder': 'getOrder',
+  'privateCancelOrder': 'cancelOrder',
+  'privateGetOrders': 'getOrders',
+  'privateGetOrdersOpen': 'ordersOpen',
+  'privateGetTrades': 'trades',
+  'privateGetAccount': 'account',
+  'privateGetFees': 'fees',
+  'privateGetBalance': 'balance',
+  'privateDepositAssets': 'depositAssets',
+  'privateWithdrawAssets': 'withdrawAssets',
+  'privateGetDepositHistory': 'depositHistory',
+  'privateGetWithdrawalHistory': 'withdrawalHistory',
+  'privateCancelOrders': 'cancelOrders',
+}
+
+# channel name -> callbacks key(s); candles are keyed 'candles:<interval>' in subscription sets
+_SUBSCRIPTION_KEYS = (
+  ('ticker', 'subscriptionTicker'),
+  ('ticker24h', 'subscriptionTicker24h'),
+  ('account', 'subscriptionAccount'),
+  ('trades', 'subscriptionTrades'),
+  ('book', 'subscriptionBookUpdate'),
+  ('book', 'subscriptionBookUser'),
+)
+
+def _marketList(market):
+  return [market] if isinstance(market, str) else list(market)
+
+def _channelKey(channel):
+  return 'candles:' + channel['interval'][0] if channel['name'] == 'candles' else channel['name']
+
+# {'ticker': {'BTC-EUR', ...}, 'candles:1m': {...}} -> one frame holding every channel
+def subscriptionFrame(action, sets):
+  channels = []
+  for key in sorted(sets):
+    if not sets[key]:
+      continue
+    if key.startswith('candles:'):
+      channels.append({ 'name': 'candles', 'interval': [key[8:]], 'markets': sorted(sets[key]) })
+    else:
+      channels.append({ 'name': key, 'markets': sorted(sets[key]) })
+  return { 'action': action, 'channels': channels }
+
+# Runs user callbacks off the receive thread. Every key (market or action) maps to one worker,
+# so callbacks for a market stay in order; a full queue drops the message and counts it.
+class callbackPool:
+  def __init__(self, workers, maxQueue, onError):
+    self.queues = [queue.Queue(maxQueue) for _ in range(workers)]
+    self.onError = onError
+    self.submitted = 0
+    self.dropped = 0
+    for q in self.queues:
+      thread = threading.Thread(target = self.run, args = (q,))
+      thread.daemon = True
+      thread.start()
+
+  def submit(self, key, callback, arg):
+    try:
+      self.queues[hash(key) % len(self.queues)].put_nowait((callback, arg))
+      self.submitted += 1
+    except queue.Full:
+      self.dropped += 1
+
+  def run(self, q):
+    while True:
+      item = q.get()
+      if item is None:
+        return
+      try:
+        item[0](item[1])
+      except Exception as e:
+        self.onError(e)
+
+  def close(self):
+    for q in self.queues:
+      try:
+        q.put_nowait(None)
+      except queue.Full:
+        pass
+
+  def stats(self):
+    return {'workers': len(self.queues), 'submitted': self.submitted, 'dropped': self.dropped, 'queued': sum(q.qsize() for q in self.queues)}
+
+# Raised through a request future when the server answers a requestId with an error frame.
+class requestError(Exception):
+  def __init__(self, response):
+    Exception.__init__(self, response.get('error'))
+    self.errorCode = response.get('errorCode')
+    self.response = response
 
 class rateLimitThread (threading.Thread):
   def __init__(self, reset, bitvavo):
@@ -141,6 +441,9 @@ class Bitvavo:
     self.rateLimitRemaining = 1000
     self.rateLimitReset = 0
     self.timeout = None
+    self.decoder = None
+    self.wsWorkers = 0
+    self.wsQueue = 1024
     global debugging
     debugging = False
     for key in options:
@@ -157,7 +460,13 @@ class Bitvavo:
       elif key.lower() == "wsurl":
         self.wsUrl = options[key]
       elif key.lower() == "timeout":
-        self.timeout = options[key]        
+        self.timeout = options[key]
+      elif key.lower() == "decoder":
+        self.decoder = options[key]
+      elif key.lower() == "wsworkers":
+        self.wsWorkers = int(options[key])
+      elif key.lower() == "wsqueue":
+        self.wsQueue = int(options[key])
     if(self.ACCESSWINDOW == None):
       self.ACCESSWINDOW = 10000
 
@@ -186,43 +495,50 @@ class Bitvavo:
           self.rateLimitThread.start()
 
 
-  def publicRequest(self, url):
-    debugToConsole("REQUEST: " + url)
-    if(self.APIKEY != ''):
-      now = int(time.time() * 1000)
-      sig = createSignature(now, 'GET', url.replace(self.base, ''), None, self.APISECRET)
-      headers = {
-        'bitvavo-access-key': self.APIKEY,
-        'bitvavo-access-signature': sig,
-        'bitvavo-access-timestamp': str(now),
-        'bitvavo-access-window': str(self.ACCESSWINDOW)
-      }
-      r = requests.get(url, headers = headers, timeout = self.timeout)
-    else:
-      r = requests.get(url, timeout = self.timeout)
-    if('error' in r.json()):
-      self.updateRateLimit(r.json())
-    else:
-      self.updateRateLimit(r.headers)
-    return r.json()
+  # headers/rate-limit handling shared with the asyncio client (python_bitvavo_api.aio)
+  def publicHeaders(self, url):
+    if(self.APIKEY == ''):
+      return None
+    now = int(time.time() * 1000)
+    sig = createSignature(now, 'GET', url.replace(self.base, ''), None, self.APISECRET)
+    return {
+      'bitvavo-access-key': self.APIKEY,
+      'bitvavo-access-signature': sig,
+      'bitvavo-access-timestamp': str(now),
+      'bitvavo-access-window': str(self.ACCESSWINDOW)
+    }
 
-  def privateRequest(self, endpoint, postfix, body = None, method = 'GET'):
+  def privateHeaders(self, endpoint, postfix, body, method):
     now = int(time.time() * 1000)
     sig = createSignature(now, method, (endpoint + postfix), body, self.APISECRET)
-    url = self.base + endpoint + postfix
-    headers = {
+    return {
       'bitvavo-access-key': self.APIKEY,
       'bitvavo-access-signature': sig,
       'bitvavo-access-timestamp': str(now),
       'bitvavo-access-window': str(self.ACCESSWINDOW),
     }
+
+  def trackRateLimit(self, data, headers):
+    if(isinstance(data, dict) and 'error' in data):
+      self.updateRateLimit(data)
+    else:
+      self.updateRateLimit(headers)
+
+  def publicRequest(self, url):
+    debugToConsole("REQUEST: " + url)
+    r = requests.get(url, headers = self.publicHeaders(url), timeout = self.timeout)
+    data = r.json()
+    self.trackRateLimit(data, r.headers)
+    return data
+
+  def privateRequest(self, endpoint, postfix, body = None, method = 'GET'):
+    url = self.base + endpoint + postfix
+    headers = self.privateHeaders(endpoint, postfix, body, method)
     debugToConsole("REQUEST: " + url)
     r = requests.request(method, url, headers=headers, json=body, timeout=self.timeout)
-    if 'error' in r.json():
-      self.updateRateLimit(r.json())
-    else:
-      self.updateRateLimit(r.headers)
-    return r.json()
+    data = r.json()
+    self.trackRateLimit(data, r.headers)
+    return data
 
   def time(self):
     return self.publicRequest((self.base + '/time'))
@@ -379,10 +695,44 @@ class Bitvavo:
       self.keepAlive = True
       self.reconnect = False
       self.reconnectTimer = 0.1
+      self.connectCount = 0
       self.bitvavo = bitvavo
+      self.initDispatch(bitvavo.decoder, bitvavo.wsWorkers, bitvavo.wsQueue)
+      self.requestTimeout = 30
+      self.requestSeq = 0
+      self.requestLock = threading.Lock()
+      self.pending = {}
+      self.subscriptions = {}
+      self.requestedSubs = {}
+      self.subscribeTimeout = 10
+      self.batching = 0
+      self.pendingSnapshots = set()
 
       self.subscribe()
 
+    # decoder: callable(frame) -> dict; workers > 0 runs user callbacks on a callbackPool
+    def initDispatch(self, decoder = None, workers = 0, maxQueue = 1024):
+      self.decoder = _default(decoder, _loads)
+      self.pool = callbackPool(workers, maxQueue, self._onCallbackError) if workers else None
+      self._eventHandlers = {
+        'authenticate': self._onAuthenticate,
+        'fill': self._onAccount,
+        'order': self._onAccount,
+        'ticker': self._onTicker,
+        'ticker24h': self._onTicker24h,
+        'candle': self._onCandle,
+        'book': self._onBook,
+        'trade': self._onTrade,
+        'subscribed': self._onSubscribed,
+        'unsubscribed': self._onSubscribed,
+      }
+
+    def _onCallbackError(self, error):
+      if 'error' in self.callbacks:
+        self.callbacks['error'](error)
+      else:
+        errorToConsole(repr(error))
+
     def subscribe(self):
       websocket.enableTrace(False)
       ws = websocket.WebSocketApp(self.wsUrl, 
@@ -404,13 +754,78 @@ class Bitvavo:
       self.ws.close()
       self.keepAlive = False
       self.receiveThread.join()
+      if self.pool is not None:
+        self.pool.close()
 
     def waitForSocket(self, ws, message, private):
-      if (not private and self.open) or (private and self.authenticated and self.open):
-        return
-      else:
+      # a loop, not recursion: a socket that stays down for minutes must not hit the recursion limit
+      while not ((not private and self.open) or (private and self.authenticated and self.open)):
         time.sleep(0.1)
-        self.waitForSocket(ws, message, private)
+
+    def waitForSocketUntil(self, private, deadline):
+      while not ((not private and self.open) or (private and self.authenticated and self.open)):
+        if time.time() >= deadline:
+          return False
+        time.sleep(0.05)
+      return True
+
+    # Tags body with a requestId and returns a concurrent.futures.Future resolved with the response
+    # (or requestError / TimeoutError / ConnectionError). Many threads can wait on one socket.
+    def requestFuture(self, body, private = False, timeout = None):
+      future = concurrent.futures.Future()
+      if private and self.APIKEY == '':
+        future.set_exception(requestError({'errorCode': 0, 'error': 'You did not set the API key, but requested a private function.'}))
+        return future
+      now = time.time()
+      deadline = now + _default(timeout, self.requestTimeout)
+      with self.requestLock:
+        self.requestSeq += 1
+        requestId = self.requestSeq
+        expired = [rid for rid, entry in self.pending.items() if entry[1] < now]
+        stale = [self.pending.pop(rid)[0] for rid in expired]
+        self.pending[requestId] = (future, deadline)
+      for f in stale:
+        if not f.done():
+          f.set_exception(concurrent.futures.TimeoutError('no response'))
+      future.add_done_callback(lambda f: self.pending.pop(requestId, None))
+      body['requestId'] = requestId
+      if not self.waitForSocketUntil(private, deadline):
+        if not future.done():
+          future.set_exception(concurrent.futures.TimeoutError('socket not ready'))
+        return future
+      message = json.dumps(body)
+      try:
+        self.ws.send(message)
+      except Exception as e:
+        if not future.done():
+          future.set_exception(ConnectionError(str(e)))
+        return future
+      if debugging:
+        debugToConsole('SENT: ' + message)
+      return future
+
+    def resolveRequest(self, msg):
+      with self.requestLock:
+        entry = self.pending.pop(msg.get('requestId'), None)
+      if entry is None:
+        return False
+      future = entry[0]
+      try:
+        if 'error' in msg:
+          future.set_exception(requestError(msg))
+        else:
+          future.set_result(msg.get('response'))
+      except concurrent.futures.InvalidStateError:
+        pass  # the caller gave up and cancelled it
+      return True
+
+    def failPending(self, error):
+      with self.requestLock:
+        entries = list(self.pending.values())
+        self.pending.clear()
+      for future, deadline in entries:
+        if not future.done():
+          future.set_exception(error)
 
     def doSend(self, ws, message, private = False):
       if private and self.APIKEY == '':
@@ -421,10 +836,18 @@ class Bitvavo:
       debugToConsole('SENT: ' + message)
 
     def on_message(self, ws, msg):
-      debugToConsole('RECEIVED: ' + msg)
-      msg = json.loads(msg)
+      if debugging:
+        debugToConsole('RECEIVED: ' + (msg if isinstance(msg, str) else msg.decode()))
+      msg = self.decoder(msg)
       callbacks = self.callbacks
 
+      # only requestFuture tags requests; a late answer whose future already timed out is dropped here
+      if 'requestId' in msg:
+        self.resolveRequest(msg)
+        if msg.get('errorCode') == 105:
+          self.bitvavo.updateRateLimit(msg)
+        return
+
       if 'error' in msg:
         if msg['errorCode'] == 105:
           self.bitvavo.updateRateLimit(msg)
@@ -432,94 +855,70 @@ class Bitvavo:
           callbacks['error'](msg)
         else:
           errorToConsole(json.dumps(msg, indent=2))
+        return
+
+      action = msg.get('action')
+      if action is not None:
+        name = _ACTION_CALLBACKS.get(action)
+        if name is not None:
+          self.deliver(action, callbacks[name], msg['response'])
+        elif action == 'getBook':
+          self._onGetBook(msg)
+      else:
+        handler = self._eventHandlers.get(msg.get('event'))
+        if handler is not None:
+          handler(msg)
+
+    def deliver(self, key, callback, arg):
+      if self.pool is None:
+        callback(arg)
+      else:
+        self.pool.submit(key, callback, arg)
+
+    def dispatchStats(self):
+      if self.pool is None:
+        return {'workers': 0, 'submitted': 0, 'dropped': 0, 'queued': 0}
+      return self.pool.stats()
+
+    def _onGetBook(self, msg):
+      market = msg['response']['market']
+      if 'book' in self.callbacks:
+        self.deliver(market, self.callbacks['book'], msg['response'])
+      if self.keepBookCopy and market in self.callbacks.get('subscriptionBook', {}):
+        self.callbacks['subscriptionBook'][market](self, msg)
+
+    def _onAuthenticate(self, msg):
+      self.authenticated = True
+      debugToConsole('Authenticated Websocket.')
+
+    def _onAccount(self, msg):
+      market = msg['market']
+      self.deliver(market, self.callbacks['subscriptionAccount'][market], msg)
+
+    def _onTicker(self, msg):
+      market = msg['market']
+      self.deliver(market, self.callbacks['subscriptionTicker'][market], msg)
+
+    def _onTicker24h(self, msg):
+      for entry in msg['data']:
+        self.deliver(entry['market'], self.callbacks['subscriptionTicker24h'][entry['market']], entry)
+
+    def _onCandle(self, msg):
+      market = msg['market']
+      self.deliver(market, self.callbacks['subscriptionCandles'][market][msg['interval']], msg)
+
+    def _onBook(self, msg):
+      market = msg['market']
+      callbacks = self.callbacks
+      if market in callbacks.get('subscriptionBookUpdate', {}):
+        self.deliver(market, callbacks['subscriptionBookUpdate'][market], msg)
+      if self.keepBookCopy and market in callbacks.get('subscriptionBook', {}):
+        callbacks['subscriptionBook'][market](self, msg)
 
-      if 'action' in msg:
-        if(msg['action'] == 'getTime'):
-          callbacks['time'](msg['response'])
-        elif(msg['action'] == 'getMarkets'):
-          callbacks['markets'](msg['response'])
-        elif(msg['action'] == 'getAssets'):
-          callbacks['assets'](msg['response'])
-        elif(msg['action'] == 'getTrades'):
-          callbacks['publicTrades'](msg['response'])
-        elif(msg['action'] == 'getCandles'):
-          callbacks['candles'](msg['response'])
-        elif(msg['action'] == 'getTicker24h'):
-          callbacks['ticker24h'](msg['response'])
-        elif(msg['action'] == 'getTickerPrice'):
-          callbacks['tickerPrice'](msg['response'])
-        elif(msg['action'] == 'getTickerBook'):
-          callbacks['tickerBook'](msg['response'])
-        elif(msg['action'] == 'privateCreateOrder'):
-          callbacks['placeOrder'](msg['response'])
-        elif(msg['action'] == 'privateUpdateOrder'):
-          callbacks['updateOrder'](msg['response'])
-        elif(msg['action'] == 'privateGetOrder'):
-          callbacks['getOrder'](msg['response'])
-        elif(msg['action'] == 'privateCancelOrder'):
-          callbacks['cancelOrder'](msg['response'])
-        elif(msg['action'] == 'privateGetOrders'):
-          callbacks['getOrders'](msg['response'])
-        elif(msg['action'] == 'privateGetOrdersOpen'):
-          callbacks['ordersOpen'](msg['response'])
-        elif(msg['action'] == 'privateGetTrades'):
-          callbacks['trades'](msg['response'])
-        elif(msg['action'] == 'privateGetAccount'):
-          callbacks['account'](msg['response'])
-        elif(msg['action'] == 'privateGetFees'):
-          callbacks['fees'](msg['response'])
-        elif(msg['action'] == 'privateGetBalance'):
-          callbacks['balance'](msg['response'])
-        elif(msg['action'] == 'privateDepositAssets'):
-          callbacks['depositAssets'](msg['response'])
-        elif(msg['action'] == 'privateWithdrawAssets'):
-          callbacks['withdrawAssets'](msg['response'])
-        elif(msg['action'] == 'privateGetDepositHistory'):
-          callbacks['depositHistory'](msg['response'])
-        elif(msg['action'] == 'privateGetWithdrawalHistory'):
-          callbacks['withdrawalHistory'](msg['response'])
-        elif(msg['action'] == 'privateCancelOrders'):
-          callbacks['cancelOrders'](msg['response'])
-        elif(msg['action'] == 'getBook'):
-          market = msg['response']['market']
-          if('book' in callbacks):
-            callbacks['book'](msg['response'])
-          if(self.keepBookCopy):
-            if(market in callbacks['subscriptionBook']):
-              callbacks['subscriptionBook'][market](ws, msg)
-
-      elif('event' in msg):
-        if(msg['event'] == 'authenticate'):
-          self.authenticated = True
-          debugToConsole('Authenticated Websocket.')
-        elif(msg['event'] == 'fill'):
-          market = msg['market']
-          callbacks['subscriptionAccount'][market](msg)
-        elif(msg['event'] == 'order'):
-          market = msg['market']
-          callbacks['subscriptionAccount'][market](msg)
-        elif(msg['event'] == 'ticker'):
-          market = msg['market']
-          callbacks['subscriptionTicker'][market](msg)
-        elif(msg['event'] == 'ticker24h'):
-          for entry in msg['data']:
-            callbacks['subscriptionTicker24h'][entry['market']](entry)
-        elif(msg['event'] == 'candle'):
-          market = msg['market']
-          interval = msg['interval']
-          callbacks['subscriptionCandles'][market][interval](msg)
-        elif(msg['event'] == 'book'):
-          market = msg['market']
-          if('subscriptionBookUpdate' in callbacks):
-            if(market in callbacks['subscriptionBookUpdate']):
-              callbacks['subscriptionBookUpdate'][market](msg)
-          if(self.keepBookCopy):
-            if(market in callbacks['subscriptionBook']):
-              callbacks['subscriptionBook'][market](ws, msg)
-        elif(msg['event'] == 'trade'):
-          market = msg['market']
-          if('subscriptionTrades' in callbacks):
-            callbacks['subscriptionTrades'][market](msg)
+    def _onTrade(self, msg):
+      market = msg['market']
+      if 'subscriptionTrades' in self.callbacks:
+        self.deliver(market, self.callbacks['subscriptionTrades'][market], msg)
 
     def on_error(self, ws, error):
       if 'error' in self.callbacks:
@@ -527,37 +926,144 @@ class Bitvavo:
       else:
         errorToConsole(error)
 
-    def on_close(self, ws):
-      self.receiveThread.exit()
+    # websocket-client >= 1.0 passes (ws, close_status_code, close_msg)
+    def on_close(self, ws, *args):
+      self.open = False
+      # responses to requests sent on this connection will never arrive, and its subscriptions are gone
+      self.failPending(ConnectionError('websocket closed'))
+      self.subscriptions = {}
+      self.requestedSubs = {}
       debugToConsole('Closed Websocket.')
 
     def checkReconnect(self):
-      if('subscriptionTicker' in self.callbacks):
-        for market in self.callbacks['subscriptionTicker']:
-          self.subscriptionTicker(market, self.callbacks['subscriptionTicker'][market])
-      if('subscriptionTicker24h' in self.callbacks):
-        for market in self.callbacks['subscriptionTicker24h']:
-          self.subscriptionTicker(market, self.callbacks['subscriptionTicker24h'][market])
-      if('subscriptionAccount' in self.callbacks):
-        for market in self.callbacks['subscriptionAccount']:
-          self.subscriptionAccount(market, self.callbacks['subscriptionAccount'][market])
-      if('subscriptionCandles' in self.callbacks):
-        for market in self.callbacks['subscriptionCandles']:
-          for interval in self.callbacks['subscriptionCandles'][market]:
-            self.subscriptionCandles(market, interval, self.callbacks['subscriptionCandles'][market][interval])
-      if('subscriptionTrades' in self.callbacks):
-        for market in self.callbacks['subscriptionTrades']:
-          self.subscriptionTrades(market, self.callbacks['subscriptionTrades'][market])
-      if('subscriptionBookUpdate' in self.callbacks):
-        for market in self.callbacks['subscriptionBookUpdate']:
-          self.subscriptionBookUpdate(market, self.callbacks['subscriptionBookUpdate'][market])
-      if('subscriptionBookUser' in self.callbacks):
-        for market in self.callbacks['subscriptionBookUser']:
-          self.subscriptionBook(market, self.callbacks['subscriptionBookUser'][market])
+      self.reconcileSubscriptions(False)
+      if self.keepBookCopy:
+        self.resnapshotBooks()
+
+    # ---- subscription sets: desired = registered callbacks, actual = last 'subscribed'/'unsubscribed' event
+    # The subscription methods and unsubscribe change the callback dicts from other threads; iterate over snapshots.
+    def desiredSubscriptions(self):
+      wanted = {}
+      for name, key in _SUBSCRIPTION_KEYS:
+        for market in list(self.callbacks.get(key, {})):
+          wanted.setdefault(name, set()).add(market)
+      for market, intervals in list(self.callbacks.get('subscriptionCandles', {}).items()):
+        for interval in list(intervals):
+          wanted.setdefault('candles:' + interval, set()).add(market)
+      return wanted
+
+    def _onSubscribed(self, msg):
+      actual = {}
+      for name, markets in msg.get('subscriptions', {}).items():
+        if isinstance(markets, dict):
+          for interval, ms in markets.items():
+            actual['candles:' + interval] = set(ms)
+        else:
+          actual[name] = set(markets)
+      self.subscriptions = actual
+      for key, markets in actual.items():
+        self._dropRequested(key, markets)
+
+    # requestedSubs: key -> {market: time sent}; a subscribe that is neither confirmed nor answered
+    # within subscribeTimeout (rejected or lost) stops counting as in flight, so reconcile sends it again.
+    def _markRequested(self, key, markets):
+      now = time.monotonic()
+      self.requestedSubs.setdefault(key, {}).update(dict.fromkeys(markets, now))
+
+    def _dropRequested(self, key, markets):
+      sent = self.requestedSubs.get(key)
+      if sent:
+        for market in markets:
+          sent.pop(market, None)
+
+    def _inFlight(self, key):
+      cutoff = time.monotonic() - self.subscribeTimeout
+      sent = self.requestedSubs.get(key, {})
+      return {market for market, at in list(sent.items()) if at > cutoff}
+
+    def subscriptionDiff(self):
+      wanted, actual = self.desiredSubscriptions(), self.subscriptions
+      missing, extra = {}, {}
+      for key, markets in wanted.items():
+        todo = markets - actual.get(key, set()) - self._inFlight(key)
+        if todo:
+          missing[key] = todo
+      for key, markets in actual.items():
+        gone = markets - wanted.get(key, set())
+        if gone:
+          extra[key] = gone
+      return missing, extra
+
+    def subscriptionStatus(self):
+      missing, extra = self.subscriptionDiff()
+      return {'desired': sum(len(m) for m in self.desiredSubscriptions().values()),
+              'actual': sum(len(m) for m in self.subscriptions.values()),
+              'missing': sum(len(m) for m in missing.values()), 'extra': sum(len(m) for m in extra.values())}
+
+    # Sends whatever is missing as one public subscribe frame (plus one private frame for account)
+    # and, with unsubscribe, drops what nobody listens to any more in one unsubscribe frame.
+    def reconcileSubscriptions(self, unsubscribe = True):
+      missing, extra = self.subscriptionDiff()
+      private = {'account': missing.pop('account')} if 'account' in missing else {}
+      for sets, isPrivate in ((missing, False), (private, True)):
+        if not sets or (isPrivate and self.APIKEY == ''):
+          continue
+        for key, markets in sets.items():
+          self._markRequested(key, markets)
+        self.doSend(self.ws, json.dumps(subscriptionFrame('subscribe', sets)), isPrivate)
+      if unsubscribe and extra:
+        for key, markets in extra.items():
+          self._dropRequested(key, markets)
+        self.doSend(self.ws, json.dumps(subscriptionFrame('unsubscribe', extra)))
+      missing.update(private)
+      return missing, extra
+
+    # Inside the block subscription methods only register callbacks; on exit everything goes out in one frame.
+    @contextlib.contextmanager
+    def batchSubscriptions(self):
+      self.batching += 1
+      try:
+        yield self
+      finally:
+        self.batching -= 1
+        if self.batching == 0:
+          self.reconcileSubscriptions(False)
+          snapshots, self.pendingSnapshots = self.pendingSnapshots, set()
+          if snapshots:
+            self.resnapshotBooks(snapshots)
+
+    # Invalidates the local books and sends every getBook back to back; the snapshots are all in flight together.
+    def resnapshotBooks(self, markets = None):
+      markets = list(self.localBook) if markets is None else list(markets)
+      for market in markets:
+        if market in self.localBook:
+          self.localBook[market].invalidate()
+      for market in markets:
+        if market in self.localBook:
+          self.doSend(self.ws, json.dumps({ 'action': 'getBook', 'market': market }))
+
+    def bookStats(self):
+      out = {'books': len(self.localBook), 'pending': 0, 'buffered': 0, 'snapshots': 0, 'resyncs': 0, 'replayed': 0,
+             'stale': 0, 'staleSnapshots': 0, 'overflow': 0, 'lastMs': 0.0, 'maxMs': 0.0, 'totalMs': 0.0}
+      for book in list(self.localBook.values()):
+        out['pending'] += book['nonce'] is None
+        out['buffered'] += len(book.buffer)
+        for key in ('snapshots', 'resyncs', 'replayed', 'stale', 'staleSnapshots', 'overflow', 'totalMs'):
+          out[key] += book.stats[key]
+        out['maxMs'] = max(out['maxMs'], book.stats['maxMs'])
+        out['lastMs'] = max(out['lastMs'], book.stats['lastMs'])
+      return out
+
+    def _subscribe(self, channel, private = False):
+      if self.batching:
+        return
+      self._markRequested(_channelKey(channel), channel['markets'])
+      self.doSend(self.ws, json.dumps({ 'action': 'subscribe', 'channels': [channel] }), private)
 
     def on_open(self, ws):
       now = int(time.time()*1000)
       self.open = True
+      self.connectCount += 1
       self.reconnectTimer = 0.5
       if self.APIKEY != '':
         self.doSend(self.ws, json.dumps({ 'window':str(self.ACCESSWINDOW), 'action': 'authenticate', 'key': self.APIKEY, 'signature': createSignature(now, 'GET', '/websocket', {}, self.APISECRET), 'timestamp': now }))
@@ -637,6 +1143,13 @@ class Bitvavo:
       body['action'] = 'privateCreateOrder'
       self.doSend(self.ws, json.dumps(body), True)
 
+    def placeOrderFuture(self, market, side, orderType, body, timeout = None):
+      body['market'] = market
+      body['side'] = side
+      body['orderType'] = orderType
+      body['action'] = 'privateCreateOrder'
+      return self.requestFuture(body, True, timeout)
+
     def getOrder(self, market, orderId, callback):
       self.callbacks['getOrder'] = callback
       options = { 'action': 'privateGetOrder', 'market': market, 'orderId': orderId }
@@ -646,6 +1159,9 @@ class Bitvavo:
     #          untriggered stopLoss/takeProfit:(amount, amountQuote, disableMarketProtection, triggerType, triggerReference, triggerAmount)
     #                      stopLossLimit/takeProfitLimit: (amount, price, postOnly, triggerType, triggerReference, triggerAmount)
     #          all orderTypes: operatorId
+    def getOrderFuture(self, market, orderId, timeout = None):
+      return self.requestFuture({ 'action': 'privateGetOrder', 'market': market, 'orderId': orderId }, True, timeout)
+
     def updateOrder(self, market, orderId, body, callback):
       self.callbacks['updateOrder'] = callback
       body['market'] = market
@@ -660,6 +1176,18 @@ class Bitvavo:
         options['operatorId'] = operatorId
       self.doSend(self.ws, json.dumps(options), True)
 
+    def updateOrderFuture(self, market, orderId, body, timeout = None):
+      body['market'] = market
+      body['orderId'] = orderId
+      body['action'] = 'privateUpdateOrder'
+      return self.requestFuture(body, True, timeout)
+
+    def cancelOrderFuture(self, market, orderId, operatorId = None, timeout = None):
+      options = { 'action': 'privateCancelOrder', 'market': market, 'orderId': orderId }
+      if operatorId is not None:
+        options['operatorId'] = operatorId
+      return self.requestFuture(options, True, timeout)
+
     # options: limit, start, end, orderIdFrom, orderIdTo
     def getOrders(self, market, options, callback):
       self.callbacks['getOrders'] = callback
@@ -728,53 +1256,92 @@ class Bitvavo:
       options['action'] = 'privateGetWithdrawalHistory'
       self.doSend(self.ws, json.dumps(options), True)
 
+    # Drops the callbacks (so a reconnect will not restore the channel) and sends one unsubscribe frame.
+    def unsubscribe(self, name, market, interval = None):
+      markets = _marketList(market)
+      for m in markets:
+        if name == 'candles':
+          self.callbacks.get('subscriptionCandles', {}).get(m, {}).pop(interval, None)
+          continue
+        for channel, key in _SUBSCRIPTION_KEYS:
+          if channel == name:
+            self.callbacks.get(key, {}).pop(m, None)
+        if name == 'book':
+          self.callbacks.get('subscriptionBook', {}).pop(m, None)
+          self.localBook.pop(m, None)
+      channel = { 'name': name, 'markets': markets }
+      if name == 'candles':
+        channel['interval'] = [interval]
+      self._dropRequested(_channelKey(channel), markets)
+      if self.open:
+        self.doSend(self.ws, json.dumps({ 'action': 'unsubscribe', 'channels': [channel] }))
+
+    # market may be one market or a list of markets; a list goes out as a single subscribe frame
     def subscriptionTicker(self, market, callback):
+      markets = _marketList(market)
       if 'subscriptionTicker' not in self.callbacks:
         self.callbacks['subscriptionTicker'] = {}
-      self.callbacks['subscriptionTicker'][market] = callback
-      self.doSend(self.ws, json.dumps({ 'action': 'subscribe', 'channels': [{ 'name': 'ticker', 'markets': [market] }] }))
+      for m in markets:
+        self.callbacks['subscriptionTicker'][m] = callback
+      self._subscribe({ 'name': 'ticker', 'markets': markets })
 
     def subscriptionTicker24h(self, market, callback):
+      markets = _marketList(market)
       if 'subscriptionTicker24h' not in self.callbacks:
         self.callbacks['subscriptionTicker24h'] = {}
-      self.callbacks['subscriptionTicker24h'][market] = callback
-      self.doSend(self.ws, json.dumps({ 'action': 'subscribe', 'channels': [{ 'name': 'ticker24h', 'markets': [market] }] }))
+      for m in markets:
+        self.callbacks['subscriptionTicker24h'][m] = callback
+      self._subscribe({ 'name': 'ticker24h', 'markets': markets })
 
     def subscriptionAccount(self, market, callback):
+      markets = _marketList(market)
       if 'subscriptionAccount' not in self.callbacks:
         self.callbacks['subscriptionAccount'] = {}
-      self.callbacks['subscriptionAccount'][market] = callback
-      self.doSend(self.ws, json.dumps({ 'action': 'subscribe', 'channels': [{ 'name': 'account', 'markets': [market] }] }), True)
+      for m in markets:
+        self.callbacks['subscriptionAccount'][m] = callback
+      self._subscribe({ 'name': 'account', 'markets': markets }, True)
 
     def subscriptionCandles(self, market, interval, callback):
+      markets = _marketList(market)
       if 'subscriptionCandles' not in self.callbacks:
         self.callbacks['subscriptionCandles'] = {}
-      if market not in self.callbacks['subscriptionCandles']:
-        self.callbacks['subscriptionCandles'][market] = {}
-      self.callbacks['subscriptionCandles'][market][interval] = callback
-      self.doSend(self.ws, json.dumps({ 'action': 'subscribe', 'channels': [{ 'name': 'candles', 'interval': [interval], 'markets': [market] }] }))
+      for m in markets:
+        if m not in self.callbacks['subscriptionCandles']:
+          self.callbacks['subscriptionCandles'][m] = {}
+        self.callbacks['subscriptionCandles'][m][interval] = callback
+      self._subscribe({ 'name': 'candles', 'interval': [interval], 'markets': markets })
 
     def subscriptionTrades(self, market, callback):
+      markets = _marketList(market)
       if 'subscriptionTrades' not in self.callbacks:
         self.callbacks['subscriptionTrades'] = {}
-      self.callbacks['subscriptionTrades'][market] = callback
-      self.doSend(self.ws, json.dumps({ 'action': 'subscribe', 'channels': [{ 'name': 'trades', 'markets': [market] }] }))
+      for m in markets:
+        self.callbacks['subscriptionTrades'][m] = callback
+      self._subscribe({ 'name': 'trades', 'markets': markets })
 
     def subscriptionBookUpdate(self, market, callback):
+      markets = _marketList(market)
       if 'subscriptionBookUpdate' not in self.callbacks:
         self.callbacks['subscriptionBookUpdate'] = {}
-      self.callbacks['subscriptionBookUpdate'][market] = callback
-      self.doSend(self.ws, json.dumps({ 'action': 'subscribe', 'channels': [{ 'name': 'book', 'markets': [market] }] })) 
-
-    def subscriptionBook(self, market, callback):
+      for m in markets:
+        self.callbacks['subscriptionBookUpdate'][m] = callback
+      self._subscribe({ 'name': 'book', 'markets': markets })
+
+    # changesOnly: callback gets {'market', 'nonce', 'bids', 'asks', 'snapshot'} holding only the levels that moved (size '0' = removed)
+    # depth: callbacks see at most this many levels per side (the local book itself keeps all of them)
+    def subscriptionBook(self, market, callback, changesOnly = False, depth = None):
+      markets = _marketList(market)
       self.keepBookCopy = True
       if 'subscriptionBookUser' not in self.callbacks:
         self.callbacks['subscriptionBookUser'] = {}
-      self.callbacks['subscriptionBookUser'][market] = callback
       if 'subscriptionBook' not in self.callbacks:
         self.callbacks['subscriptionBook'] = {}
-      self.callbacks['subscriptionBook'][market] = processLocalBook
-      self.doSend(self.ws, json.dumps({ 'action': 'subscribe', 'channels': [{ 'name': 'book', 'markets': [market] }] }))
-
-      self.localBook[market] = {}
-      self.doSend(self.ws, json.dumps({ 'action': 'getBook', 'market': market }))
+      for m in markets:
+        self.localBook[m] = LocalBook(m, depth, changesOnly)
+        self.callbacks['subscriptionBookUser'][m] = callback
+        self.callbacks['subscriptionBook'][m] = processLocalBook
+      self._subscribe({ 'name': 'book', 'markets': markets })
+      if self.batching:
+        self.pendingSnapshots.update(markets)
+      else:
+        self.resnapshotBooks(markets)
@@ -20,6 +20,9 @@ setup(
         'requests>=2.31.0,<3.0.0',
         'setuptools'
     ],
+    extras_require={
+        'orjson': ['orjson>=3.9.0'],
+    },
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: ISC License (ISCL)",
@@ -1,7 +1,9 @@
 # -*- coding: utf-8 -*-
 # strategy.py — Zero-Latency Entry/Exit + Mirror-Exit (for Saqer core-1.3)
 
-import os, time, json, threading, requests
+import os, time, json, heapq, itertools, threading, requests
+from concurrent.futures import ThreadPoolExecutor
+import strategy_base
 
 # ===== إعدادات عامة =====
 HEADROOM_EUR           = 0.30
@@ -40,7 +42,15 @@ try:
 except Exception:
     R = None
 
-def read_hint(market: str) -> dict:
+HINT_TTL_SEC      = float(os.getenv("HINT_TTL_SEC","30"))     # عمر hint وصل بالدفع (حين تكون keyspace events مفعّلة)
+HINT_PULL_TTL_SEC = float(os.getenv("HINT_PULL_TTL_SEC","1"))  # عمر نتيجة السحب (≈ وتيرة الاستطلاع القديمة)
+HINT_STATS = {"push": 0, "keyspace": 0, "pull": 0, "wakes": 0, "errors": 0}
+_HINTS = {}               # market -> (hint, expires_ts)
+_HINT_THREAD = None
+_HINT_LOCK = threading.Lock()
+_KEYSPACE_OK = [False]    # SET لاحق على المفتاح يصلنا؟ وإلا فالـ hint المدفوع يعيش HINT_PULL_TTL_SEC فقط
+
+def _pull_hint(market: str) -> dict:
     # 1) Redis
     if R:
         try:
@@ -58,19 +68,80 @@ def read_hint(market: str) -> dict:
             pass
     return {}
 
+def _push_ttl() -> float:
+    # بلا keyspace events: Express قد يكتب exit_now بـ SET فقط، فلا نحجب السحب أطول من وتيرته
+    return HINT_TTL_SEC if _KEYSPACE_OK[0] else min(HINT_TTL_SEC, HINT_PULL_TTL_SEC)
+
+def _keyspace_enabled() -> bool:
+    try:
+        cfg = (R.config_get("notify-keyspace-events") or {}).get("notify-keyspace-events", "")
+    except Exception:
+        return False   # CONFIG محظور (Redis مُدار): ننتظر أول حدث keyspace
+    return "K" in cfg and any(c in cfg for c in "A$")
+
+def _hint_put(market: str, hint: dict, ttl: float):
+    _HINTS[market] = (hint, time.time() + ttl)
+    try:
+        if int(hint.get("exit_now", 0)) == 1:
+            HINT_STATS["wakes"] += 1; EXITS.wake(market)   # Mirror-Exit فوراً بدل الدورة التالية
+    except Exception:
+        pass
+
+def _hint_listener():
+    """
+    Express → هنا بالدفع: PUBLISH express:signal:<market> <json>، أو keyspace notifications على المفتاح نفسه
+    (تتطلب notify-keyspace-events يحوي K$gx في Redis). الغياب لا يكسر شيئاً: read_hint يسحب عند انتهاء الـ TTL.
+    """
+    while True:
+        try:
+            _KEYSPACE_OK[0] = _KEYSPACE_OK[0] or _keyspace_enabled()
+            ps = R.pubsub(ignore_subscribe_messages=True)
+            ps.psubscribe("express:signal:*", "__keyspace@*__:express:signal:*")
+            while True:
+                msg = ps.get_message(timeout=1.0)
+                if not msg: continue
+                ch, data = msg.get("channel") or "", msg.get("data")
+                market = ch.rsplit(":", 1)[-1]
+                if ch.startswith("__keyspace@"):
+                    HINT_STATS["keyspace"] += 1; _KEYSPACE_OK[0] = True
+                    if data == "set":
+                        s = R.get(f"express:signal:{market}")
+                        if s: _hint_put(market, json.loads(s), HINT_TTL_SEC)
+                    elif data in ("del", "expired"):
+                        _HINTS.pop(market, None)
+                else:
+                    HINT_STATS["push"] += 1
+                    _hint_put(market, json.loads(data), _push_ttl())
+        except Exception as e:
+            HINT_STATS["errors"] += 1; print("hint listener err:", e); time.sleep(1.0)
+
+def _hint_start():
+    global _HINT_THREAD
+    if not R or _HINT_THREAD is not None: return
+    with _HINT_LOCK:
+        if _HINT_THREAD is None:
+            _HINT_THREAD = threading.Thread(target=_hint_listener, daemon=True, name="hints"); _HINT_THREAD.start()
+
+def read_hint(market: str) -> dict:
+    """من كاش الدفع؛ عند الغياب/الانتهاء سحب (Redis ثم HTTP) ويُحفظ HINT_PULL_TTL_SEC."""
+    _hint_start()
+    ent = _HINTS.get(market)
+    if ent and ent[1] > time.time(): return ent[0]
+    HINT_STATS["pull"] += 1
+    hint = _pull_hint(market)
+    _HINTS[market] = (hint, time.time() + HINT_PULL_TTL_SEC)
+    return hint
+
 # ===== أدوات =====
-_NOTIFY_MUTE = {}
 def tg_once(core, key: str, text: str, window_sec: float = 20.0):
-    now = time.time(); last = _NOTIFY_MUTE.get(key, 0)
-    if now - last >= window_sec:
-        _NOTIFY_MUTE[key] = now; core.tg_send(text)
+    core.tg_once(key, text, window_sec)
 
-def _tick(core, market: str) -> float:
-    return core.price_tick(market) or (1.0 / (10 ** core.price_decimals(market)))
+def _tick(core, market: str, ref: float | None = None) -> float:
+    return core.price_tick(market, ref) or (1.0 / (10 ** core.price_decimals(market, ref)))
 
 def _clip_sell_maker(core, market: str, target: float, bid: float, ask: float) -> float:
     if ask <= 0 or bid <= 0: return target
-    return max(target, ask + EDGE_TICKS_ABOVE_ASK * _tick(core, market))
+    return max(target, ask + EDGE_TICKS_ABOVE_ASK * _tick(core, market, ask))
 
 def _remaining_from_status(st: dict, fallback_amt: float) -> float:
     try:
@@ -81,11 +152,11 @@ def _remaining_from_status(st: dict, fallback_amt: float) -> float:
 
 # ===== مؤشرات خفيفة لاختيار TP مبدئي =====
 def _fetch_candles(core, market: str, interval="1m", limit=240):
-    data = core.bv_request("GET", f"/{market}/candles?interval={interval}&limit={limit}")
-    if not isinstance(data, list): return [], [], []
-    highs = [float(r[2]) for r in data]
-    lows  = [float(r[3]) for r in data]
-    closes= [float(r[4]) for r in data]
+    data = core.candles(market, interval, limit)   # حلقة الكور في الذاكرة (من الأقدم للأحدث)
+    if not data: return [], [], []
+    highs = [r[2] for r in data]
+    lows  = [r[3] for r in data]
+    closes= [r[4] for r in data]
     return highs, lows, closes
 
 def _ema(vals, n):
@@ -95,24 +166,18 @@ def _ema(vals, n):
     for v in vals[1:]: out.append(v*k + out[-1]*(1-k))
     return out
 
-def _rsi(cl, n=14):
-    if len(cl) < n+1: return 50.0
-    gains=loss=0.0
-    for i in range(-n,0):
-        d = cl[i]-cl[i-1]
-        gains += d if d>=0 else 0.0
-        loss  += -d if d<0 else 0.0
-    loss = loss if loss>0 else 1e-9
-    rs = gains/loss
-    return 100.0-(100.0/(1.0+rs))
-
 def _choose_tp_pct(core, market: str, fallback_pct=TP_INIT_PCT_DEFAULT):
-    _,_,closes = _fetch_candles(core, market, "1m", 240)
-    if len(closes) < 210: return fallback_pct
-    ema50  = _ema(closes, 50)[-1]
-    ema200 = _ema(closes, 200)[-1]
-    trend_up = ema50 > ema200
-    rsi = _rsi(closes, 14)
+    reg = strategy_base.regime_cached(market)   # مسح REGIME_SCAN الدفعي إن لم يمضِ عليه أكثر من دورة مسح
+    if reg:
+        trend_up, rsi = reg["trend_up"], reg["rsi"]
+    else:
+        # حالة EMA50/EMA200 متدفقة (strategy_base.RegimeStream) = _ema(closes[-240:]) دون إعادة الحساب
+        rs, cur = strategy_base.regime_stream(core, market, "1m", 240)
+        if rs is None or min(rs.n + 1, rs.window) < 210: return fallback_pct
+        c = cur[4]
+        with rs.lock:
+            trend_up = rs.ema_fast.peek(c) > rs.ema_slow.peek(c)
+            rsi = rs.rsi.peek(c) or 50.0   # نفس RSI المسح الدفعي وmarket_regime
     if rsi >= 75: base = 0.55
     elif rsi <= 40: base = 0.40 if not trend_up else 0.55
     else: base = 0.60 if trend_up else 0.50
@@ -122,13 +187,18 @@ def _choose_tp_pct(core, market: str, fallback_pct=TP_INIT_PCT_DEFAULT):
 def chase_buy(core, market:str, spend_eur:float, entry_hint:float|None=None,
               max_window_sec:float=ENTRY_MAX_WINDOW_SEC, reprice_max_wait:float=ENTRY_REPRICE_MAX_WAIT) -> dict:
     last_oid=None; last_price=None
-    start=time.time(); min_tick=_tick(core, market)
+    start=time.time(); min_tick=_tick(core, market, entry_hint)
     while True:
         if time.time()-start >= max_window_sec:
             if last_oid:
                 try: core.cancel_order_blocking(market, last_oid, wait_sec=2.0)
                 except: pass
             return {"ok": False, "ctx":"entry_timeout"}
+        if core.open_get(market).get("abort"):   # «الغ COIN» من تيليغرام (قد يصل من عامل آخر)
+            if last_oid:
+                try: core.cancel_order_blocking(market, last_oid, wait_sec=2.0)
+                except: pass
+            return {"ok": False, "ctx":"aborted"}
 
         bid, ask = core.get_best_bid_ask(market)
         px = max(bid, entry_hint or 0.0) if entry_hint else bid
@@ -139,11 +209,17 @@ def chase_buy(core, market:str, spend_eur:float, entry_hint:float|None=None,
             return {"ok": False, "ctx":"amount_too_small"}
 
         if last_oid:
-            try: core.cancel_order_blocking(market, last_oid, wait_sec=2.0)
-            except: pass
-
-        _, resp = core.place_limit_postonly(market, "buy", px, amount)
+            _, resp = core.amend_order(market, last_oid, "buy", px, amount)
+            if isinstance(resp, dict) and resp.get("filled"):
+                st = resp.get("order") or {}
+                fb = float(st.get("filledAmount",0) or 0)
+                fq = float(st.get("filledAmountQuote",0) or 0)
+                avg = (fq/fb) if (fb>0 and fq>0) else last_price
+                return {"ok": True, "status": "filled", "avg_price": avg, "filled_base": fb, "spent_eur": fq, "last_oid": last_oid}
+        else:
+            _, resp = core.place_limit_postonly(market, "buy", px, amount)
         if isinstance(resp, dict) and resp.get("error"):
+            if resp.get("prev_canceled"): last_oid = None
             time.sleep(ENTRY_FAIL_COOLDOWN); continue
 
         last_oid = resp.get("orderId"); last_price = px
@@ -159,6 +235,7 @@ def chase_buy(core, market:str, spend_eur:float, entry_hint:float|None=None,
                 avg = (fq/fb) if (fb>0 and fq>0) else last_price
                 return {"ok": True, "status": s, "avg_price": avg, "filled_base": fb, "spent_eur": fq, "last_oid": last_oid}
 
+            if core.open_get(market).get("abort"): break
             bid2, _ = core.get_best_bid_ask(market)
             if (bid2 > 0 and abs(bid2 - last_price) >= min_tick*ENTRY_REPRICE_MIN_TICK) or (time.time()-t0 >= reprice_max_wait):
                 break
@@ -174,145 +251,316 @@ def maybe_move_sl(core, market:str, avg:float, base:float, current_bid:float, cu
         return current_sl_price
     except: return current_sl_price
 
-# ===== TP Loop مع Mirror-Exit =====
-def _tp_loop(core, market: str, entry: float, base_size: float,
-             tp_init_price: float, init_oid: str|None, init_price: float|None):
+# ===== TP مع Mirror-Exit: آلة حالة لكل موقع =====
+class _TPJob:
+    """حالة TP/Decay/Force-Taker لموقع واحد. step() يعيد مهلة الخطوة التالية (ثوانٍ) أو None عند الانتهاء."""
+
+    def __init__(self, core, market: str, entry: float, base_size: float,
+                 tp_init_price: float, init_oid: str|None, init_price: float|None):
+        self.core, self.market, self.entry = core, market, entry
+        self.tp_init_price = tp_init_price
+        self.minb = core.min_base(market)
+        self.amt  = core.round_amount_down(market, float(base_size))
+        self.last_oid   = init_oid or None
+        self.last_amt   = self.amt
+        self.last_price = float(init_price or 0.0)
+        self.last_place_ts = time.time() if init_oid else 0.0
+        self.start = time.time()
+        self.tp_floor = entry * (1.0 + TP_MIN_PCT/100.0)
+        self.tp_top   = max(tp_init_price, self.tp_floor)
+        self.target   = max(tp_init_price, self.tp_floor)
+        self.phaseB = False
+        self.busy = False; self.due = 0.0; self.kick = False
+
+    def begin(self) -> float|None:
+        core, market = self.core, self.market
+        if self.amt < self.minb:
+            core.tg_send(f"⛔ كمية غير كافية للبيع — {market}"); core.notify_ready(market, "no_amount", None); return None
+        core.tg_send(f"🎯 TP — {market} | Entry {self.entry:.8f} | Init {self.tp_init_price:.8f} → Min {self.tp_floor:.8f}")
+        return 0.0
+
+    def finish(self) -> None:
+        """انتهى الخروج: علّم الموقع (إن بقي) كي لا يُتبنّى، وحرّر الـ lease."""
+        try: self.core.pos_cas(self.market, lambda p: {**p, "tp_done": True} if p else None)
+        except Exception: pass
+        self.core.lease_release(self.market)
+
+    def _taker_exit(self, reason: str) -> None:
+        core, market, entry, amt = self.core, self.market, self.entry, self.amt
+        if self.last_oid:
+            try: core.cancel_order_blocking(market, self.last_oid, wait_sec=2.5)
+            except: pass
+        res = core.emergency_taker_sell(market, amt)
+        if res.get("ok"):
+            st2=res.get("response") or {}
+            try:
+                fq=float(st2.get("filledAmountQuote",0) or 0); fa=float(st2.get("filledAmount",0) or 0)
+                avg_out=(fq/fa) if (fa>0 and fq>0) else (core.get_best_bid_ask(market)[0] or entry)
+            except:
+                avg_out=core.get_best_bid_ask(market)[0] or entry; fa=amt
+            pnl=(avg_out-entry)*fa
+            core.pos_clear(market); core.notify_ready(market, reason, round(pnl,4))
+        else:
+            core.notify_ready(market, f"{reason}_failed" if reason=="mirror_exit" else "taker_failed", None)
 
-    try:
-        minb = core.min_base(market)
-        amt  = core.round_amount_down(market, float(base_size))
-        if amt < minb:
-            core.tg_send(f"⛔ كمية غير كافية للبيع — {market}"); core.notify_ready(market, "no_amount", None); return
+    def step(self, md: dict) -> float|None:
+        core, market, entry = self.core, self.market, self.entry
 
-        last_oid   = init_oid or None
-        last_price = float(init_price or 0.0)
-        last_place_ts = time.time() if init_oid else 0.0
-        start=time.time()
+        if "pos" in md:   # غيابه = تعذّرت القراءة؛ نكمل
+            pos = md["pos"]
+            if not pos or pos.get("tp_done"): return None   # حُسم في مكان آخر (watchdog/عامل آخر/reset): لا إشعار ثانٍ
+            if "base" in pos and float(pos.get("base") or 0.0) <= 0.0:
+                core.notify_ready(market,"closed_external", None); return None
 
-        tp_floor = entry * (1.0 + TP_MIN_PCT/100.0)
-        tp_top   = max(tp_init_price, tp_floor)
-        target   = max(tp_init_price, tp_floor)
+        # Mirror exit: Express قال exit_now=1؟
+        try:
+            hint = md.get("hint")
+            if hint and int(hint.get("exit_now",0)) == 1:
+                core.tg_send(f"🤖 Mirror Exit — {market}")
+                self._taker_exit("mirror_exit"); return None
+        except Exception:
+            pass
 
-        core.tg_send(f"🎯 TP — {market} | Entry {entry:.8f} | Init {tp_init_price:.8f} → Min {tp_floor:.8f}")
+        bid, ask = md.get("book") or (0.0, 0.0)
+        elapsed_min=int((time.time()-self.start)/60)
 
-        phaseB=False
-        while True:
-            # Mirror exit: Express قال exit_now=1؟
-            try:
-                hint = read_hint(market)
-                if hint and int(hint.get("exit_now",0)) == 1:
-                    if last_oid:
-                        try: core.cancel_order_blocking(market, last_oid, wait_sec=2.5)
+        if elapsed_min < max(1, TP_RATCHET_MIN):
+            if ask>0:
+                cand=_clip_sell_maker(core, market, ask, bid, ask)
+                if cand>self.target: self.target=cand
+                if cand>self.tp_top: self.tp_top=cand
+        else:
+            if not self.phaseB:
+                core.tg_send(f"⤵️ Decay — {market}")
+                self.phaseB=True
+            span=max(1, TP_DECAY_WINDOW_MIN)
+            prog=min(1.0, (elapsed_min - TP_DECAY_START_MIN)/span)
+            top_pct=(self.tp_top/entry) - 1.0
+            floor_pct=(TP_MIN_PCT/100.0)
+            t_pct=(1.0-prog)*top_pct + prog*floor_pct
+            self.target=entry*(1.0+max(t_pct, floor_pct))
+            if ask>0: self.target=_clip_sell_maker(core, market, self.target, bid, ask)
+
+        delay = REPRICE_SEC
+        tick=_tick(core, market, self.last_price or ask or None)
+        need_reprice=(abs(self.target-self.last_price) >= MIN_TICK_REPRICE*tick) or ((time.time()-self.last_place_ts) >= max(2.0, REPRICE_SEC*2))
+        if need_reprice:
+            target = self.target
+            p_to_place=target if ask<=0 else _clip_sell_maker(core, market, target, bid, ask)
+            if self.last_oid:
+                opened = md.get("open")
+                st = opened[self.last_oid] if (opened is not None and self.last_oid in opened) else (core.order_status(market, self.last_oid) or {})
+                if (st.get("status","").lower())!="filled":
+                    self.amt = core.round_amount_down(market, _remaining_from_status(st, self.last_amt))
+                    if self.amt < self.minb:
+                        try: core.cancel_order_blocking(market, self.last_oid, wait_sec=3.5)
                         except: pass
-                    core.tg_send(f"🤖 Mirror Exit — {market}")
-                    res = core.emergency_taker_sell(market, amt)
-                    if res.get("ok"):
-                        st2=res.get("response") or {}
-                        try:
-                            fq=float(st2.get("filledAmountQuote",0) or 0)
-                            fa=float(st2.get("filledAmount",0) or 0)
-                            avg_out=(fq/fa) if (fa>0 and fq>0) else (core.get_best_bid_ask(market)[0] or entry)
-                        except:
-                            avg_out=core.get_best_bid_ask(market)[0] or entry; fa=amt
-                        pnl=(avg_out-entry)*fa
-                        core.pos_clear(market); core.notify_ready(market,"mirror_exit", round(pnl,4))
-                    else:
-                        core.notify_ready(market,"mirror_exit_failed", None)
-                    return
-            except Exception:
-                pass
-
-            pos=core.pos_get(market) or {}
-            if float(pos.get("base", amt) or amt) <= 0.0:
-                core.notify_ready(market,"closed_external", None); return
-
-            bid, ask = core.get_best_bid_ask(market)
-            elapsed_min=int((time.time()-start)/60)
-
-            if elapsed_min < max(1, TP_RATCHET_MIN):
-                if ask>0:
-                    cand=_clip_sell_maker(core, market, ask, bid, ask)
-                    if cand>target: target=cand
-                    if cand>tp_top: tp_top=cand
+                        core.notify_ready(market,"dust_leftover", None); return None
+                    _, resp = core.amend_order(market, self.last_oid, "sell", p_to_place, self.amt, keep_amount=True)
+                    if isinstance(resp, dict) and resp.get("filled"): st = resp.get("order") or {}
+                if (st.get("status","").lower())=="filled":
+                    try:
+                        fq=float(st.get("filledAmountQuote",0) or 0); fa=float(st.get("filledAmount",0) or 0)
+                        avg_out=(fq/fa) if (fa>0 and fq>0) else self.last_price
+                    except:
+                        avg_out=self.last_price; fa=self.amt
+                    pnl=(avg_out-entry)*fa
+                    core.pos_clear(market); core.notify_ready(market,"tp_filled", round(pnl,4)); return None
             else:
-                if not phaseB:
-                    core.tg_send(f"⤵️ Decay — {market}")
-                    phaseB=True
-                span=max(1, TP_DECAY_WINDOW_MIN)
-                prog=min(1.0, (elapsed_min - TP_DECAY_START_MIN)/span)
-                top_pct=(tp_top/entry) - 1.0
-                floor_pct=(TP_MIN_PCT/100.0)
-                t_pct=(1.0-prog)*top_pct + prog*floor_pct
-                target=entry*(1.0+max(t_pct, floor_pct))
-                if ask>0: target=_clip_sell_maker(core, market, target, bid, ask)
-
-            tick=_tick(core, market)
-            need_reprice=(abs(target-last_price) >= MIN_TICK_REPRICE*tick) or ((time.time()-last_place_ts) >= max(2.0, REPRICE_SEC*2))
-            if need_reprice:
-                if last_oid:
-                    st=core.order_status(market, last_oid) or {}
-                    if (st.get("status","").lower())=="filled":
-                        try:
-                            fq=float(st.get("filledAmountQuote",0) or 0); fa=float(st.get("filledAmount",0) or 0)
-                            avg_out=(fq/fa) if (fa>0 and fq>0) else last_price
-                        except:
-                            avg_out=last_price; fa=amt
-                        pnl=(avg_out-entry)*fa
-                        core.pos_clear(market); core.notify_ready(market,"tp_filled", round(pnl,4)); return
-                    amt = core.round_amount_down(market, _remaining_from_status(st, amt))
-                    try: core.cancel_order_blocking(market, last_oid, wait_sec=3.5)
-                    except: pass
-                    last_oid=None; time.sleep(0.20)
-                if amt < minb: core.notify_ready(market,"dust_leftover", None); return
-                p_to_place=target if ask<=0 else _clip_sell_maker(core, market, target, bid, ask)
-                _, resp = core.place_limit_postonly(market, "sell", p_to_place, amt)
-                if isinstance(resp, dict) and not resp.get("error"):
-                    last_oid=resp.get("orderId"); last_price=p_to_place; last_place_ts=time.time()
-                else:
-                    code=0
-                    try: code=int(resp.get("errorCode",0))
-                    except: pass
-                    if code==216:
-                        tg_once(core, f"216:{market}", f"🧯 BV216 — تعديل كمية")
-                        amt = core.round_amount_down(market, amt*0.9995)
-                    else:
-                        tg_once(core, f"ERR:{market}:{code}", f"🩻 ERR sell {market}: {json.dumps(resp, ensure_ascii=False)[:200]}")
-                    time.sleep(0.5)
-
-            if FORCE_TAKER_AFTER_MIN and elapsed_min >= FORCE_TAKER_AFTER_MIN:
-                if EMERGENCY_ONLY_PROFIT and (bid <= entry):
-                    pass
+                if self.amt < self.minb: core.notify_ready(market,"dust_leftover", None); return None
+                _, resp = core.place_limit_postonly(market, "sell", p_to_place, self.amt)
+            if isinstance(resp, dict) and not resp.get("error"):
+                if resp.get("orderId") != self.last_oid:
+                    self.last_amt=self.amt
+                    oid = resp.get("orderId")
+                    core.pos_cas(market, lambda p: {**p, "tp_oid": oid, "tp_target": p_to_place} if p else None)
+                self.last_oid=resp.get("orderId"); self.last_price=p_to_place; self.last_place_ts=time.time()
+            else:
+                if (resp or {}).get("prev_canceled"): self.last_oid=None
+                code=0
+                try: code=int(resp.get("errorCode",0))
+                except: pass
+                if code==216:
+                    tg_once(core, f"216:{market}", f"🧯 BV216 — تعديل كمية")
+                    self.amt = core.round_amount_down(market, self.amt*0.9995)
                 else:
-                    if last_oid:
-                        try: core.cancel_order_blocking(market, last_oid, wait_sec=2.5)
-                        except: pass
-                    core.tg_send(f"⚡ Taker Exit — {market}")
-                    res=core.emergency_taker_sell(market, amt)
-                    if res.get("ok"):
-                        st2=res.get("response") or {}
-                        try:
-                            fq=float(st2.get("filledAmountQuote",0) or 0); fa=float(st2.get("filledAmount",0) or 0)
-                            avg_out=(fq/fa) if (fa>0 and fq>0) else (core.get_best_bid_ask(market)[0] or entry)
-                        except:
-                            avg_out=core.get_best_bid_ask(market)[0] or entry; fa=amt
-                        pnl=(avg_out-entry)*fa
-                        core.pos_clear(market); core.notify_ready(market,"taker_emergency", round(pnl,4))
-                    else:
-                        core.notify_ready(market,"taker_failed", None)
-                    return
-
-            time.sleep(REPRICE_SEC)
+                    tg_once(core, f"ERR:{market}:{code}", f"🩻 ERR sell {market}: {json.dumps(resp, ensure_ascii=False)[:200]}")
+                delay += 0.5
+
+        if FORCE_TAKER_AFTER_MIN and elapsed_min >= FORCE_TAKER_AFTER_MIN:
+            if not (EMERGENCY_ONLY_PROFIT and (bid <= entry)):
+                core.tg_send(f"⚡ Taker Exit — {market}")
+                self._taker_exit("taker_emergency"); return None
+
+        return delay
+
+# ===== Exit Engine: مجدول واحد لكل مواقع TP بدل خيط نائم لكل موقع =====
+EXIT_WORKERS   = int(os.getenv("EXIT_WORKERS","4"))     # خيوط تنفيذ الخطوات (I/O الأوامر)
+EXIT_BATCH_MIN = int(os.getenv("EXIT_BATCH_MIN","20"))  # من هذا العدد: /ordersOpen واحد (وزن 25) بدل order_status لكل موقع
+EXIT_COALESCE_SEC = 0.10                                 # ضمّ المواقع المستحقة قريباً إلى نفس الدفعة
+
+class ExitEngine:
+    """
+    timer-heap: كل موقع يُجدول بمهلته؛ عند الاستحقاق تُجلب حالة الأوامر دفعة واحدة حين يكثر العدد،
+    ثم تُنفّذ كل خطوة (مع جلب hint/pos/book لسوقها) على pool محدود.
+    """
+    def __init__(self, workers: int = EXIT_WORKERS):
+        self.jobs = {}
+        self.heap = []
+        self.cv = threading.Condition()
+        self.seq = itertools.count()
+        self.pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="exit")
+        self.thread = None
+        self.stats = {"ticks": 0, "steps": 0, "errors": 0, "batched_status": 0}
+
+    def _push(self, job, due: float):
+        job.due = due
+        heapq.heappush(self.heap, (due, next(self.seq), job))
+
+    def add(self, job):
+        delay = job.begin()
+        if delay is None:
+            job.finish(); return
+        with self.cv:
+            self.jobs[job.market] = job
+            self._push(job, time.time() + delay)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True, name="exit-engine"); self.thread.start()
+            self.cv.notify()
+
+    def wake(self, market: str):
+        with self.cv:
+            job = self.jobs.get(market)
+            if not job: return
+            if job.busy: job.kick = True   # الخطوة الجارية تُتبع بأخرى فوراً
+            else: self._push(job, time.time()); self.cv.notify()
+
+    def has(self, market: str) -> bool:
+        return market in self.jobs
+
+    def drop(self, market: str):
+        """إيقاف إدارة موقع دون لمس أوامره (فقدنا الـ lease لعامل آخر)."""
+        with self.cv:
+            self.jobs.pop(market, None)
+
+    def size(self) -> int:
+        return len(self.jobs)
+
+    def _run(self):
+        while True:
+            with self.cv:
+                while not self.heap or self.heap[0][0] > time.time():
+                    self.cv.wait(None if not self.heap else max(0.0, self.heap[0][0] - time.time()))
+                now = time.time(); batch = {}
+                while self.heap and self.heap[0][0] <= now + EXIT_COALESCE_SEC:
+                    due, _, job = heapq.heappop(self.heap)
+                    if job.busy or due != job.due or self.jobs.get(job.market) is not job: continue
+                    job.busy = True; batch[job.market] = job
+            if not batch: continue
+            self.stats["ticks"] += 1
+            self.pool.submit(self._tick, list(batch.values()))   # حتى /ordersOpen على العامل: طلب بطيء أو انتظار RL لا يوقف المؤقّتات
+
+    def _tick(self, jobs):
+        try:
+            opened = _open_batch(jobs)
+        except Exception as e:
+            print("exit tick err:", e); opened = None
+        for job in jobs:
+            self.pool.submit(self._step, job, opened)
 
+    def _step(self, job, opened: dict | None):
+        delay = None
+        try:
+            delay = job.step(_market_data(job.core, job.market, opened))   # الجلب على العامل: سوق بطيء لا يؤخّر غيره
+            self.stats["steps"] += 1
+        except Exception as e:
+            self.stats["errors"] += 1
+            job.core.tg_send(f"⛔ خطأ TP — {job.market}\n{type(e).__name__}: {e}")
+            job.core.notify_ready(job.market, "tp_loop_error", None)
+        ended = False
+        with self.cv:
+            job.busy = False
+            if delay is None:
+                if self.jobs.get(job.market) is job:
+                    self.jobs.pop(job.market, None); ended = True
+            else:
+                if job.kick: delay = 0.0
+                self._push(job, time.time() + delay); self.cv.notify()
+            job.kick = False
+        if ended: job.finish()
+
+def _open_batch(jobs) -> dict | None:
+    """حالة الأوامر المفتوحة دفعة واحدة عند الكثرة (طلب واحد لكل دفعة)، وإلا None."""
+    if sum(1 for j in jobs if j.last_oid) < EXIT_BATCH_MIN: return None
+    rows = jobs[0].core.orders_open()
+    if not isinstance(rows, list): return None
+    EXITS.stats["batched_status"] += 1
+    return {o.get("orderId"): o for o in rows if isinstance(o, dict)}
+
+def _market_data(core, market: str, opened: dict | None) -> dict:
+    """hint/pos/book لسوق واحد؛ فشل pos_get يترك المفتاح غائباً (مجهول) لا {} (مُغلق)."""
+    md = {"open": opened}
+    try: md["book"] = core.get_best_bid_ask(market)
+    except Exception: md["book"] = (0.0, 0.0)
+    try: md["hint"] = read_hint(market)
+    except Exception: md["hint"] = {}
+    try: md["pos"] = core.pos_get(market) or {}
+    except Exception: pass
+    return md
+
+def _tick_data(jobs) -> dict:
+    """بيانات كل سوق في الدفعة بشكل متزامن (مسار _tp_loop)."""
+    opened = _open_batch(jobs)
+    return {j.market: _market_data(j.core, j.market, opened) for j in jobs}
+
+EXITS = ExitEngine()
+
+def _tp_loop(core, market: str, entry: float, base_size: float,
+             tp_init_price: float, init_oid: str|None, init_price: float|None):
+    """توافق: تشغيل موقع واحد بشكل متزامن (المسار المعتاد هو EXITS.add)."""
+    job = _TPJob(core, market, entry, base_size, tp_init_price, init_oid, init_price)
+    try:
+        delay = job.begin()
+        while delay is not None:
+            time.sleep(delay)
+            delay = job.step(_tick_data([job])[market])
     except Exception as e:
         core.tg_send(f"⛔ خطأ TP — {market}\n{type(e).__name__}: {e}")
         core.notify_ready(market, "tp_loop_error", None)
+    job.finish()
+
+# ===== إقلاع (يستدعيه الكور مرة لكل عملية) =====
+REGIME_SCAN = os.getenv("REGIME_SCAN","0") == "1"   # اختياري: ترتيب الأسواق ذات الحلقات الحيّة كل دقيقة (strategy_base.REGIME_CACHE)
+
+def on_boot(core):
+    if REGIME_SCAN: strategy_base.start_regime_scanner(core)
+
+# ===== ملكية المواقع بين العمّال (يستدعيها الكور) =====
+def adopt_position(core, market: str, pos: dict):
+    """استئناف خروج موقع كان يديره عامل توقف؛ الساعة من ts_open كي تستمر مراحل Ratchet/Decay."""
+    avg = float(pos.get("avg") or 0.0); base = float(pos.get("base") or 0.0)
+    tp_target = float(pos.get("tp_target") or 0.0)
+    job = _TPJob(core, market, avg, base, float(pos.get("tp_init") or tp_target or avg), pos.get("tp_oid"), tp_target)
+    job.start = float(pos.get("ts_open") or time.time())
+    EXITS.add(job)
+
+def on_lease_lost(core, market: str):
+    EXITS.drop(market)
 
 # ===== تنفيذ الشراء (/hook) =====
 def on_hook_buy(core, coin:str):
     market = core.coin_to_market(coin)
     if not market:
         core.tg_send(f"⛔ سوق غير مدعوم — {coin}"); return
+    if not core.lease_acquire(market):
+        core.tg_send(f"⏳ {market} يُدار في عامل آخر — تجاهل الإشارة"); return
+    core.candle_watch(market, "1m")   # بذرة الشموع أثناء المطاردة لا بعد الملء
+    try:
+        _hook_buy(core, market)
+    finally:
+        if not EXITS.has(market): core.lease_release(market)
 
+def _hook_buy(core, market: str):
     eur_avail = core.balance("EUR")
     spend = max(0.0, eur_avail - HEADROOM_EUR)
     if spend <= 0:
@@ -320,7 +568,8 @@ def on_hook_buy(core, coin:str):
         core.notify_ready(market,"buy_failed"); return
 
     # اقرأ Hint من Express
-    hint = read_hint(market)
+    with core.span("read_hint"):
+        hint = read_hint(market)
     entry_hint = float(hint.get("entry_hint") or 0.0) or None
     signal_score = float(hint.get("score") or 0.0) if hint else None
     fast = bool(int(hint.get("flash",0))) if hint else False
@@ -329,8 +578,9 @@ def on_hook_buy(core, coin:str):
     reprice_wait = FLASH_REPRICE_MAX_WAIT if (fast or (signal_score and signal_score>=FLASH_SCORE_MIN)) else ENTRY_REPRICE_MAX_WAIT
 
     core.open_set(market, {"side":"buy", "abort": False})
-    res = chase_buy(core, market, spend, entry_hint=entry_hint,
-                    max_window_sec=max_window, reprice_max_wait=reprice_wait)
+    with core.span("chase_buy"):
+        res = chase_buy(core, market, spend, entry_hint=entry_hint,
+                        max_window_sec=max_window, reprice_max_wait=reprice_wait)
     if not res.get("ok"):
         core.tg_send(f"⚠️ فشل الدخول — {market}\n{json.dumps(res,ensure_ascii=False)}")
         core.notify_ready(market,"buy_failed"); return
@@ -353,7 +603,8 @@ def on_hook_buy(core, coin:str):
         core.open_clear(market); return
 
     # TP مبدئي
-    tp_pct = _choose_tp_pct(core, market, fallback_pct=TP_INIT_PCT_DEFAULT)
+    with core.span("choose_tp"):
+        tp_pct = _choose_tp_pct(core, market, fallback_pct=TP_INIT_PCT_DEFAULT)
     tp_init = avg * (1.0 + tp_pct/100.0)
 
     bid, ask = core.get_best_bid_ask(market)
@@ -367,10 +618,11 @@ def on_hook_buy(core, coin:str):
     else:
         core.tg_send(f"⚠️ فشل وضع TP — {json.dumps(tp_resp, ensure_ascii=False)[:240]}")
 
-    core.pos_set(market, {"avg": avg, "base": base_bought, "tp_oid": tp_oid, "tp_target": p0, "sl_oid": None, "sl_price": 0.0})
+    core.pos_set(market, {"avg": avg, "base": base_bought, "tp_oid": tp_oid, "tp_target": p0, "tp_init": tp_init,
+                          "sl_oid": None, "sl_price": 0.0, "ts_open": time.time(), "tp_done": False})
     core.open_clear(market)
 
-    threading.Thread(target=_tp_loop, args=(core, market, avg, base_bought, tp_init, tp_oid, p0), daemon=True).start()
+    EXITS.add(_TPJob(core, market, avg, base_bought, tp_init, tp_oid, p0))
 
 # ===== أوامر تيليغرام =====
 def on_tg_command(core, text):
@@ -420,7 +672,6 @@ def on_tg_command(core, text):
         info["abort"]=True; core.open_set(market, info)
         if info.get("orderId"):
             ok, final, last = core.cancel_order_blocking(market, info["orderId"], wait_sec=12.0)
-            if ok: core.open_clear(market)
             core.tg_send(("✅ تم الإلغاء" if ok else "ℹ️ أوقفت المطاردة")+f" — status={final}")
         else:
             core.tg_send("ℹ️ أوقفت المطاردة (لا يوجد OID)")
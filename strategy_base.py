@@ -1,11 +1,21 @@
 # -*- coding: utf-8 -*-
 # strategy_base.py — ثابت: مؤشرات + نظام اختيار TP + مطاردة شراء + مساعدات
 
-import time, statistics as st
+import time, threading, statistics as st
+from collections import deque, OrderedDict
+from itertools import islice
+try:
+    import numpy as np   # اختياري: مسار المصفوفات لكل الأسواق دفعة واحدة
+except Exception:
+    np = None
 
 # إعدادات مؤشرات وحدود TP الافتراضية (قيم عملية وثابتة غالباً)
 ADX_LEN = 14; RSI_LEN = 14; EMA_FAST = 50; EMA_SLOW = 200; ATR_LEN = 14
 TP_MIN_PCT = 0.30; TP_MID_PCT = 0.70; TP_MAX_PCT = 1.20
+REGIME_SCAN_SEC = 60; REGIME_MAX_AGE_SEC = 150   # مسح كل أسواق EUR / عمر نتيجة الكاش المقبول للترتيب (regime_cached: دورة مسح)
+REGIME_KEEP = 256                                # حالات RegimeStream المحفوظة (LRU)
+_IV_SEC = {"1m": 60, "5m": 300, "15m": 900, "30m": 1800, "1h": 3600, "2h": 7200,
+           "4h": 14400, "6h": 21600, "8h": 28800, "12h": 43200, "1d": 86400}
 
 # ===== مؤشرات =====
 def _series_ema(values, period):
@@ -61,17 +71,349 @@ def _adx(highs, lows, closes, period=14):
     dx = (abs(pDI - mDI) / max(pDI + mDI, 1e-9)) * 100.0
     return dx
 
+# ===== مؤشرات متدفقة: O(1) لكل شمعة، وبنفس نتيجة الدوال أعلاه على نفس النافذة =====
+# window=None: تكافئ الدالة على كل ما أُدخل؛ window=W: تكافئها على آخر W شمعة (الانزلاق بتصحيح جبري لا بإعادة الحساب).
+# update(...) يُثبّت شمعة مغلقة؛ peek(...) قيمة "لو أُضيفت" (الشمعة الجارية) دون تغيير الحالة.
+class StreamEMA:
+    def __init__(self, period: int, window: int | None = None):
+        self.period, self.window = period, window
+        self.k = 2.0 / (period + 1.0)
+        self.win = deque(maxlen=window)          # القيم داخل النافذة (نحتاج أول قيمتين عند الانزلاق)
+        self.n = 0; self.e = None
+        self._drop = (1 - self.k) ** (window - 1) if window else 0.0
+
+    def _next(self, x: float):
+        if self.n == 0: return x
+        e = self.e
+        if self.window and len(self.win) == self.window:
+            e = e + self._drop * (self.win[1] - self.win[0])   # بذرة النافذة تنتقل من v0 إلى v1
+        return x * self.k + e * (1 - self.k)
+
+    def update(self, x: float):
+        self.e = self._next(x); self.win.append(x); self.n += 1
+        return self.value
+
+    def peek(self, x: float):
+        n = min(self.n + 1, self.window or self.n + 1)
+        return self._next(x) if n >= self.period else None
+
+    @property
+    def value(self):
+        n = min(self.n, self.window or self.n)
+        return self.e if n >= self.period else None
+
+    def snapshot(self) -> dict: return {"n": self.n, "e": self.e, "win": list(self.win)}
+    def restore(self, s: dict):
+        self.n, self.e = s["n"], s["e"]; self.win = deque(s["win"], maxlen=self.window)
+        return self
+
+class StreamRSI:
+    """نفس _rsi: متوسطات بسيطة لآخر period فرق؛ تكفي آخر period+1 إغلاق."""
+    def __init__(self, period: int = 14):
+        self.period = period; self.closes = deque(maxlen=period + 1)
+
+    @staticmethod
+    def _calc(cl, period):
+        if len(cl) < period + 1: return None
+        return _rsi(cl, period)
+
+    def update(self, c: float):
+        self.closes.append(c); return self.value
+
+    def peek(self, c: float):
+        cl = list(self.closes)[1 if len(self.closes) == self.period + 1 else 0:] + [c]
+        return self._calc(cl, self.period)
+
+    @property
+    def value(self): return self._calc(list(self.closes), self.period)
+
+    def snapshot(self) -> dict: return {"closes": list(self.closes)}
+    def restore(self, s: dict):
+        self.closes = deque(s["closes"], maxlen=self.period + 1); return self
+
+class _WilderSum:
+    """
+    مجموع Wilder كما في _atr/_adx: S = مجموع أول period قيمة ثم w = w - w/period + x.
+    على نافذة ثابتة L: w = a^(L-p)·S + Σ a^(L-1-i)·x_i (a = 1 - 1/p)، فالانزلاق بتصحيح من الطرفين.
+    """
+    def __init__(self, period: int, window: int | None = None):
+        self.p, self.window = period, window
+        self.win = deque(maxlen=window)
+        self.w = None
+        a = 1.0 - 1.0 / period
+        self._a = a
+        self._A = a ** (window - period) if window and window >= period else 0.0   # وزن S
+        self._B = a ** (window - period - 1) if window and window > period else 0.0   # وزن x_p قبل الانزلاق
+
+    def _next(self, x: float):
+        win, p, L = self.win, self.p, len(self.win)
+        if self.window and L == self.window:
+            if L == p: return sum(islice(win, 1, p)) + x
+            s_old = sum(islice(win, 0, p)); s_new = sum(islice(win, 1, p + 1))
+            return self._A * s_new + self._a * (self.w - self._A * s_old - self._B * win[p]) + x
+        if L + 1 < p: return None
+        if L + 1 == p: return sum(win) + x
+        return self.w - (self.w / p) + x
+
+    def update(self, x: float):
+        self.w = self._next(x); self.win.append(x); return self.w
+
+    def peek(self, x: float): return self._next(x)
+
+    def snapshot(self) -> dict: return {"w": self.w, "win": list(self.win)}
+    def restore(self, s: dict):
+        self.w = s["w"]; self.win = deque(s["win"], maxlen=self.window); return self
+
+def _tr(h, l, pc): return max(h - l, abs(h - pc), abs(l - pc))
+
+class StreamATR:
+    """window بالشموع (كما في _atr(highs[-W:], ...))؛ نافذة TR = W-1."""
+    def __init__(self, period: int = 14, window: int | None = None):
+        self.period = period
+        self.tr = _WilderSum(period, window - 1 if window else None)
+        self.prev = None
+
+    def update(self, h: float, l: float, c: float):
+        if self.prev is not None: self.tr.update(_tr(h, l, self.prev))
+        self.prev = c; return self.value
+
+    def peek(self, h: float, l: float, c: float):
+        if self.prev is None: return None
+        w = self.tr.peek(_tr(h, l, self.prev))
+        return None if w is None else w / self.period
+
+    @property
+    def value(self): return None if self.tr.w is None else self.tr.w / self.period
+
+    def snapshot(self) -> dict: return {"prev": self.prev, "tr": self.tr.snapshot()}
+    def restore(self, s: dict):
+        self.prev = s["prev"]; self.tr.restore(s["tr"]); return self
+
+class StreamADX:
+    """نفس _adx (قيمة DX الأخيرة من مجاميع Wilder لـ TR و±DM)."""
+    def __init__(self, period: int = 14, window: int | None = None):
+        self.period = period
+        w = window - 1 if window else None
+        self.tr, self.pdm, self.mdm = _WilderSum(period, w), _WilderSum(period, w), _WilderSum(period, w)
+        self.prev = None   # (h, l, c)
+
+    def _parts(self, h, l):
+        ph, pl, pc = self.prev
+        up, dn = h - ph, pl - l
+        return (up if (up > dn and up > 0) else 0.0), (dn if (dn > up and dn > 0) else 0.0), _tr(h, l, pc)
+
+    @staticmethod
+    def _dx(tr14, p14, m14):
+        if tr14 is None: return None
+        if tr14 <= 0: return 0.0
+        pDI = (p14 / tr14) * 100.0
+        mDI = (m14 / tr14) * 100.0
+        return (abs(pDI - mDI) / max(pDI + mDI, 1e-9)) * 100.0
+
+    def update(self, h: float, l: float, c: float):
+        if self.prev is not None:
+            pdm, mdm, tr = self._parts(h, l)
+            self.tr.update(tr); self.pdm.update(pdm); self.mdm.update(mdm)
+        self.prev = (h, l, c); return self.value
+
+    def peek(self, h: float, l: float, c: float):
+        if self.prev is None: return None
+        pdm, mdm, tr = self._parts(h, l)
+        return self._dx(self.tr.peek(tr), self.pdm.peek(pdm), self.mdm.peek(mdm))
+
+    @property
+    def value(self): return self._dx(self.tr.w, self.pdm.w, self.mdm.w)
+
+    def snapshot(self) -> dict:
+        return {"prev": self.prev, "tr": self.tr.snapshot(), "pdm": self.pdm.snapshot(), "mdm": self.mdm.snapshot()}
+    def restore(self, s: dict):
+        self.prev = tuple(s["prev"]) if s["prev"] else None
+        self.tr.restore(s["tr"]); self.pdm.restore(s["pdm"]); self.mdm.restore(s["mdm"]); return self
+
+class RegimeStream:
+    """حالة market_regime لسوق واحد: تُغذّى بالشموع المغلقة، وتُقرأ بـ peek على الشمعة الجارية.
+    lock: التغذية والقراءة من خيوط عدة (المسح الخلفي، اختيار TP) تمرّ عبره."""
+    def __init__(self, window: int = 240):
+        self.window = window; self.n = 0; self.last_ts = None; self.lock = threading.Lock()
+        self.ema_fast = StreamEMA(EMA_FAST, window); self.ema_slow = StreamEMA(EMA_SLOW, window)
+        self.rsi = StreamRSI(RSI_LEN); self.atr = StreamATR(ATR_LEN, window); self.adx = StreamADX(ADX_LEN, window)
+
+    def update(self, ts: int, h: float, l: float, c: float):
+        self.ema_fast.update(c); self.ema_slow.update(c); self.rsi.update(c)
+        self.atr.update(h, l, c); self.adx.update(h, l, c)
+        self.n += 1; self.last_ts = ts
+
+    def peek(self, h: float, l: float, c: float) -> dict:
+        """نفس خرج market_regime على (آخر window-1 مغلقة + الجارية)."""
+        if min(self.n + 1, self.window) < max(EMA_SLOW+5, ATR_LEN+5):
+            return {"ok": False}
+        ema_fast = self.ema_fast.peek(c); ema_slow = self.ema_slow.peek(c)
+        atr = self.atr.peek(h, l, c) or 0.0
+        return {"ok": True, "trend_up": ema_fast > ema_slow, "rsi": self.rsi.peek(c) or 50.0,
+                "atr_pct": (atr / c) if (atr and c > 0) else 0.0, "adx": self.adx.peek(h, l, c) or 0.0}
+
+    def snapshot(self) -> dict:
+        return {"window": self.window, "n": self.n, "last_ts": self.last_ts,
+                **{k: getattr(self, k).snapshot() for k in ("ema_fast", "ema_slow", "rsi", "atr", "adx")}}
+
+    @classmethod
+    def restore(cls, s: dict) -> "RegimeStream":
+        rs = cls(s["window"]); rs.n = s["n"]; rs.last_ts = s["last_ts"]
+        for k in ("ema_fast", "ema_slow", "rsi", "atr", "adx"): getattr(rs, k).restore(s[k])
+        return rs
+
+_REGIMES = OrderedDict()   # (market, interval) -> RegimeStream، الأقدم استخداماً أولاً
+_REGIME_LOCK = threading.Lock()
+
+def regime_stream(core, market: str, interval: str = "1m", window: int = 240) -> tuple[RegimeStream | None, tuple | None]:
+    """
+    (الحالة بعد تغذيتها بكل الشموع المغلقة الجديدة، الشمعة الجارية). تُطلب من الكور الشموع منذ آخر تغذية فقط
+    (3 صفوف في الوضع المستقر، أكثر إن طال الفاصل بين النداءات)؛ عند أول استدعاء، أو فاصل ≥ window، أو فجوة
+    (الشمعة الأخيرة المُغذّاة غائبة) تُبنى الحالة من النافذة كاملة.
+    """
+    k = (market, interval)
+    with _REGIME_LOCK:
+        rs = _REGIMES.get(k); rows = None
+        if rs is not None: _REGIMES.move_to_end(k)
+    if rs is not None and rs.last_ts is not None:
+        behind = int((time.time() - rs.last_ts / 1000.0) // _IV_SEC.get(interval, 60)) + 3
+        if behind < window: rows = core.candles(market, interval, behind)
+    if rows and len(rows) > 1:
+        with rs.lock:   # خيط آخر ربما غذّاها بعد قراءة last_ts: ما بعد last_ts الحالي فقط
+            if rs.last_ts >= rows[-2][0] or any(r[0] == rs.last_ts for r in rows[:-1]):
+                for r in rows[:-1]:
+                    if r[0] > rs.last_ts: rs.update(r[0], r[2], r[3], r[4])
+                return rs, rows[-1]
+    rows = core.candles(market, interval, window)
+    if not rows: return None, None
+    rs = RegimeStream(window)
+    for r in rows[:-1]: rs.update(r[0], r[2], r[3], r[4])
+    with _REGIME_LOCK:
+        _REGIMES[k] = rs
+        while len(_REGIMES) > REGIME_KEEP: _REGIMES.popitem(last=False)
+    return rs, rows[-1]
+
+# ===== مسار دفعي (NumPy): كل الأسواق × الزمن في عمليات مصفوفات =====
+# كل مؤشر تكراري خطي في مدخلاته، فقيمته الأخيرة = حاصل ضرب نقطي بأوزان ثابتة لطول T (نفس الصيغ أعلاه):
+#   EMA:    (1-k)^(T-1)·v0 + Σ k(1-k)^(T-1-j)·v_j
+#   Wilder: a^(L-p)·Σ_{i<p} x_i + Σ_{i≥p} a^(L-1-i)·x_i
+_W_CACHE = {}
+
+def _ema_weights(T: int, period: int):
+    key = ("ema", T, period)
+    if key not in _W_CACHE:
+        k = 2.0 / (period + 1.0)
+        w = k * (1 - k) ** np.arange(T - 1, -1, -1, dtype=float); w[0] = (1 - k) ** (T - 1)
+        _W_CACHE[key] = w
+    return _W_CACHE[key]
+
+def _wilder_weights(L: int, period: int):
+    key = ("wilder", L, period)
+    if key not in _W_CACHE:
+        a = 1.0 - 1.0 / period
+        w = a ** np.arange(L - 1, -1, -1, dtype=float); w[:period] = a ** (L - period)
+        _W_CACHE[key] = w
+    return _W_CACHE[key]
+
+def regime_batch(highs, lows, closes) -> dict:
+    """
+    highs/lows/closes: مصفوفات (M أسواق × T شموع، من الأقدم للأحدث). يعيد dict مصفوفات بطول M
+    لمخرجات market_regime: ok, trend_up, rsi, atr_pct, adx. دون NumPy: حلقة على الدوال أعلاه.
+    """
+    if np is None:
+        rows = [_regime_from_lists(h, l, c) for h, l, c in zip(highs, lows, closes)]
+        return {k: [r.get(k, 0.0 if k != "ok" else False) for r in rows] for k in ("ok", "trend_up", "rsi", "atr_pct", "adx")}
+    H = np.asarray(highs, dtype=float); L = np.asarray(lows, dtype=float); C = np.asarray(closes, dtype=float)
+    M, T = C.shape
+    if T < max(EMA_SLOW+5, ATR_LEN+5):
+        z = np.zeros(M)
+        return {"ok": np.zeros(M, dtype=bool), "trend_up": z.astype(bool), "rsi": z, "atr_pct": z, "adx": z}
+
+    trend_up = (C @ _ema_weights(T, EMA_FAST)) > (C @ _ema_weights(T, EMA_SLOW))
+
+    d = np.diff(C[:, -(RSI_LEN+1):], axis=1)
+    gains = np.where(d >= 0, d, 0.0).sum(axis=1); losses = np.where(d < 0, -d, 0.0).sum(axis=1)
+    avg_loss = np.where(losses > 0, losses / RSI_LEN, 1e-9)
+    rsi = 100.0 - (100.0 / (1.0 + (gains / RSI_LEN) / avg_loss))
+    rsi = np.where(rsi == 0.0, 50.0, rsi)   # `_rsi(...) or 50.0`
+
+    pc = C[:, :-1]; h1 = H[:, 1:]; l1 = L[:, 1:]
+    tr = np.maximum(h1 - l1, np.maximum(np.abs(h1 - pc), np.abs(l1 - pc)))
+    atr = (tr @ _wilder_weights(T - 1, ATR_LEN)) / ATR_LEN
+    last = C[:, -1]
+    atr_pct = np.where((atr != 0) & (last > 0), atr / np.where(last > 0, last, 1.0), 0.0)
+
+    up = H[:, 1:] - H[:, :-1]; dn = L[:, :-1] - L[:, 1:]
+    pdm = np.where((up > dn) & (up > 0), up, 0.0); mdm = np.where((dn > up) & (dn > 0), dn, 0.0)
+    w = _wilder_weights(T - 1, ADX_LEN)
+    tr14 = tr @ w; safe = np.where(tr14 > 0, tr14, 1.0)
+    pDI = (pdm @ w) / safe * 100.0; mDI = (mdm @ w) / safe * 100.0
+    adx = np.where(tr14 > 0, np.abs(pDI - mDI) / np.maximum(pDI + mDI, 1e-9) * 100.0, 0.0)
+    return {"ok": np.ones(M, dtype=bool), "trend_up": trend_up, "rsi": rsi, "atr_pct": atr_pct, "adx": adx}
+
+REGIME_CACHE = {}   # market -> نتيجة market_regime + "ts"
+_SCANNER = [None]
+_SCAN_EVERY = [REGIME_SCAN_SEC]   # فاصل المسح الفعلي: عمر الكاش المقبول لاختيار TP
+
+def regime_scan(core, markets, interval: str = "1m", window: int = 240) -> int:
+    """يحسب نظام السوق لكل الأسواق ذات window شمعة كاملة دفعة واحدة وينشره في REGIME_CACHE.
+    يقرأ الحلقات الموجودة فقط (candles_peek): لا بذرة REST ولا اشتراك ولا إبقاء حلقة خاملة حيّة."""
+    names, hs, ls, cs = [], [], [], []
+    for m in markets:
+        rows = core.candles_peek(m, interval, window)
+        if len(rows) < window: continue
+        names.append(m); hs.append([r[2] for r in rows]); ls.append([r[3] for r in rows]); cs.append([r[4] for r in rows])
+    if not names: return 0
+    out = regime_batch(hs, ls, cs); ts = time.time()
+    for i, m in enumerate(names):
+        REGIME_CACHE[m] = {"ok": bool(out["ok"][i]), "trend_up": bool(out["trend_up"][i]), "rsi": float(out["rsi"][i]),
+                           "atr_pct": float(out["atr_pct"][i]), "adx": float(out["adx"][i]), "ts": ts}
+    return len(names)
+
+def regime_cached(market: str, max_age: float | None = None) -> dict | None:
+    """نتيجة آخر مسح دفعي للسوق إن كانت صالحة ولم يمضِ عليها أكثر من دورة مسح (max_age)، وإلا None
+    فيرجع المستدعي إلى regime_stream."""
+    if max_age is None: max_age = _SCAN_EVERY[0]
+    reg = REGIME_CACHE.get(market)
+    return reg if (reg and reg["ok"] and time.time() - reg["ts"] <= max_age) else None
+
+def regime_rank(key: str = "adx", top: int = 20, max_age: float = REGIME_MAX_AGE_SEC) -> list:
+    """[(market, regime)] مرتبة تنازلياً حسب key من آخر مسح."""
+    now = time.time()
+    rows = [(m, r) for m, r in list(REGIME_CACHE.items()) if r["ok"] and now - r["ts"] <= max_age]
+    return sorted(rows, key=lambda x: x[1][key], reverse=True)[:top]
+
+def start_regime_scanner(core, every_sec: float = REGIME_SCAN_SEC):
+    if _SCANNER[0] is not None or every_sec <= 0: return
+    _SCAN_EVERY[0] = every_sec
+    def loop():
+        while True:
+            t0 = time.time()
+            try: regime_scan(core, core.markets())
+            except Exception as e: print("regime scan err:", e)
+            time.sleep(max(1.0, every_sec - (time.time() - t0)))
+    _SCANNER[0] = threading.Thread(target=loop, daemon=True, name="regime-scan"); _SCANNER[0].start()
+
 # ===== سلوك السوق + اختيار TP =====
 def _fetch_candles(core, market: str, interval="1m", limit=240):
-    data = core.bv_request("GET", f"/{market}/candles?interval={interval}&limit={limit}")
-    if not isinstance(data, list): return [], [], []
-    highs = [float(r[2]) for r in data]
-    lows  = [float(r[3]) for r in data]
-    closes= [float(r[4]) for r in data]
+    data = core.candles(market, interval, limit)   # حلقة الكور في الذاكرة (من الأقدم للأحدث)
+    if not data: return [], [], []
+    highs = [r[2] for r in data]
+    lows  = [r[3] for r in data]
+    closes= [r[4] for r in data]
     return highs, lows, closes
 
 def market_regime(core, market: str):
+    rs, cur = regime_stream(core, market, "1m", 240)
+    if rs is None: return {"ok": False}
+    with rs.lock: return rs.peek(cur[2], cur[3], cur[4])
+
+def market_regime_batch(core, market: str):
+    """المرجع: الحساب الكامل على 240 شمعة (للمقارنة مع RegimeStream وregime_batch)."""
     highs, lows, closes = _fetch_candles(core, market, "1m", 240)
+    return _regime_from_lists(highs, lows, closes)
+
+def _regime_from_lists(highs, lows, closes):
     if len(closes) < max(EMA_SLOW+5, ATR_LEN+5):
         return {"ok": False}
     ema_fast = _series_ema(closes, EMA_FAST)[-1]
@@ -85,7 +427,7 @@ def market_regime(core, market: str):
     return {"ok": True, "trend_up": trend_up, "rsi": rsi, "atr_pct": atr_pct, "adx": adx_val}
 
 def choose_tp_price(core, market: str, avg_price: float) -> tuple[float, dict]:
-    reg = market_regime(core, market)
+    reg = regime_cached(market) or market_regime(core, market)   # من آخر مسح دفعي إن لم يمضِ عليه أكثر من دورة مسح
     if not reg.get("ok"):
         pct = TP_MID_PCT
     else:
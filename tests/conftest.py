@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+# إعداد مشترك: استيراد main/strategy_base من جذر المستودع بلا إقلاع (watchdog/leases/بث/تحديث الأسواق) ولا شبكة،
+# ومقبس Bitvavo.websocket على FakeApp لاختبارات السدك
+
+import importlib, json, os, sys, threading, time, types
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("SAQER_BOOT", "0")
+os.environ.setdefault("BOOK_FEED", "0")
+os.environ.setdefault("MARKETS_REFRESH_SEC", "0")
+os.environ.setdefault("MARKETS_SNAPSHOT_FILE", "")
+os.environ.pop("REDIS_URL", None)
+
+# اختبارات السدك (python_bitvavo_api) لا تحتاج websocket-client/requests: وحدة فارغة مكان غير المثبّت
+for _name in ("websocket", "requests"):
+    try: importlib.import_module(_name)
+    except ImportError: sys.modules[_name] = types.ModuleType(_name)
+
+class FakeApp:
+    """WebSocketApp بلا شبكة: run_forever يفتح الاتصال ويبقى حتى drop()؛ sent = الإطارات المرسلة (JSON)."""
+    def __init__(self, url, on_message=None, on_error=None, on_close=None, on_open=None):
+        self.on_message, self.on_close, self.on_open = on_message, on_close, on_open
+        self.sent = []; self.ended = threading.Event()
+    def run_forever(self):
+        self.ended.clear(); self.on_open(self); self.ended.wait(); self.on_close(self, None, None)
+    def send(self, message): self.sent.append(json.loads(message))
+    def close(self): self.ended.set()
+    drop = close
+    def feed(self, obj): self.on_message(self, json.dumps(obj))
+    def frames(self, action): return [f for f in self.sent if f.get("action") == action]
+
+def _wait_for(cond, timeout=3.0):
+    deadline = time.time() + timeout
+    while not cond():
+        if time.time() > deadline: raise AssertionError("timeout")
+        time.sleep(0.01)
+
+@pytest.fixture
+def wait_for():
+    return _wait_for
+
+@pytest.fixture
+def sdk_socket(monkeypatch):
+    """make(**options) → Bitvavo.websocket متصل عبر FakeApp (ws.ws)؛ يُغلق بعد الاختبار."""
+    from python_bitvavo_api import bitvavo as bv
+    monkeypatch.setattr(bv, "websocket", types.SimpleNamespace(WebSocketApp=FakeApp, enableTrace=lambda on: None))
+    made = []
+    def make(**options):
+        ws = bv.Bitvavo(options).newWebsocket(); made.append(ws)
+        _wait_for(lambda: ws.open)
+        return ws
+    yield make
+    for ws in made: ws.closeSocket()
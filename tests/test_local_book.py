@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+# LocalBook في السدك مقابل دفتر مرجعي من dict: بروتوكول إعادة المزامنة (تخزين الأحداث أثناء اللقطة، فجوة nonce، لقطة قديمة)
+
+import random
+
+import pytest
+
+from python_bitvavo_api import bitvavo as bv
+
+M = "BTC-EUR"
+
+class RefBook:
+    """الدفتر المرجعي: price → size لكل جانب؛ size 0 = حذف."""
+    def __init__(self): self.bids, self.asks, self.nonce = {}, {}, 0
+    def update(self, bids, asks):
+        for side, rows in ((self.bids, bids), (self.asks, asks)):
+            for p, s in rows:
+                if float(s) > 0: side[p] = s
+                else: side.pop(p, None)
+    def view(self, depth=None):
+        bids = sorted(self.bids.items(), key=lambda r: -float(r[0]))[:depth]
+        asks = sorted(self.asks.items(), key=lambda r: float(r[0]))[:depth]
+        return [list(r) for r in bids], [list(r) for r in asks]
+    def snapshot(self):
+        bids, asks = self.view()
+        return {"market": M, "nonce": self.nonce, "bids": bids, "asks": asks}
+
+def _rows(rnd, lo, hi):
+    return [[f"{rnd.randint(lo, hi)}.0", "0" if rnd.random() < 0.3 else f"{rnd.randint(1, 9)}.5"] for _ in range(rnd.randint(1, 4))]
+
+def _event(ref, rnd):
+    """حدث book تالٍ (nonce+1) يُطبّق على المرجع."""
+    ref.nonce += 1
+    bids, asks = _rows(rnd, 90, 99), _rows(rnd, 101, 110)
+    ref.update(bids, asks)
+    return {"event": "book", "market": M, "nonce": ref.nonce, "bids": bids, "asks": asks}
+
+def _matches(book, ref):
+    bids, asks = ref.view()
+    return book["nonce"] == ref.nonce and book["bids"] == bids and book["asks"] == asks
+
+def test_resync_buffers_during_snapshot_and_recovers_from_gap(sdk_socket, wait_for):
+    rnd = random.Random(7); ref = RefBook(); got = []
+    for _ in range(50): _event(ref, rnd)
+    ws = sdk_socket()
+    ws.subscriptionBook(M, got.append)
+    app, book = ws.ws, ws.localBook[M]
+    assert len(app.frames("getBook")) == 1 and book["nonce"] is None
+
+    # الأحداث قبل وصول اللقطة تُخزَّن، واللقطة (أقدم منها) + الإعادة = المرجع
+    snap = ref.snapshot()
+    early = [_event(ref, rnd) for _ in range(20)]
+    for ev in early: app.feed(ev)
+    assert not got and len(book.buffer) == 20
+    app.feed({"action": "getBook", "response": snap})
+    assert _matches(book, ref) and book.stats["replayed"] == 20 and len(got) == 1
+
+    for _ in range(30): app.feed(_event(ref, rnd))
+    assert _matches(book, ref) and len(got) == 31
+
+    # فجوة: nonce مفقود → إبطال وطلب لقطة جديدة وتخزين ما بعدها
+    _event(ref, rnd)
+    for _ in range(5): app.feed(_event(ref, rnd))
+    assert book["nonce"] is None and book.stats["resyncs"] == 1 and len(app.frames("getBook")) == 2
+
+    # لقطة لا تكمل المخزّن (أقدم من الحدث المفقود) → فجوة أثناء الإعادة → لقطة ثالثة
+    app.feed({"action": "getBook", "response": {**snap, "nonce": ref.nonce - 10}})
+    assert book["nonce"] is None and len(app.frames("getBook")) == 3 and len(got) == 31
+
+    app.feed({"action": "getBook", "response": ref.snapshot()})
+    assert _matches(book, ref) and len(got) == 32
+    for _ in range(10): app.feed(_event(ref, rnd))
+    assert _matches(book, ref)
+
+def test_stale_snapshot_is_ignored(sdk_socket):
+    rnd = random.Random(3); ref = RefBook(); got = []
+    ws = sdk_socket()
+    ws.subscriptionBook(M, got.append)
+    app, book = ws.ws, ws.localBook[M]
+    old = ref.snapshot()
+    app.feed({"action": "getBook", "response": old})
+    for _ in range(10): app.feed(_event(ref, rnd))
+    delivered = len(got)
+
+    # كتاب صالح يتلقى لقطة أقدم أو مساوية: لا تحميل ولا تسليم، ويُحسب
+    app.feed({"action": "getBook", "response": old})
+    app.feed({"action": "getBook", "response": ref.snapshot()})
+    assert _matches(book, ref) and len(got) == delivered
+    assert book.stats["staleSnapshots"] == 2 and ws.bookStats()["staleSnapshots"] == 2
+
+    # بعد الإبطال تُقبل أي لقطة
+    book.invalidate()
+    app.feed({"action": "getBook", "response": old})
+    assert book["nonce"] == old["nonce"] and len(got) == delivered + 1
+
+def _apply_view(view, changes):
+    for side in ("bids", "asks"):
+        for p, s in changes[side]:
+            if float(s) > 0: view[side][p] = s
+            else: view[side].pop(p, None)
+
+@pytest.mark.parametrize("depth", [None, 3, 5])
+def test_book_and_change_views_match_reference(depth):
+    """خاصية: الدفتر الكامل = المرجع، وعرض changesOnly المبني من التغييرات وحدها = أعلى depth من المرجع."""
+    for seed in range(20):
+        rnd = random.Random(seed); ref = RefBook()
+        for _ in range(rnd.randint(0, 30)): _event(ref, rnd)
+        book = bv.LocalBook(M, depth, changesOnly=True)
+        assert book.sync(ref.snapshot())
+        first = book.snapshotChanges()
+        view = {"bids": {p: s for p, s in first["bids"]}, "asks": {p: s for p, s in first["asks"]}}
+        for i in range(300):
+            changes = book.apply(_event(ref, rnd))
+            _apply_view(view, changes)
+            bids, asks = ref.view(depth)
+            assert _matches(book, ref), (seed, i)
+            assert book.top(None)["bids"] == bids and book.top(None)["asks"] == asks, (seed, i)
+            assert sorted(view["bids"].items(), key=lambda r: -float(r[0])) == [tuple(r) for r in bids], (seed, i)
+            assert sorted(view["asks"].items(), key=lambda r: float(r[0])) == [tuple(r) for r in asks], (seed, i)
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+# fmt_price / fmt_amount / round_amount_down: جدول _PREC يطابق المسار المرجعي Decimal لكل قيمة
+
+import random
+from decimal import Decimal
+
+import pytest
+
+main = pytest.importorskip("main")
+
+_METAS = {
+    "DEC-EUR":  {"priceDecimals": 2, "priceSigDigits": None, "amountDecimals": 4, "step": 0.0005},
+    "DEC0-EUR": {"priceDecimals": 0, "priceSigDigits": None, "amountDecimals": 0, "step": 1.0},
+    "SIG-EUR":  {"priceDecimals": None, "priceSigDigits": 5, "amountDecimals": 8, "step": 1e-8},
+    "SIG1-EUR": {"priceDecimals": None, "priceSigDigits": 1, "amountDecimals": 3, "step": 0.001},
+    "LOT-EUR":  {"priceDecimals": None, "priceSigDigits": 6, "amountDecimals": 6, "step": 0.25},
+}
+_PAIRS = [("fmt_price", "_fmt_price_dec"), ("fmt_amount", "_fmt_amount_dec"),
+          ("round_amount_down", "_round_amount_down_dec")]
+
+@pytest.fixture(autouse=True)
+def markets(monkeypatch):
+    monkeypatch.setattr(main, "MARKET_META", dict(_METAS))
+    monkeypatch.setattr(main, "_PREC", {m: main._make_prec(v) for m, v in _METAS.items()})
+
+def _values(seed: int, n: int) -> list:
+    # مقادير من 1e-9 إلى 1e6، مع قيم على حدود الخانات (x.5, x.9999…, أعداد صحيحة، سالبة)
+    rnd = random.Random(seed); out = []
+    for _ in range(n):
+        r = rnd.random()
+        if r < 0.6: out.append(rnd.random() * 10 ** rnd.randint(-9, 6))
+        elif r < 0.75: out.append(round(rnd.uniform(0, 1000), rnd.randint(0, 9)))
+        elif r < 0.85: out.append(float(rnd.randint(0, 10 ** 6)))
+        elif r < 0.95: out.append(-rnd.random() * 10 ** rnd.randint(-4, 4))
+        else: out.append(rnd.randint(0, 10 ** 7))
+    return out
+
+@pytest.mark.parametrize("fast,ref", _PAIRS)
+@pytest.mark.parametrize("seed", range(4))
+def test_fast_path_matches_decimal(fast, ref, seed):
+    f, r = getattr(main, fast), getattr(main, ref)
+    for m in _METAS:
+        assert main._PREC[m] is not None
+        for v in _values(seed, 5000):
+            assert f(m, v) == r(m, v), (m, v)
+
+@pytest.mark.parametrize("fast,ref", _PAIRS)
+@pytest.mark.parametrize("v", [0, 0.0, 1e-12, 5e-324, 1e16, 0.1 + 0.2, 123456.789, 1e-5, 9.99999999])
+def test_edge_values(fast, ref, v):
+    f, r = getattr(main, fast), getattr(main, ref)
+    for m in _METAS:
+        assert f(m, v) == r(m, v), (m, v)
+
+@pytest.mark.parametrize("fast,ref", _PAIRS)
+def test_decimal_input_uses_reference(fast, ref):
+    f, r = getattr(main, fast), getattr(main, ref)
+    for m in _METAS:
+        d = Decimal("1234.56789012345")
+        assert f(m, d) == r(m, d)
+
+def test_market_without_table_falls_back(monkeypatch):
+    # step أدق من amountDecimals: لا جدول؛ كل الدوال تمر بالمسار المرجعي
+    meta = {"priceDecimals": 3, "priceSigDigits": None, "amountDecimals": 2, "step": 0.0001}
+    assert main._make_prec(meta) is None
+    main.MARKET_META["ODD-EUR"] = meta
+    for fast, ref in _PAIRS:
+        for v in _values(9, 500):
+            assert getattr(main, fast)("ODD-EUR", v) == getattr(main, ref)("ODD-EUR", v)
+
+@pytest.mark.parametrize("m", list(_METAS))
+def test_round_amount_down_is_on_step_and_not_above(m):
+    step = Decimal(str(_METAS[m]["step"]))
+    for v in _values(11, 3000):
+        if v < 0: continue
+        out = main.round_amount_down(m, v)
+        assert Decimal(str(out)) <= Decimal(str(v))
+        assert Decimal(str(out)) % step == 0
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+# مؤشرات strategy_base المتدفقة (Stream*/RegimeStream) مقابل الدوال الدفعية على نفس النافذة، وsnapshot/restore عبر JSON
+
+import json, random, threading, time
+
+import pytest
+
+import strategy_base as B
+
+REL = 1e-9
+
+def _series(n: int, seed: int):
+    rnd = random.Random(seed); c = 100.0; H, L, C = [], [], []
+    for _ in range(n):
+        c *= 1 + rnd.gauss(0, 0.003)
+        H.append(c * (1 + abs(rnd.gauss(0, 0.002)))); L.append(c * (1 - abs(rnd.gauss(0, 0.002)))); C.append(c)
+    return H, L, C
+
+def _close(got, exp):
+    if exp is None: return got is None
+    return got is not None and abs(got - exp) <= REL * max(1.0, abs(exp))
+
+@pytest.mark.parametrize("window", [None, 240, 60, 20])
+def test_stream_indicators_match_batch(window):
+    H, L, C = _series(700, seed=window or 1)
+    e, r = B.StreamEMA(B.EMA_FAST, window), B.StreamRSI(B.RSI_LEN)
+    a, x = B.StreamATR(B.ATR_LEN, window), B.StreamADX(B.ADX_LEN, window)
+    for i in range(len(C)):
+        lo = 0 if window is None else max(0, i + 1 - window)
+        h, l, c = H[lo:i + 1], L[lo:i + 1], C[lo:i + 1]
+        exp = {"ema": (B._series_ema(c, B.EMA_FAST) or [None])[-1], "rsi": B._rsi(c, B.RSI_LEN),
+               "atr": B._atr(h, l, c, B.ATR_LEN), "adx": B._adx(h, l, c, B.ADX_LEN)}
+        # peek قبل التثبيت = الدفعي بعد إضافة الشمعة
+        peek = {"ema": e.peek(C[i]), "rsi": r.peek(C[i]), "atr": a.peek(H[i], L[i], C[i]), "adx": x.peek(H[i], L[i], C[i])}
+        e.update(C[i]); r.update(C[i]); a.update(H[i], L[i], C[i]); x.update(H[i], L[i], C[i])
+        got = {"ema": e.value, "rsi": r.value, "atr": a.value, "adx": x.value}
+        for k in exp:
+            assert _close(got[k], exp[k]), (i, k, got[k], exp[k])
+            assert _close(peek[k], exp[k]), (i, k, "peek", peek[k], exp[k])
+
+@pytest.mark.parametrize("cls,args,feed", [
+    (B.StreamEMA, (B.EMA_FAST, 240), lambda s, h, l, c: s.update(c)),
+    (B.StreamRSI, (B.RSI_LEN,), lambda s, h, l, c: s.update(c)),
+    (B.StreamATR, (B.ATR_LEN, 240), lambda s, h, l, c: s.update(h, l, c)),
+    (B.StreamADX, (B.ADX_LEN, 240), lambda s, h, l, c: s.update(h, l, c)),
+])
+def test_snapshot_restore_roundtrip(cls, args, feed):
+    H, L, C = _series(500, seed=5)
+    a = cls(*args)
+    for i in range(300): feed(a, H[i], L[i], C[i])
+    b = cls(*args).restore(json.loads(json.dumps(a.snapshot())))
+    for i in range(300, 500):
+        assert feed(a, H[i], L[i], C[i]) == feed(b, H[i], L[i], C[i])
+
+class _Core:
+    """core.candles من سلسلة ثابتة؛ الشمعة t هي الجارية، والطوابع على ساعة حقيقية."""
+    def __init__(self, H, L, C):
+        self.H, self.L, self.C = H, L, C; self.t = 0; self.limits = []
+        self.t0 = (int(time.time()) // 60) * 60_000 - len(C) * 60_000
+    def ts(self, k): return self.t0 + k * 60_000
+    def candles(self, market, interval, limit):
+        self.limits.append(limit)
+        return [(self.ts(k), 0.0, self.H[k], self.L[k], self.C[k], 1.0) for k in range(self.t + 1)][-limit:]
+
+@pytest.fixture
+def core(monkeypatch):
+    monkeypatch.setattr(B, "_REGIMES", B.OrderedDict())
+    H, L, C = _series(600, seed=9)
+    c = _Core(H, L, C)
+    monkeypatch.setattr(B.time, "time", lambda: c.ts(c.t) / 1000.0 + 30.0)
+    return c
+
+def test_regime_stream_matches_batch_incrementally(core):
+    for t in range(300, 600):
+        core.t = t; core.limits.clear()
+        got, exp = B.market_regime(core, "A-EUR"), B.market_regime_batch(core, "A-EUR")
+        assert got["ok"] and exp["ok"] and got["trend_up"] == exp["trend_up"]
+        for k in ("rsi", "atr_pct", "adx"):
+            assert _close(got[k], exp[k]), (t, k)
+        if t > 300: assert core.limits[0] < 10   # النداء المتدفق طلب شموعاً قليلة فقط
+
+def test_regime_stream_catches_up_after_idle_minutes(core):
+    core.t = 300; B.market_regime(core, "A-EUR")
+    core.t = 345; core.limits.clear()   # 45 دقيقة بلا نداء: صفوف منذ آخر تغذية، لا إعادة بناء
+    got, exp = B.market_regime(core, "A-EUR"), B.market_regime_batch(core, "A-EUR")
+    assert core.limits[0] < 240
+    for k in ("rsi", "atr_pct", "adx"):
+        assert _close(got[k], exp[k]), k
+
+def test_regime_snapshot_restore(core):
+    core.t = 400; B.market_regime(core, "A-EUR")
+    rs = B._REGIMES[("A-EUR", "1m")]
+    rs2 = B.RegimeStream.restore(json.loads(json.dumps(rs.snapshot())))
+    h, l, c = core.H[400], core.L[400], core.C[400]
+    assert rs.peek(h, l, c) == rs2.peek(h, l, c)
+
+def test_regimes_are_bounded(core, monkeypatch):
+    monkeypatch.setattr(B, "REGIME_KEEP", 5)
+    core.t = 300
+    for i in range(12): B.market_regime(core, f"M{i}-EUR")
+    assert list(B._REGIMES) == [(f"M{i}-EUR", "1m") for i in range(7, 12)]
+
+def test_regime_stream_concurrent_feeders(core, monkeypatch):
+    """المسح الخلفي واختيار TP يغذّيان نفس الحالة معاً: كل شمعة تُغذّى مرة واحدة."""
+    update = B.RegimeStream.update
+    def slow_update(self, *a):
+        time.sleep(0.0005); update(self, *a)   # يوسّع نافذة التداخل بين الفحص والتغذية
+    monkeypatch.setattr(B.RegimeStream, "update", slow_update)
+    core.t = 300; B.market_regime(core, "A-EUR")
+    for t in range(301, 330, 4):
+        core.t = t
+        ts = [threading.Thread(target=B.market_regime, args=(core, "A-EUR")) for _ in range(4)]
+        for th in ts: th.start()
+        for th in ts: th.join()
+        rs = B._REGIMES[("A-EUR", "1m")]
+        assert rs.last_ts == core.ts(t - 1) and rs.n == 239 + (t - 300), t   # 239 من البناء الأول
+        got, exp = B.market_regime(core, "A-EUR"), B.market_regime_batch(core, "A-EUR")
+        for k in ("rsi", "atr_pct", "adx"):
+            assert _close(got[k], exp[k]), (t, k)
+
+def test_tp_regime_same_from_scan_cache_and_stream(core, monkeypatch):
+    """اختيار TP: نتيجة المسح الدفعي والحالة المتدفقة بنفس تعريف RSI؛ كاش أقدم من دورة مسح يُرفض."""
+    import strategy as S
+    monkeypatch.setattr(B, "REGIME_CACHE", {})
+    core.candles_peek = core.candles
+    for t in range(300, 420, 7):
+        core.t = t
+        B.REGIME_CACHE.clear(); stream_pct = S._choose_tp_pct(core, "A-EUR")
+        rs, cur = B.regime_stream(core, "A-EUR", "1m", 240)
+        B.regime_scan(core, ["A-EUR"]); reg = B.regime_cached("A-EUR")
+        assert reg and _close(reg["rsi"], rs.rsi.peek(cur[4])), t
+        assert S._choose_tp_pct(core, "A-EUR") == stream_pct, t
+    B.REGIME_CACHE["A-EUR"]["ts"] -= B._SCAN_EVERY[0] + 1
+    assert B.regime_cached("A-EUR") is None
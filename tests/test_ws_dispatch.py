@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+# جدول توزيع on_message (_ACTION_CALLBACKS/_eventHandlers، ومع callbackPool) مقابل سلسلة if/elif الأصلية:
+# نفس الـ callback بنفس الوسيط لكل action وحدث وإطار خطأ
+
+import json, time
+
+import pytest
+
+from python_bitvavo_api import bitvavo as bv
+
+M, N = "BTC-EUR", "ETH-EUR"
+
+def _legacy(ws, callbacks, msg):
+    """on_message قبل جدول التوزيع (بلا debug)، كما في الإصدار الأصلي."""
+    if 'error' in msg:
+        if msg['errorCode'] == 105:
+            ws.bitvavo.updateRateLimit(msg)
+        if 'error' in callbacks:
+            callbacks['error'](msg)
+    if 'action' in msg:
+        if msg['action'] in bv._ACTION_CALLBACKS:
+            callbacks[bv._ACTION_CALLBACKS[msg['action']]](msg['response'])
+        elif msg['action'] == 'getBook':
+            market = msg['response']['market']
+            if 'book' in callbacks:
+                callbacks['book'](msg['response'])
+            if ws.keepBookCopy and market in callbacks['subscriptionBook']:
+                callbacks['subscriptionBook'][market](ws, msg)
+    elif 'event' in msg:
+        e = msg['event']
+        if e == 'authenticate':
+            ws.authenticated = True
+        elif e in ('fill', 'order'):
+            callbacks['subscriptionAccount'][msg['market']](msg)
+        elif e == 'ticker':
+            callbacks['subscriptionTicker'][msg['market']](msg)
+        elif e == 'ticker24h':
+            for entry in msg['data']:
+                callbacks['subscriptionTicker24h'][entry['market']](entry)
+        elif e == 'candle':
+            callbacks['subscriptionCandles'][msg['market']][msg['interval']](msg)
+        elif e == 'book':
+            if msg['market'] in callbacks.get('subscriptionBookUpdate', {}):
+                callbacks['subscriptionBookUpdate'][msg['market']](msg)
+            if ws.keepBookCopy and msg['market'] in callbacks['subscriptionBook']:
+                callbacks['subscriptionBook'][msg['market']](ws, msg)
+        elif e == 'trade':
+            if 'subscriptionTrades' in callbacks:
+                callbacks['subscriptionTrades'][msg['market']](msg)
+
+def _frames():
+    out = [{"action": a, "response": {"a": a}} for a in bv._ACTION_CALLBACKS]
+    out += [{"action": "getBook", "response": {"market": M, "nonce": 1, "bids": [], "asks": []}},
+            {"action": "unknownAction", "response": {}},
+            {"event": "authenticate", "authenticated": True},
+            {"event": "fill", "market": M, "fillId": "f"}, {"event": "order", "market": N, "orderId": "o"},
+            {"event": "ticker", "market": M, "bestBid": "1"}, {"event": "ticker", "market": N, "bestBid": "2"},
+            {"event": "ticker24h", "data": [{"market": M, "x": 1}, {"market": N, "x": 2}]},
+            {"event": "candle", "market": M, "interval": "1m", "candle": [[1, "1", "1", "1", "1", "1"]]},
+            {"event": "candle", "market": M, "interval": "5m", "candle": []},
+            {"event": "book", "market": M, "nonce": 2, "bids": [], "asks": []},
+            {"event": "book", "market": "XRP-EUR", "nonce": 2, "bids": [], "asks": []},
+            {"event": "trade", "market": N, "id": "t"},
+            {"event": "subscribed", "subscriptions": {"ticker": [M, N]}},
+            {"event": "unknownEvent"},
+            {"errorCode": 205, "error": "bad"},
+            {"errorCode": 105, "error": f"Rate limit exceeded. Unbanned at {int(time.time() * 1000) + 3600000}."},
+            {"action": "privateCreateOrder", "errorCode": 216, "error": "insufficient balance"}]
+    return out
+
+def _callbacks(log):
+    rec = lambda name: (lambda arg: log.append((name, json.dumps(arg, sort_keys=True))))
+    return {**{name: rec(name) for name in set(bv._ACTION_CALLBACKS.values())},
+            "book": rec("book"), "error": rec("error"),
+            "subscriptionAccount": {M: rec("acct:" + M), N: rec("acct:" + N)},
+            "subscriptionTicker": {M: rec("tick:" + M), N: rec("tick:" + N)},
+            "subscriptionTicker24h": {M: rec("t24:" + M), N: rec("t24:" + N)},
+            "subscriptionCandles": {M: {"1m": rec("c1"), "5m": rec("c5")}},
+            "subscriptionBookUpdate": {M: rec("bookUpdate")},
+            "subscriptionBook": {M: lambda ws, msg: log.append(("localBook", json.dumps(msg, sort_keys=True)))},
+            "subscriptionTrades": {N: rec("trade")}}
+
+def _socket(decoder=None, workers=0):
+    ws = bv.Bitvavo.websocket.__new__(bv.Bitvavo.websocket)
+    ws.bitvavo = bv.Bitvavo({}); ws.keepBookCopy = True; ws.localBook = {}; ws.authenticated = False
+    ws.subscriptions = {}; ws.requestedSubs = {}; ws.pending = {}
+    ws.initDispatch(decoder, workers, 1 << 12)
+    return ws
+
+DECODERS = [None] + ([bv.orjson.loads] if bv.orjson is not None else [])
+
+@pytest.mark.parametrize("decoder", DECODERS)
+@pytest.mark.parametrize("workers", [0, 3])
+def test_dispatch_matches_legacy_chain(decoder, workers, wait_for):
+    want, got = [], []
+    old, new = _socket(), _socket(decoder, workers)
+    old.callbacks = _callbacks(want); new.callbacks = _callbacks(got)
+    for msg in _frames():
+        try: _legacy(old, old.callbacks, msg)
+        except KeyError: pass   # السلسلة القديمة تسقط بعد callback الخطأ لإطار خطأ يحمل action
+        new.on_message(None, json.dumps(msg))
+    if workers:   # المجمّع يحفظ الترتيب لكل مفتاح (سوق/action) لا بين المفاتيح
+        wait_for(lambda: len(got) >= len(want)); new.pool.close()
+        assert sorted(got) == sorted(want)
+    else:
+        assert got == want
+    assert {n for n, _ in want} >= set(bv._ACTION_CALLBACKS.values()) | {"error", "book", "localBook"}
+    assert new.authenticated and old.authenticated
+    assert new.bitvavo.rateLimitRemaining == old.bitvavo.rateLimitRemaining == 0
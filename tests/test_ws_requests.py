@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+# Bitvavo.websocket.requestFuture على FakeApp: ربط الأجوبة بـ requestId (خارج الترتيب)، المهلة، وfailPending عند الانقطاع
+
+import concurrent.futures
+
+import pytest
+
+from python_bitvavo_api import bitvavo as bv
+
+def _send(ws, n, timeout=None):
+    futs = [ws.requestFuture({"action": "getTime", "n": i}, timeout=timeout) for i in range(n)]
+    ids = [f["requestId"] for f in ws.ws.frames("getTime")[-n:]]
+    return futs, ids
+
+def test_out_of_order_responses_resolve_their_own_future(sdk_socket):
+    ws = sdk_socket(); errors = []
+    ws.setErrorCallback(errors.append)
+    futs, ids = _send(ws, 5)
+    assert len(set(ids)) == 5
+    for i in reversed(range(5)):
+        if i == 2:
+            ws.ws.feed({"action": "getTime", "requestId": ids[i], "errorCode": 205, "error": "bad"})
+        else:
+            ws.ws.feed({"action": "getTime", "requestId": ids[i], "response": {"n": i}})
+    for i, f in enumerate(futs):
+        if i == 2:
+            with pytest.raises(bv.requestError) as e: f.result(0)
+            assert e.value.errorCode == 205
+        else:
+            assert f.result(0) == {"n": i}
+    assert not ws.pending and not errors
+    # جواب متأخر لطلب محسوم أو مجهول يُسقط بلا callback
+    ws.ws.feed({"action": "getTime", "requestId": ids[0], "response": {"n": 99}})
+    ws.ws.feed({"action": "getTime", "requestId": 10 ** 6, "response": {}})
+    assert futs[0].result(0) == {"n": 0} and not errors
+
+def test_timeout(sdk_socket):
+    ws = sdk_socket()
+    (late,), (rid,) = _send(ws, 1, timeout=0.05)
+    with pytest.raises(concurrent.futures.TimeoutError): late.result(0.1)
+    # المنتهي يُحسم TimeoutError عند الطلب التالي ويخرج من pending؛ جوابه المتأخر لا يُطابق شيئاً
+    (nxt,), (nid,) = _send(ws, 1)
+    with pytest.raises(concurrent.futures.TimeoutError): late.result(0)
+    assert list(ws.pending) == [nid]
+    assert not ws.resolveRequest({"requestId": rid, "response": {}})
+    # مقبس غير مفتوح حتى المهلة: TimeoutError بلا إرسال
+    ws.open = False; sent = len(ws.ws.sent)
+    f = ws.requestFuture({"action": "getTime"}, timeout=0.1)
+    with pytest.raises(concurrent.futures.TimeoutError): f.result(0)
+    assert len(ws.ws.sent) == sent
+
+def test_fail_pending_on_disconnect(sdk_socket, wait_for):
+    ws = sdk_socket()
+    futs, _ = _send(ws, 3)
+    ws.ws.drop()
+    for f in futs:
+        with pytest.raises(ConnectionError): f.result(2)
+    assert not ws.pending
+    wait_for(lambda: ws.open and ws.connectCount == 2)
+    (f,), (rid,) = _send(ws, 1)
+    ws.ws.feed({"action": "getTime", "requestId": rid, "response": {"ok": 1}})
+    assert f.result(0) == {"ok": 1}
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+# اشتراكات Bitvavo.websocket على FakeApp: إطار واحد مجمّع، إعادة subscribe بلا جواب بعد subscribeTimeout، والمطابقة بعد إعادة الاتصال
+
+import time
+
+def _cb(msg): pass
+
+def _channels(frame):
+    return {(c["name"], tuple(c.get("interval", ())), tuple(c["markets"])) for c in frame["channels"]}
+
+def test_batch_sends_one_frame(sdk_socket):
+    ws = sdk_socket(); app = ws.ws
+    with ws.batchSubscriptions():
+        ws.subscriptionTicker(["B-EUR", "A-EUR"], _cb)
+        ws.subscriptionCandles("A-EUR", "1m", _cb)
+        ws.subscriptionTrades("C-EUR", _cb)
+        assert not app.frames("subscribe")
+    frames = app.frames("subscribe")
+    assert len(frames) == 1
+    assert _channels(frames[0]) == {("ticker", (), ("A-EUR", "B-EUR")), ("candles", ("1m",), ("A-EUR",)),
+                                    ("trades", (), ("C-EUR",))}
+    # كل شيء قيد الطلب: لا شيء ناقص
+    assert ws.reconcileSubscriptions(False) == ({}, {}) and len(app.frames("subscribe")) == 1
+
+def test_unanswered_subscribe_is_resent_after_timeout(sdk_socket):
+    ws = sdk_socket(); app = ws.ws; ws.subscribeTimeout = 0.2
+    with ws.batchSubscriptions():
+        ws.subscriptionTicker(["A-EUR", "B-EUR"], _cb)
+        ws.subscriptionTrades("C-EUR", _cb)
+    # الخادم أكّد ticker فقط؛ trades رُفض/ضاع
+    app.feed({"event": "subscribed", "subscriptions": {"ticker": ["A-EUR", "B-EUR"]}})
+    assert "ticker" not in ws.requestedSubs or not ws.requestedSubs["ticker"]
+    ws.reconcileSubscriptions(False)
+    assert len(app.frames("subscribe")) == 1   # ما زال في المهلة
+    time.sleep(0.25)
+    missing, _ = ws.reconcileSubscriptions(False)
+    assert missing == {"trades": {"C-EUR"}}
+    assert _channels(app.frames("subscribe")[-1]) == {("trades", (), ("C-EUR",))}
+    assert ws.subscriptionStatus() == {"desired": 3, "actual": 2, "missing": 0, "extra": 0}
+
+def test_reconnect_restores_every_subscription_in_one_frame(sdk_socket, wait_for):
+    ws = sdk_socket(); app = ws.ws
+    with ws.batchSubscriptions():
+        ws.subscriptionTicker(["A-EUR", "B-EUR"], _cb)
+        ws.subscriptionCandles("A-EUR", "5m", _cb)
+    app.feed({"event": "subscribed", "subscriptions": {"ticker": ["A-EUR", "B-EUR"], "candles": {"5m": ["A-EUR"]}}})
+    ws.unsubscribe("ticker", "B-EUR")
+    before = len(app.frames("subscribe"))
+
+    app.drop()   # on_close يمسح الاشتراكات الفعلية؛ receiveThread يعيد الاتصال وcheckReconnect يطابق
+    wait_for(lambda: len(app.frames("subscribe")) > before)
+    frames = app.frames("subscribe")[before:]
+    assert len(frames) == 1 and ws.connectCount == 2
+    assert _channels(frames[0]) == {("ticker", (), ("A-EUR",)), ("candles", ("5m",), ("A-EUR",))}